@@ -1,5 +1,6 @@
 from flask import Flask
 from flask_login import LoginManager
+from .cache import Cache
 from .config import Config
 from .db import DB
 
@@ -13,6 +14,7 @@ def create_app():
     app.config.from_object(Config)
 
     app.db = DB(app)
+    app.cache = Cache(app)
     login.init_app(app)
 
     from .index import bp as index_bp
@@ -30,4 +32,12 @@ def create_app():
     from .item import bp as item_bp
     app.register_blueprint(item_bp)
 
+    if app.config.get('CART_RESERVATION_SECONDS'):
+        from .models.reservation import start_sweeper
+        start_sweeper(app)
+
+    if app.config.get('SQL_PROFILE'):
+        from .sqlprofile import SQLProfiler
+        app.sql_profiler = SQLProfiler(app)
+
     return app
@@ -0,0 +1,248 @@
+"""Read-through cache for catalog data that is read far more than written.
+
+    @staticmethod
+    @cached('product.get_with_id', tags=('product:{id}',))
+    def get_with_id(id):
+        ...
+
+The key is the function name plus its (bound) arguments, so every
+filter/sort/page combination is its own entry. `tags` name what the
+entry depends on; they are formatted with the arguments. Writes call
+
+    app.cache.invalidate('catalog', f'product:{product_id}')
+
+which bumps the version of each tag. Entry keys embed the current tag
+versions, so bumping a tag makes every entry that carries it
+unreachable at once; the stale entries then age out of the LRU or
+expire. Tags are bumped immediately (so the writing request reads its
+own writes) and again once the transaction commits (so a reader that
+repopulated an entry from the pre-commit data in between loses it).
+
+Entries are stored pickled, so callers get their own copy and may
+mutate it freely.
+
+Backends (CACHE_BACKEND):
+
+* 'local' (default): in-process LRU with a TTL per entry. Each worker
+  process has its own cache and its own tag versions, so a write seen
+  by one worker reaches the others only when their entries expire.
+* 'redis': a shared Redis at CACHE_URL holds the entries and the tag
+  versions (so invalidation reaches every worker), with the local LRU
+  in front of it for entries this process has already seen. Needs the
+  `redis` package. Any object with the same get/get_many/set/incr
+  methods can be passed as `Cache(app, shared=...)` instead, e.g. a
+  LocalBackend standing in for Redis in development.
+* 'none': no caching; every call goes to the database.
+
+Hit, miss, eviction and invalidation counts are kept in `app.cache.stats`
+and exported at /metrics when SQL_PROFILE is on.
+"""
+import hashlib
+import inspect
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend:
+    """Thread-safe in-process LRU whose entries also expire after their TTL.
+
+    It implements the shared backend interface too (get_many, incr), so
+    it can stand in for Redis: Cache(app, shared=LocalBackend()).
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._counters = defaultdict(int)  # never evicted (tag versions)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_many(self, keys):
+        with self._lock:
+            counters = [self._counters.get(key) for key in keys]
+        return [value if value is not None else self.get(key) for key, value in zip(keys, counters)]
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] += 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared backend; entries expire through Redis' own TTLs."""
+
+    def __init__(self, url, prefix='mini-amazon:'):
+        import redis  # optional dependency, only needed for CACHE_BACKEND=redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def get_many(self, keys):
+        return self.client.mget([self.prefix + key for key in keys])
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+
+class Cache:
+    def __init__(self, app, shared=None):
+        self.enabled = app.config.get('CACHE_BACKEND', 'local') != 'none'
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', 300)
+        self.local = LocalBackend(app.config.get('CACHE_MAX_ENTRIES', 10000))
+        self.shared = shared
+        if shared is None and app.config.get('CACHE_BACKEND') == 'redis':
+            self.shared = RedisBackend(app.config['CACHE_URL'])
+        # name -> {'hits', 'misses', 'sets', 'errors'}
+        self.stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'sets': 0, 'errors': 0})
+        self.invalidations = defaultdict(int)  # tag -> times bumped
+        self._tag_versions = defaultdict(int)  # without a shared backend
+        self._lock = threading.Lock()
+
+    def _count(self, name, key):
+        with self._lock:
+            self.stats[name][key] += 1
+
+    def _versions(self, tags):
+        """Current version of each tag (0 if never bumped)."""
+        keys = [f'tag:{tag}' for tag in tags]
+        if self.shared is None:
+            return [self._tag_versions[key] for key in keys]
+        return [int(value or 0) for value in self.shared.get_many(keys)]
+
+    def version(self, tag):
+        """Current version of `tag`; changes whenever it is invalidated."""
+        return self._versions([tag])[0]
+
+    def key(self, name, arguments, tags):
+        """Cache key for `name` called with `arguments`, under the tags' current versions."""
+        digest = hashlib.sha1(repr(sorted(arguments.items())).encode()).hexdigest()[:16]
+        versions = '.'.join(str(v) for v in self._versions(tags))
+        return f'{name}:{digest}:{versions}'
+
+    def get_or_compute(self, name, arguments, tags, compute, ttl=None):
+        if not self.enabled:
+            return compute()
+        try:
+            key = self.key(name, arguments, tags)
+            raw = self.local.get(key)
+            if raw is None and self.shared is not None:
+                raw = self.shared.get(key)
+                if raw is not None:
+                    self.local.set(key, raw, ttl or self.default_ttl)
+        except Exception:
+            # A cache outage degrades to uncached reads
+            logger.exception('cache lookup failed for %s', name)
+            self._count(name, 'errors')
+            return compute()
+
+        if raw is not None:
+            self._count(name, 'hits')
+            return pickle.loads(raw)
+
+        self._count(name, 'misses')
+        value = compute()
+        raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            self.local.set(key, raw, ttl or self.default_ttl)
+            if self.shared is not None:
+                self.shared.set(key, raw, ttl or self.default_ttl)
+            self._count(name, 'sets')
+        except Exception:
+            logger.exception('cache store failed for %s', name)
+            self._count(name, 'errors')
+        # Hand back a copy, as a hit would: callers see the same object
+        # shape (and pickle it the same way, see httpcache) either way
+        return pickle.loads(raw)
+
+    def _bump(self, tags):
+        for tag in tags:
+            try:
+                if self.shared is not None:
+                    self.shared.incr(f'tag:{tag}')
+                else:
+                    with self._lock:
+                        self._tag_versions[f'tag:{tag}'] += 1
+            except Exception:
+                logger.exception('cache invalidation failed for tag %s', tag)
+            with self._lock:
+                self.invalidations[tag] += 1
+
+    def invalidate(self, *tags):
+        """Make every entry carrying any of `tags` unreachable, now and at commit."""
+        if not self.enabled:
+            return
+        self._bump(tags)
+        current_app.db.after_commit(lambda: self._bump(tags))
+
+    def clear(self):
+        self.local.clear()
+
+    def snapshot(self):
+        """Counters for /metrics and /debug/sql."""
+        with self._lock:
+            return {
+                'entries': len(self.local),
+                'evictions': self.local.evictions,
+                'expirations': self.local.expirations,
+                'calls': {name: dict(stats) for name, stats in self.stats.items()},
+                'invalidations': dict(self.invalidations),
+            }
+
+
+def cached(name, tags=(), ttl=None):
+    """Decorator: serve the function's result from app.cache (see module docstring)."""
+    def decorate(fn):
+        signature = inspect.signature(fn)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            return current_app.cache.get_or_compute(
+                name, arguments, [tag.format(**arguments) for tag in tags],
+                lambda: fn(*args, **kwargs), ttl)
+        return wrapper
+    return decorate
@@ -8,12 +8,21 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 
 from .models.cart import Cart
-from .models.purchase import Purchase
+from .models.purchase import OutOfStock, Purchase
+from .models.reservation import StockReservation
 from .models.user import User
 
 bp = Blueprint('cart', __name__)
 
 
+def _hold_stock():
+    """Re-hold the cart's stock after a change, when reservations are on
+    (CART_RESERVATION_SECONDS). Returns the lines that could not be held."""
+    if not StockReservation.enabled():
+        return []
+    return StockReservation.hold_cart(current_user.id)
+
+
 @bp.route('/cart')
 @login_required
 def view_cart():
@@ -21,12 +30,84 @@ def view_cart():
 
     Aggregates formatted items, totals and user balance for rendering.
     """
-    uid = current_user.id
-    items = Cart.format_cart_items(uid)
-    total = Cart.get_cart_total(uid)
-    count = Cart.get_cart_item_count(uid)
+    summary = Cart.summary(current_user.id)
     balance = current_user.balance
-    return render_template('cart.html', items=items, total=total, count=count, balance=balance)
+    return render_template('cart.html', items=summary['items'], total=summary['total'],
+                           count=summary['count'], balance=balance)
+
+
+@bp.route('/cart/summary')
+@login_required
+def cart_summary():
+    """Item count and total of the current user's cart as JSON.
+
+    Used by the cart badge in the page header. Pass `items=1` to also
+    get the lines.
+    """
+    summary = Cart.summary(current_user.id)
+    response = jsonify(_summary_json(summary, items=bool(request.args.get('items'))))
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
+
+def _summary_json(summary, items=False):
+    body = {
+        'count': summary['count'],
+        'lines': len(summary['items']),
+        'total': str(summary['total']),
+    }
+    if items:
+        body['items'] = [dict(it, price=str(it['price']), subtotal=str(it['subtotal']))
+                         for it in summary['items']]
+    return body
+
+
+# Most operations one /cart/batch request may carry
+BATCH_MAX_OPS = 500
+
+
+@bp.route('/cart/batch', methods=['POST'])
+@login_required
+def cart_batch():
+    """Apply several cart changes in one request and one transaction.
+
+    Expects JSON ``{"ops": [{"op": "add"|"set"|"remove", "product_id": ..,
+    "seller_id": .., "quantity": ..}, ...]}``; a bare list of ops works
+    too. `seller_id` may be omitted for "add" (a seller with stock is
+    picked). Ops apply in order. Responds with the resulting cart (as
+    /cart/summary?items=1) and any ops skipped because the product is
+    not offered by that seller.
+    """
+    data = request.get_json(silent=True)
+    raw_ops = data.get('ops') if isinstance(data, dict) else data
+    if not isinstance(raw_ops, list) or not raw_ops:
+        return jsonify({'error': 'expected a non-empty list of ops'}), 400
+    if len(raw_ops) > BATCH_MAX_OPS:
+        return jsonify({'error': f'at most {BATCH_MAX_OPS} ops per batch'}), 400
+
+    ops = []
+    for index, raw in enumerate(raw_ops):
+        try:
+            op = raw['op']
+            if op not in Cart.BATCH_OPS:
+                raise ValueError(op)
+            sid_raw = raw.get('seller_id')
+            sid = None if sid_raw in (None, '') else int(sid_raw)
+            qty = int(raw.get('quantity', 1 if op == 'add' else 0))
+            if sid is None and op != 'add':
+                raise ValueError('seller_id')
+            if qty < (1 if op == 'add' else 0):
+                raise ValueError('quantity')
+            ops.append({'op': op, 'product_id': int(raw['product_id']), 'seller_id': sid, 'quantity': qty})
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return jsonify({'error': f'invalid op at index {index}'}), 400
+
+    summary, skipped = Cart.apply_batch(current_user.id, ops)
+    unreserved = _hold_stock()
+    return jsonify({'ok': True, 'applied': len(ops) - len(skipped), 'skipped': skipped,
+                    'unreserved': [{'product_id': pid, 'seller_id': sid} for pid, sid in unreserved],
+                    'cart': _summary_json(summary, items=True)})
 
 
 @bp.route('/cart/add', methods=['POST'])
@@ -35,8 +116,8 @@ def add_to_cart():
     """Add a product to the current user's cart.
 
     Accepts JSON or form data with `product_id`, optional `seller_id`,
-    and optional `quantity`. If `seller_id` is omitted, a default seller
-    is selected from inventory.
+    and optional `quantity`. If `seller_id` is omitted, the cheapest seller
+    with stock is used (Cart.get_default_seller, shared with /cart/batch).
     """
 
     data = request.get_json(silent=True) or request.form
@@ -63,11 +144,15 @@ def add_to_cart():
 
     # Persist the cart change.
     Cart.add_item(current_user.id, pid, sid, qty)
+    reserved = (pid, sid) not in _hold_stock()
 
     if request.is_json:
-        return jsonify({'ok': True})
+        return jsonify({'ok': True, 'reserved': reserved})
 
-    flash('Item added to cart')
+    if reserved:
+        flash('Item added to cart')
+    else:
+        flash('Item added to cart, but other buyers are holding the remaining stock')
     return redirect(request.referrer or url_for('index.index'))
 
 
@@ -88,6 +173,7 @@ def update_cart():
         return redirect(request.referrer or url_for('cart.view_cart'))
 
     result = Cart.update_item(current_user.id, pid, sid, qty)
+    _hold_stock()
 
     if request.is_json:
         return jsonify({'ok': True, 'quantity': result})
@@ -112,6 +198,7 @@ def remove_from_cart():
         return redirect(request.referrer or url_for('cart.view_cart'))
 
     deleted = Cart.remove_item(current_user.id, pid, sid)
+    _hold_stock()
 
     if request.is_json:
         return jsonify({'ok': bool(deleted)})
@@ -134,8 +221,13 @@ def purchase():
         flash('Please provide a shipping address')
         return redirect(url_for('cart.view_cart'))
 
-    purchase = Purchase.create_from_cart(current_user.id, address)
-    
+    try:
+        purchase = Purchase.create_from_cart(current_user.id, address)
+    except OutOfStock as e:
+        names = ', '.join(line['product_name'] for line in e.lines)
+        flash(f'Not enough stock left for: {names}. Please adjust your cart.', 'error')
+        return redirect(url_for('cart.view_cart'))
+
     if purchase is None:
         flash('Unable to create purchase - cart may be empty or insufficient balance', 'error')
         return redirect(url_for('cart.view_cart'))
@@ -2,6 +2,13 @@ import os
 from urllib.parse import quote_plus
 
 
+def _env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = 'postgresql://{}:{}@{}:{}/{}'\
@@ -11,3 +18,56 @@ class Config(object):
                 os.environ.get('DB_PORT'),
                 os.environ.get('DB_NAME'))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Retries for SERIALIZABLE transactions (see app.db.transactional)
+    DB_RETRY_ATTEMPTS = int(os.environ.get('DB_RETRY_ATTEMPTS', 5))
+    DB_RETRY_BASE_DELAY = float(os.environ.get('DB_RETRY_BASE_DELAY', 0.01))
+    DB_RETRY_MAX_DELAY = float(os.environ.get('DB_RETRY_MAX_DELAY', 0.5))
+
+    # Connection pool (ignored when DB_PGBOUNCER is set; PgBouncer pools instead)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = _env_flag('DB_POOL_PRE_PING', True)
+    # Log a warning when checking out a connection takes longer than this (seconds)
+    DB_POOL_WARN_WAIT = float(os.environ.get('DB_POOL_WARN_WAIT', 0.1))
+
+    # Server-side timeouts in milliseconds (0 disables)
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 15000))
+    DB_IDLE_IN_TRANSACTION_TIMEOUT = int(os.environ.get('DB_IDLE_IN_TRANSACTION_TIMEOUT', 60000))
+
+    # Connect through a local PgBouncer running in transaction pooling mode
+    DB_PGBOUNCER = _env_flag('DB_PGBOUNCER')
+
+    # Catalog read cache (see app/cache.py): 'local', 'redis' or 'none'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local')
+    CACHE_URL = os.environ.get('CACHE_URL', 'redis://localhost:6379/0')
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+
+    # How long (seconds) the logged-in user's identity is trusted from the
+    # session before Users is read again (see User.load). Only used with
+    # CACHE_BACKEND=redis: the invalidation that makes it safe has to reach
+    # every worker, so with the in-process cache Users is read every request
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+
+    # Hold cart lines' stock for this many seconds after each cart change
+    # (0 = off; stock is then only checked at checkout), and how often
+    # expired holds are deleted (see app/models/reservation.py)
+    CART_RESERVATION_SECONDS = int(os.environ.get('CART_RESERVATION_SECONDS', 0))
+    CART_RESERVATION_SWEEP_SECONDS = int(os.environ.get('CART_RESERVATION_SWEEP_SECONDS', 60))
+
+    # Cache-Control max-age (seconds) for anonymous catalog pages (see app/httpcache.py)
+    HTTP_CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE', 30))
+
+    # Per-request SQL instrumentation: response headers, /debug/sql, /metrics
+    # (see app/sqlprofile.py). Exposes query text, so keep it off in production
+    # unless those routes are firewalled. Outside debug mode the two routes
+    # answer only the client addresses in SQL_PROFILE_ALLOW (comma-separated,
+    # e.g. a Prometheus scraper).
+    SQL_PROFILE = _env_flag('SQL_PROFILE')
+    SQL_PROFILE_ALLOW = [a.strip() for a in os.environ.get('SQL_PROFILE_ALLOW', '').split(',') if a.strip()]
+    SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+    SQL_SLOW_QUERY_MS = float(os.environ.get('SQL_SLOW_QUERY_MS', 0))
+    SQL_PROFILE_HISTORY = int(os.environ.get('SQL_PROFILE_HISTORY', 50))
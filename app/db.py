@@ -1,13 +1,442 @@
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, request, session
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATEs that mean "run the whole transaction again":
+# serialization_failure and deadlock_detected.
+RETRYABLE_SQLSTATES = {'40001', '40P01'}
+
+
+def is_serialization_failure(exc):
+    """True if `exc` is a serialization failure or deadlock worth retrying."""
+    orig = getattr(exc, 'orig', None)
+    code = getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+    return code in RETRYABLE_SQLSTATES
+
+
+def transactional(name=None, isolation_level=None, read_only=False, deferrable=False):
+    """Decorator: run the function in its own retried transaction.
+
+    Serialization failures and deadlocks re-run the whole function with
+    exponential backoff. Called inside another transactional block it
+    simply joins that block, which then owns the retries.
+
+        @staticmethod
+        @transactional('cart.add_item')
+        def add_item(...):
+            ...
+
+    Inside a request, blocks without options (and read-only ones once the
+    request has a transaction open) join the request's unit of work
+    instead: nothing is committed until the view returns, and a
+    serialization failure re-runs the whole view (see DB._retry_requests).
+    Blocks that write with their own isolation level (checkout, holds,
+    fulfillment) still get their own transaction, so the request's work
+    up to that point is committed first and a later failure in the view
+    does not undo it; such a view is not re-run either, as its committed
+    work would be repeated.
+    """
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            return current_app.db.run_in_transaction(
+                fn, args, kwargs, name=label,
+                isolation_level=isolation_level,
+                read_only=read_only, deferrable=deferrable)
+        return wrapper
+    return decorate
+
+
+class _UnitOfWork:
+    """One pooled connection and the transaction open on it."""
+
+    def __init__(self, db, request_scoped=False, options=None):
+        self.conn = db._connect()
+        if options:
+            self.conn.execution_options(**options)
+        self.trans = self.conn.begin()
+        db._prepare(self.conn)
+        self.request_scoped = request_scoped
+        self.read_only = bool(options and options.get('postgresql_readonly'))
+        self.on_commit = []
+
+    def commit(self):
+        if self.trans.is_active:
+            self.trans.commit()
+            if not self.read_only and has_request_context():
+                # The view can no longer be re-run without repeating this.
+                g._db_committed = True
+            callbacks, self.on_commit = self.on_commit, []
+            for callback in callbacks:
+                callback()
+
+    def close(self):
+        try:
+            if self.trans.is_active:
+                self.trans.rollback()
+        finally:
+            self.conn.close()
+
+
+class _Attempt:
+    """Context manager for one try of a retried transaction (see DB.attempts)."""
+
+    def __init__(self, db, label, number, options):
+        self.db = db
+        self.label = label
+        self.number = number
+        self.options = options
+        self.done = False
+
+    def __enter__(self):
+        self._prev = g.get('_db_uow')
+        self._uow = g._db_uow = _UnitOfWork(self.db, options=self.options)
+        return self._uow.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        commit_error = None
+        try:
+            if exc_type is None:
+                try:
+                    self._uow.commit()
+                except DBAPIError as e:
+                    commit_error = exc = e
+        finally:
+            if self._prev is None:
+                g.pop('_db_uow', None)
+            else:
+                g._db_uow = self._prev
+            self._uow.close()
+
+        if exc is None:
+            self.done = True
+            return False
+        if not isinstance(exc, DBAPIError) or not is_serialization_failure(exc):
+            self.done = True
+            if commit_error is not None:
+                raise commit_error
+            return False
+        if self.number >= self.db.retry_attempts:
+            self.done = True
+            self.db._count(self.label, 'failures')
+            if commit_error is not None:
+                raise commit_error
+            return False
+
+        self.db._count(self.label, 'retries')
+        time.sleep(self.db._backoff(self.number))
+        return True
 
-from sqlalchemy import text
 
 class DB:
     def __init__(self, app):
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        statement_timeout = app.config.get('DB_STATEMENT_TIMEOUT', 0)
+        idle_timeout = app.config.get('DB_IDLE_IN_TRANSACTION_TIMEOUT', 0)
+        self.pool_warn_wait = app.config.get('DB_POOL_WARN_WAIT', 0.1)
+        self._settings = {}
+        connect_args = {}
+        if make_url(uri).get_driver_name() == 'psycopg':
+            # Server-side prepared statements don't survive PgBouncer
+            # handing our transactions to different server connections.
+            connect_args['prepare_threshold'] = None
+
+        if app.config.get('DB_PGBOUNCER'):
+            # PgBouncer (transaction mode) does the pooling and rejects
+            # startup options, so settings are applied per transaction.
+            pool_args = {'poolclass': NullPool}
+            if statement_timeout:
+                self._settings['statement_timeout'] = str(statement_timeout)
+            if idle_timeout:
+                self._settings['idle_in_transaction_session_timeout'] = str(idle_timeout)
+        else:
+            pool_args = {
+                'pool_size': app.config.get('DB_POOL_SIZE', 5),
+                'max_overflow': app.config.get('DB_MAX_OVERFLOW', 10),
+                'pool_timeout': app.config.get('DB_POOL_TIMEOUT', 30),
+                'pool_recycle': app.config.get('DB_POOL_RECYCLE', -1),
+                'pool_pre_ping': app.config.get('DB_POOL_PRE_PING', False),
+            }
+            options = []
+            if statement_timeout:
+                options.append(f'-c statement_timeout={statement_timeout}')
+            if idle_timeout:
+                options.append(f'-c idle_in_transaction_session_timeout={idle_timeout}')
+            if options:
+                connect_args['options'] = ' '.join(options)
+
+        self._settings_stmt = text('SELECT ' + ', '.join(
+            f"set_config('{name}', :{name}, true)" for name in self._settings))
         self.engine = create_engine(
-            app.config['SQLALCHEMY_DATABASE_URI'],
-            execution_options={"isolation_level": "SERIALIZABLE"}
+            uri,
+            connect_args=connect_args,
+            execution_options={"isolation_level": "SERIALIZABLE"},
+            **pool_args
         )
+        self.retry_attempts = app.config.get('DB_RETRY_ATTEMPTS', 5)
+        self.retry_base_delay = app.config.get('DB_RETRY_BASE_DELAY', 0.01)
+        self.retry_max_delay = app.config.get('DB_RETRY_MAX_DELAY', 0.5)
+        # call site -> {'attempts', 'retries', 'failures'}
+        self.retry_stats = defaultdict(lambda: {'attempts': 0, 'retries': 0, 'failures': 0})
+        self._stats_lock = threading.Lock()
+        # Set by app.sqlprofile.SQLProfiler when SQL_PROFILE is on
+        self.profiler = None
+
+        # Every statement issued while handling a request shares one
+        # connection/transaction; it is committed once the view returns
+        # (re-running the view on a serialization failure) and released
+        # (rolled back if still open) at teardown.
+        app.after_request(self._commit_request)
+        app.teardown_request(self._release_request)
+        app.dispatch_request = self._retry_requests(app.dispatch_request)
+
+    def _connect(self):
+        """Check out a pooled connection, logging a warning if the pool made us wait."""
+        started = time.monotonic()
+        conn = self.engine.connect()
+        waited = time.monotonic() - started
+        if waited > self.pool_warn_wait:
+            logger.warning('waited %.3fs for a database connection (%s)',
+                           waited, self.pool_status())
+        return conn
+
+    def _prepare(self, conn):
+        """Apply per-transaction settings (PgBouncer mode only)."""
+        if self._settings:
+            conn.execute(self._settings_stmt, self._settings)
+
+    def pool_status(self):
+        """Human-readable pool occupancy, e.g. for logs and debug pages."""
+        return self.engine.pool.status()
+
+    def _current(self):
+        """Return the request's unit of work, checking out a connection lazily."""
+        uow = g.get('_db_uow')
+        if uow is None:
+            uow = g._db_uow = _UnitOfWork(self, request_scoped=True)
+        return uow
+
+    def _discard(self, uow):
+        """Roll back and forget a unit of work after a failed statement."""
+        if g.get('_db_uow') is uow:
+            g.pop('_db_uow')
+        uow.close()
+
+    def _commit_request(self, response):
+        uow = g.pop('_db_uow', None)
+        if uow is not None:
+            try:
+                uow.commit()
+            finally:
+                uow.close()
+        return response
+
+    def _release_request(self, exc=None):
+        uow = g.pop('_db_uow', None)
+        if uow is not None:
+            uow.close()
+
+    def _finish_request_work(self):
+        """Commit and release the request's unit of work, if one is open.
+
+        Called before a transaction with its own connection starts, so a
+        request never holds two pooled connections (the request's one
+        would otherwise sit idle in transaction meanwhile). Statements
+        after that block open a fresh request unit of work.
+        """
+        uow = g.get('_db_uow')
+        if uow is not None and uow.request_scoped:
+            g.pop('_db_uow')
+            try:
+                uow.commit()
+            finally:
+                uow.close()
+
+    def _retry_requests(self, dispatch):
+        """Wrap `app.dispatch_request` so a serialization failure or deadlock
+        in the request's unit of work re-runs the view, with backoff.
+
+        The request's transaction is committed here, once the view returns,
+        so failures at commit are retried too. A view that already
+        committed something of its own (see `transactional`) is not re-run.
+        Flashed messages are reset between tries so they are not repeated.
+        """
+        @wraps(dispatch)
+        def wrapper():
+            flashes = list(session.get('_flashes', ()))
+            number = 0
+            while True:
+                number += 1
+                try:
+                    rv = dispatch()
+                    self._finish_request_work()
+                    return rv
+                except DBAPIError as e:
+                    if not is_serialization_failure(e) or g.get('_db_committed'):
+                        raise
+                    self._release_request()
+                    label = f'request {request.endpoint}'
+                    if number >= self.retry_attempts:
+                        self._count(label, 'failures')
+                        raise
+                    self._count(label, 'retries')
+                    if flashes:
+                        session['_flashes'] = list(flashes)
+                    else:
+                        session.pop('_flashes', None)
+                    time.sleep(self._backoff(number))
+        return wrapper
+
+    def _joins_request(self, options):
+        """True if a block with `options` should run in the request's unit of work.
+
+        Read-only blocks only read, which the request's SERIALIZABLE
+        transaction does at least as safely, so once one is open they join
+        it rather than commit it early; before that they get their own
+        transaction at no extra cost.
+        """
+        if not has_request_context():
+            return False
+        if not options:
+            return True
+        return bool(options.get('postgresql_readonly')) and g.get('_db_uow') is not None
+
+    @staticmethod
+    def _options(isolation_level, read_only, deferrable):
+        options = {}
+        if isolation_level:
+            options['isolation_level'] = isolation_level
+        if read_only:
+            options['postgresql_readonly'] = True
+        if deferrable:
+            options['postgresql_deferrable'] = True
+        return options
+
+    def _count(self, label, key):
+        with self._stats_lock:
+            self.retry_stats[label][key] += 1
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff, in seconds, after `attempt` failed."""
+        cap = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, cap)
+
+    @contextmanager
+    def transaction(self, isolation_level=None, read_only=False, deferrable=False):
+        """Run every `execute` inside the block on one connection and transaction.
+
+        Inside a request the block joins the request-scoped unit of work,
+        which commits when the view returns; outside a request the block
+        owns its transaction and commits on exit. Either way an exception
+        escaping the block rolls back everything done so far.
+
+            with app.db.transaction():
+                app.db.execute(...)
+                app.db.execute(...)
+
+        Passing an isolation level or read_only/deferrable opens a separate
+        transaction with those settings for just this block (e.g. READ
+        COMMITTED catalog reads), unless an explicit transaction is
+        already open, in which case the block joins it. Inside a request,
+        read-only blocks join the request's transaction if it has one
+        (see `_joins_request`); otherwise work the request has done so far
+        is committed first and its connection released.
+        """
+        options = self._options(isolation_level, read_only, deferrable)
+        uow = g.get('_db_uow')
+
+        if uow is not None and not uow.request_scoped:
+            # Nested inside an explicit transaction: the outermost one commits.
+            yield uow.conn
+            return
+
+        if self._joins_request(options):
+            uow = self._current()
+            try:
+                yield uow.conn
+            except BaseException:
+                self._discard(uow)
+                raise
+            return
+
+        self._finish_request_work()
+        uow = g._db_uow = _UnitOfWork(self, options=options)
+        try:
+            yield uow.conn
+            uow.commit()
+        finally:
+            g.pop('_db_uow', None)
+            uow.close()
+
+    def attempts(self, name, isolation_level=None, read_only=False, deferrable=False):
+        """Yield transaction blocks until one commits without a serialization failure.
+
+            for attempt in app.db.attempts('cart.merge'):
+                with attempt:
+                    app.db.execute(...)
+
+        Each block owns a fresh transaction; a serialization failure or
+        deadlock (in the body or at commit) rolls it back, sleeps with
+        backoff and yields the next attempt, up to `DB_RETRY_ATTEMPTS`.
+        Inside another explicit transaction the block just joins it, once.
+        Inside a request, blocks that `_joins_request` run once in the
+        request's transaction, which the request retries as a whole; for
+        the rest, work the request has done so far is committed first so
+        that a retry only replays the block and the request never holds a
+        second connection.
+        """
+        options = self._options(isolation_level, read_only, deferrable)
+        uow = g.get('_db_uow')
+
+        if uow is not None and not uow.request_scoped:
+            yield self.transaction()
+            return
+
+        if self._joins_request(options):
+            yield self.transaction()
+            return
+
+        self._finish_request_work()
+
+        number = 0
+        while True:
+            number += 1
+            self._count(name, 'attempts')
+            attempt = _Attempt(self, name, number, options)
+            yield attempt
+            if attempt.done:
+                return
+
+    def after_commit(self, callback):
+        """Call `callback()` once the open transaction commits (right away if
+        none is open). Dropped if the transaction rolls back; a retried
+        attempt registers its callbacks again as it re-runs."""
+        uow = g.get('_db_uow') if has_app_context() else None
+        if uow is None:
+            callback()
+        else:
+            uow.on_commit.append(callback)
+
+    def run_in_transaction(self, fn, args=(), kwargs=None, name=None, **options):
+        """Call `fn(*args, **kwargs)` inside `attempts()`, returning its result."""
+        for attempt in self.attempts(name or fn.__qualname__, **options):
+            with attempt:
+                result = fn(*args, **(kwargs or {}))
+        return result
 
     def execute(self, sqlstr, params=None, **kwargs):
         """
@@ -21,22 +450,79 @@ class DB:
           db.execute(sql, (seller_id,))           # positional
           db.execute(sql, {'seller_id': id})      # dict
           db.execute(sql, seller_id=id)           # kwargs
+
+        Within a request or a `transaction()` block the statement runs on
+        the shared connection; otherwise it runs in its own transaction.
+        A failing statement inside a request rolls back the shared
+        transaction, so later statements start over on a fresh one.
         """
         stmt = text(sqlstr)
 
-        with self.engine.begin() as conn:
-            # Prefer explicit params argument first
-            if params is not None:
-                # params might be a dict or a tuple/list
-                result = conn.execute(stmt, params)
-            elif kwargs:
-                # named params passed as keywords
-                result = conn.execute(stmt, kwargs)
-            else:
-                # no params
-                result = conn.execute(stmt)
+        if has_request_context():
+            uow = self._current()
+        else:
+            uow = g.get('_db_uow') if has_app_context() else None
+        if uow is None:
+            with self._connect() as conn, conn.begin():
+                self._prepare(conn)
+                return self._profiled(conn, stmt, params, kwargs)
 
-            if result.returns_rows:
-                return result.fetchall()
-            else:
-                return result.rowcount
+        try:
+            return self._profiled(uow.conn, stmt, params, kwargs)
+        except Exception:
+            if uow.request_scoped:
+                self._discard(uow)
+            raise
+
+    def stream(self, sqlstr, params=None, batch_size=1000, **kwargs):
+        """Yield the rows of a large query without holding them all in memory.
+
+        Rows come from a server-side cursor, `batch_size` at a time, on a
+        connection of its own in one REPEATABLE READ read-only transaction,
+        so the result is a consistent snapshot however long the caller
+        takes to consume it (e.g. a streamed download). The connection is
+        returned to the pool when the generator is exhausted or closed.
+        Inside a request, work the request has done so far is committed
+        first, so the request never holds a second connection.
+        """
+        stmt = text(sqlstr)
+        if has_request_context():
+            self._finish_request_work()
+        with self._connect() as conn:
+            conn.execution_options(isolation_level='REPEATABLE READ', postgresql_readonly=True,
+                                   stream_results=True, yield_per=batch_size)
+            with conn.begin():
+                self._prepare(conn)
+                yield from conn.execute(stmt, params if params is not None else kwargs)
+
+    def _profiled(self, conn, stmt, params, kwargs):
+        """_run, reporting the statement to the profiler during requests."""
+        if self.profiler is None or not has_request_context():
+            return self._run(conn, stmt, params, kwargs)
+        started = time.perf_counter()
+        rows = None
+        try:
+            result = self._run(conn, stmt, params, kwargs)
+            rows = len(result) if isinstance(result, list) else result
+            return result
+        finally:
+            self.profiler.record(stmt.text, params if params is not None else kwargs,
+                                 time.perf_counter() - started, rows)
+
+    @staticmethod
+    def _run(conn, stmt, params, kwargs):
+        # Prefer explicit params argument first
+        if params is not None:
+            # params might be a dict or a tuple/list
+            result = conn.execute(stmt, params)
+        elif kwargs:
+            # named params passed as keywords
+            result = conn.execute(stmt, kwargs)
+        else:
+            # no params
+            result = conn.execute(stmt)
+
+        if result.returns_rows:
+            return result.fetchall()
+        else:
+            return result.rowcount
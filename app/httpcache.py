@@ -0,0 +1,97 @@
+"""HTTP caching for catalog pages: ETags, conditional GETs and fragment caching.
+
+A view fetches its (app.cache-backed) data, derives a version from it
+and returns early when the browser or proxy already holds that version:
+
+    version = data_version(product, inventory)
+    etag = etag_for(version)
+    if is_fresh(etag):
+        return not_modified(etag, weak=True)
+    ...
+    return cacheable(make_response(html), etag, weak=True)
+
+The version is a hash of the data itself, so it is the same in every
+worker process and changes exactly when the data does. ETags also cover
+who the page is rendered for (the header and cart forms differ once
+logged in), whether it is an HTMX fragment or the full page, and the
+templates' modification time, so a deploy with template changes
+invalidates them too.
+
+HTMX fragments get strong ETags (the same version renders the same
+bytes); full pages get weak ones. Anonymous responses are public for
+HTTP_CACHE_MAX_AGE seconds, so a reverse proxy can serve them; logged-in
+responses are private and revalidated on every use.
+
+render_fragment() keeps rendered template fragments (the product grid,
+the seller table) in app.cache, keyed by data version and URL.
+"""
+import hashlib
+import os
+import pickle
+
+from flask import current_app, render_template, request, session
+from flask_login import current_user
+from markupsafe import Markup
+
+
+def data_version(*parts):
+    """Short hash of the given (picklable) data."""
+    raw = pickle.dumps(parts, protocol=pickle.HIGHEST_PROTOCOL)
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def _templates_version():
+    app = current_app._get_current_object()
+    version = getattr(app, '_templates_version', None)
+    if version is None:
+        folder = os.path.join(app.root_path, app.template_folder)
+        version = max((os.path.getmtime(os.path.join(root, name))
+                       for root, _, names in os.walk(folder) for name in names), default=0)
+        version = app._templates_version = int(version)
+    return version
+
+
+def _viewer():
+    if current_user.is_authenticated:
+        return (current_user.id, current_user.firstname)
+    return None
+
+
+def etag_for(version):
+    """ETag for the current request's page at data `version`."""
+    return data_version(version, _viewer(), bool(request.headers.get('HX-Request')), _templates_version())
+
+
+def is_fresh(etag):
+    """True if the client's If-None-Match already names `etag`."""
+    return request.method in ('GET', 'HEAD') and request.if_none_match.contains_weak(etag)
+
+
+def cacheable(response, etag, weak=False):
+    """Set ETag, Cache-Control and Vary on a catalog response."""
+    response.set_etag(etag, weak=weak)
+    if current_user.is_authenticated or session.modified:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config.get('HTTP_CACHE_MAX_AGE', 30)
+    response.vary.update(('Cookie', 'HX-Request'))
+    return response
+
+
+def not_modified(etag, weak=False):
+    return cacheable(current_app.response_class(status=304), etag, weak)
+
+
+def render_fragment(template, version, **context):
+    """Render `template`, reusing the HTML cached for this version, URL and viewer kind."""
+    arguments = {
+        'version': version,
+        'path': request.full_path,
+        'authenticated': current_user.is_authenticated,
+        'templates': _templates_version(),
+    }
+    html = current_app.cache.get_or_compute(
+        f'fragment:{template}', arguments, (), lambda: render_template(template, **context))
+    return Markup(html)
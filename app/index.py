@@ -1,10 +1,14 @@
+import base64
+import json
 from math import ceil
 
-from flask import render_template
+from flask import current_app as app, make_response, render_template
+from markupsafe import Markup, escape
 from flask_login import current_user
 import datetime
 
 from .models.product import Product
+from .httpcache import cacheable, data_version, etag_for, is_fresh, not_modified, render_fragment
 
 from flask import Blueprint, request
 bp = Blueprint('index', __name__)
@@ -15,6 +19,35 @@ def test():
     return "Hello world"
 
 
+@bp.app_template_filter('highlight')
+def highlight(text):
+    """Escape a search snippet, turning its [[[match]]] markers into <mark> tags."""
+    escaped = str(escape(text))
+    return Markup(escaped.replace('[[[', '<mark>').replace(']]]', '</mark>'))
+
+
+def _encode_cursor(data):
+    """Opaque, URL-safe page token for the catalog's keyset pagination."""
+    raw = json.dumps(data, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        return data if isinstance(data, dict) else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _sort_key(row, sortBy):
+    """(sort value, id) of a catalog row, as stored in a cursor."""
+    return [str(row._mapping[sortBy.lower()]) if sortBy else row.id, row.id]
+
+
 @bp.route('/')
 def index():
 
@@ -25,38 +58,101 @@ def index():
     category = request.args.get('category', type=str) or None
     keyword = request.args.get('keyword', type=str) or None
 
-    sortBy = request.args.get('sortBy', "name", type=str)
+    # Keyword searches default to best match first
+    sortBy = request.args.get('sortBy', "relevance" if keyword else "name", type=str)
     sortDir = request.args.get('sortDir', "asc", type=str)
+    if sortBy == 'relevance' and not keyword:
+        sortBy = 'name'
+
+    # The total is counted once, on the first page, and then carried along
+    # in the cursor. ?count=estimate uses the planner's row estimate
+    # instead of a COUNT(*); ?count=none skips it altogether.
+    count_mode = request.args.get('count', 'exact')
+    if count_mode not in ('exact', 'estimate', 'none'):
+        count_mode = 'exact'
+
+    # Pagination: keyset cursors carry (sort value, id) of the row to seek
+    # past, the page number and the total, and only apply to the sort
+    # they were issued for.
+    cursor = _decode_cursor(request.args.get('cursor'))
+    if cursor and cursor.get('s') != [sortBy, sortDir]:
+        cursor = None
+    after = before = None
+    page = 1
+    total = None
+    if cursor:
+        try:
+            key = cursor['k']
+            page = max(int(cursor['p']), 1)
+            total = int(cursor['t']) if cursor.get('t') is not None else None
+            if cursor.get('d') == 'prev':
+                before = key
+            else:
+                after = key
+        except (KeyError, TypeError, ValueError):
+            cursor, after, before = None, None, None
+            page, total = 1, None
+
+    # Browse reads don't need SERIALIZABLE; run them as one read-only
+    # READ COMMITTED transaction instead of one per query.
+    with app.db.transaction(isolation_level='READ COMMITTED', read_only=True):
+        if total is None and cursor is None:
+            if count_mode == 'exact':
+                total = Product.count_with_filters(category=category, keyword=keyword)
+            elif count_mode == 'estimate':
+                total = Product.estimate_with_filters(category=category, keyword=keyword)
+        pages = ceil(total / PER_PAGE) if total is not None else None
+
+        # One extra row tells us whether there is a page beyond this one
+        products = Product.get_with_filters(
+            category=category,
+            keyword=keyword,
+            sortBy=sortBy,
+            sortDir=sortDir,
+            limit=PER_PAGE + 1,
+            after=after,
+            before=before
+        )
+        categories = None
+        if not request.headers.get('HX-Request'):
+            categories = Product.get_categories()
+
+    if before is not None:
+        more_before = len(products) > PER_PAGE
+        products = products[-PER_PAGE:]
+        more_after = True
+    else:
+        more_after = len(products) > PER_PAGE
+        products = products[:PER_PAGE]
+        more_before = page > 1
+
+    base = {'s': [sortBy, sortDir], 't': total}
+    next_cursor = prev_cursor = None
+    if products and more_after:
+        next_cursor = _encode_cursor(dict(base, k=_sort_key(products[-1], sortBy), p=page + 1, d='next'))
+    if products and more_before and page > 1:
+        prev_cursor = _encode_cursor(dict(base, k=_sort_key(products[0], sortBy), p=page - 1, d='prev'))
+
+    pagination = dict(page=page, pages=pages, total=total,
+                      total_estimated=count_mode == 'estimate',
+                      next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+    # The rows come from app.cache, so this usually answers a repeat
+    # visit with a 304 (or a cached grid) without touching the database
+    version = data_version(products, pagination)
+    etag = etag_for((version, categories))
+    htmx = bool(request.headers.get('HX-Request'))
+    if is_fresh(etag):
+        return not_modified(etag, weak=not htmx)
 
-    # Pagination
-    page = request.args.get('page', 1, type=int)
-    if page < 1:
-        page = 1
-    
-    offset = (page - 1) * PER_PAGE
-    total = Product.count_with_filters(category=category, keyword=keyword)
-    pages = ceil(total / PER_PAGE)
-
-    # Calculate products and categories
-    products = Product.get_with_filters(
-        category=category,
-        keyword=keyword,
-        sortBy=sortBy,
-        sortDir=sortDir,
-        limit=PER_PAGE,
-        offset=offset
-    )
-    categories = Product.get_categories()
-
-
-    if request.headers.get('HX-Request'):  # HTMX request
-        return render_template('_products_fragment.html', 
-                               avail_products=products,
-                               page=page, pages=pages, total=total)
+    products_grid = render_fragment('_products_fragment.html', version,
+                                    avail_products=products, **pagination)
+    if htmx:  # HTMX request
+        return cacheable(make_response(products_grid), etag)
     else:
-        return render_template('index.html', 
-                               avail_products=products, page=page,
-                               pages=pages, total=total,
-                               categories=categories, selected_category=category,
-                               keyword=keyword,
-                               sortBy=sortBy, sortDir=sortDir)
+        response = make_response(render_template('index.html',
+                                 products_grid=products_grid,
+                                 categories=categories, selected_category=category,
+                                 keyword=keyword,
+                                 sortBy=sortBy, sortDir=sortDir))
+        return cacheable(response, etag, weak=True)
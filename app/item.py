@@ -1,6 +1,6 @@
 
 from flask_login import current_user, login_required
-from flask import Blueprint, request, render_template, flash, redirect, url_for, abort
+from flask import Blueprint, request, render_template, flash, redirect, url_for, abort, make_response
 
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, SelectField, DecimalField, SubmitField, IntegerField
@@ -8,6 +8,7 @@ from wtforms.validators import DataRequired, NumberRange, Optional
 
 from .models.product import Product
 from .models.inventory import InventoryItem
+from .httpcache import cacheable, data_version, etag_for, is_fresh, not_modified, render_fragment
 
 bp = Blueprint('items', __name__)
 
@@ -15,9 +16,20 @@ bp = Blueprint('items', __name__)
 def view_product(product_id):
     product = Product.get_with_id(product_id)
     inventory = InventoryItem.get_sellers_from_product(product_id)
-    return render_template('product_detail.html', 
-                           product=product, inventory=inventory
-                           )
+
+    # Both reads are usually cache hits; skip rendering if the client
+    # already has this version of the page
+    version = data_version(product, inventory)
+    etag = etag_for(version)
+    if is_fresh(etag):
+        return not_modified(etag, weak=True)
+
+    seller_table = render_fragment('_seller_table.html', version,
+                                   product=product, inventory=inventory)
+    response = make_response(render_template('product_detail.html',
+                                             product=product, inventory=inventory,
+                                             seller_table=seller_table))
+    return cacheable(response, etag, weak=True)
 
 
 class ProductForm(FlaskForm):
@@ -1,6 +1,8 @@
 from decimal import Decimal
 from flask import current_app as app
 
+from ..db import transactional
+
 
 class CartItem:
     def __init__(self, account_id, product_id, seller_id, quantity,
@@ -85,20 +87,38 @@ class Cart:
             })
         return formatted
 
+    @staticmethod
+    def summary(user_id):
+        """Items, total and item count of the cart, from the one query
+        behind format_cart_items (the total and count are the sums of the
+        item rows)."""
+        items = Cart.format_cart_items(user_id)
+        return {
+            'items': items,
+            'total': sum((it['subtotal'] for it in items), Decimal('0.00')),
+            'count': sum(it['quantity'] for it in items),
+        }
+
     @staticmethod
     def get_default_seller(product_id):
+        """The seller a product goes to when none is chosen (see get_default_sellers)."""
+        return Cart.get_default_sellers([product_id]).get(product_id)
+
+    @staticmethod
+    def get_default_sellers(product_ids):
+        """{product_id: seller_id} of the cheapest in-stock offer for each
+        product (ties by seller id); products with no stock are left out."""
         rows = app.db.execute('''
-            SELECT seller_id
+            SELECT DISTINCT ON (product_id) product_id, seller_id
             FROM Inventory
-            WHERE product_id = :pid
+            WHERE product_id = ANY(CAST(:pids AS INT[]))
               AND quantity > 0
-            LIMIT 1
-        ''', pid=product_id)
-        if not rows:
-            return None
-        return int(rows[0][0])
+            ORDER BY product_id, price, seller_id
+        ''', pids=sorted(set(product_ids)))
+        return {int(pid): int(sid) for pid, sid in rows}
 
     @staticmethod
+    @transactional('cart.add_item')
     def add_item(user_id, product_id, seller_id, quantity=1):
         print(f"[Cart.add_item] Adding to cart: user={user_id}, product={product_id}, seller={seller_id}, qty={quantity}")
         rows = app.db.execute('''
@@ -114,6 +134,7 @@ class Cart:
         return int(rows[0][0])
 
     @staticmethod
+    @transactional('cart.update_item')
     def update_item(user_id, product_id, seller_id, quantity):
         if int(quantity) <= 0:
             return Cart.remove_item(user_id, product_id, seller_id)
@@ -132,6 +153,7 @@ class Cart:
         return int(rows[0][0])
 
     @staticmethod
+    @transactional('cart.remove_item')
     def remove_item(user_id, product_id, seller_id):
         rc = app.db.execute('''
             DELETE FROM Cart
@@ -141,3 +163,88 @@ class Cart:
         ''', uid=user_id, pid=product_id, sid=seller_id)
 
         return rc > 0
+
+    # Operations accepted by apply_batch
+    BATCH_OPS = ('add', 'set', 'remove')
+
+    @staticmethod
+    def _fold_batch(ops):
+        """Collapse ops into one final change per (product_id, seller_id):
+        ('add', delta) on top of the current quantity, or ('set', quantity)
+        where a quantity of 0 removes the line. Later ops build on earlier
+        ones, as if they were applied one by one."""
+        changes = {}
+        for op in ops:
+            key = (op['product_id'], op['seller_id'])
+            mode, value = changes.get(key, ('add', 0))
+            if op['op'] == 'add':
+                changes[key] = (mode, value + op['quantity'])
+            elif op['op'] == 'set':
+                changes[key] = ('set', max(op['quantity'], 0))
+            else:
+                changes[key] = ('set', 0)
+        return changes
+
+    @staticmethod
+    @transactional('cart.apply_batch')
+    def apply_batch(user_id, ops):
+        """Apply a list of cart operations in one transaction.
+
+        Each op is a dict with 'op' ('add', 'set' or 'remove'),
+        'product_id', 'seller_id' (None picks the cheapest seller with
+        stock, as /cart/add does) and 'quantity' (for add/set; an add must
+        be at least 1, and one that is not is skipped). The whole batch
+        takes at most four statements however many ops it has: one to
+        pick default sellers, one upsert for adds, one for sets and one
+        delete, each fed by unnest() over parallel arrays.
+
+        Lines for a (product, seller) pair that is not on offer are
+        skipped. Returns (summary, skipped) with the resulting
+        Cart.summary and the skipped ops.
+        """
+        skipped = [op for op in ops if op['op'] == 'add' and op['quantity'] < 1]
+        ops = [op for op in ops if not (op['op'] == 'add' and op['quantity'] < 1)]
+        missing = {op['product_id'] for op in ops if op['seller_id'] is None}
+        if missing:
+            defaults = Cart.get_default_sellers(missing)
+            ops = [dict(op, seller_id=defaults.get(op['product_id'])) if op['seller_id'] is None else op
+                   for op in ops]
+        skipped += [op for op in ops if op['seller_id'] is None]
+        changes = Cart._fold_batch([op for op in ops if op['seller_id'] is not None])
+
+        adds = [(key, value) for key, (mode, value) in changes.items() if mode == 'add' and value > 0]
+        sets = [(key, value) for key, (mode, value) in changes.items() if mode == 'set' and value > 0]
+        removes = [key for key, (mode, value) in changes.items() if mode == 'set' and value == 0]
+
+        applied = set()
+        for rows, conflict in ((adds, 'Cart.quantity + EXCLUDED.quantity'), (sets, 'EXCLUDED.quantity')):
+            if not rows:
+                continue
+            result = app.db.execute(f'''
+                INSERT INTO Cart (account_id, product_id, seller_id, quantity)
+                SELECT :uid, r.product_id, r.seller_id, r.quantity
+                FROM unnest(CAST(:pids AS INT[]), CAST(:sids AS INT[]), CAST(:qtys AS INT[]))
+                     AS r(product_id, seller_id, quantity)
+                JOIN Inventory i ON i.product_id = r.product_id AND i.seller_id = r.seller_id
+                ON CONFLICT (account_id, product_id, seller_id)
+                DO UPDATE SET quantity = {conflict}
+                RETURNING product_id, seller_id
+            ''', uid=user_id,
+                pids=[key[0] for key, _ in rows],
+                sids=[key[1] for key, _ in rows],
+                qtys=[value for _, value in rows])
+            applied.update((pid, sid) for pid, sid in result)
+
+        if removes:
+            app.db.execute('''
+                DELETE FROM Cart c
+                USING unnest(CAST(:pids AS INT[]), CAST(:sids AS INT[])) AS r(product_id, seller_id)
+                WHERE c.account_id = :uid
+                  AND c.product_id = r.product_id
+                  AND c.seller_id = r.seller_id
+            ''', uid=user_id, pids=[key[0] for key in removes], sids=[key[1] for key in removes])
+
+        written = {key for key, _ in adds + sets}
+        skipped += [op for op in ops
+                    if (op['product_id'], op['seller_id']) in written - applied]
+        return Cart.summary(user_id), skipped
@@ -1,6 +1,9 @@
 # app/models/inventory.py
 from flask import current_app as app
 
+from ..cache import cached
+from ..db import is_serialization_failure, transactional
+
 
 class InventoryItem:
     def __init__(self, seller_id, product_id, quantity, price, name=None, category=None, image=None):
@@ -45,18 +48,21 @@ class InventoryItem:
         }
 
     @classmethod
-    def get_for_seller(cls, seller_id):
+    def get_for_seller(cls, seller_id, limit=None):
+        """The seller's listings by product name (the first `limit` of them if given)."""
         sql = """
         SELECT i.seller_id, i.product_id, i.quantity, i.price, p.name, p.category, p.image
         FROM inventory i
         LEFT JOIN products p ON p.id = i.product_id
         WHERE i.seller_id = :seller_id
         ORDER BY p.name
+        LIMIT :limit
         """
-        rows = app.db.execute(sql, seller_id=seller_id)
+        rows = app.db.execute(sql, seller_id=seller_id, limit=limit)
         return [cls.from_row(r) for r in rows]
 
     @staticmethod
+    @cached('inventory.get_sellers_from_product', tags=('product:{product_id}',))
     def get_sellers_from_product(product_id):
         rows = app.db.execute('''
                     SELECT i.seller_id, i.product_id, i.quantity, i.price, p.name, p.category, p.image
@@ -69,6 +75,7 @@ class InventoryItem:
         return [InventoryItem.from_row(row) for row in rows]
 
     @staticmethod
+    @transactional('inventory.add_or_update')
     def add_or_update(seller_id, product_id, quantity, price):
         """Add a product to inventory or update quantity if it already exists."""
         try:
@@ -80,14 +87,18 @@ class InventoryItem:
                 RETURNING seller_id, product_id, quantity, price
             ''',
             seller_id=seller_id, product_id=product_id, quantity=quantity, price=price)
+            app.cache.invalidate('catalog', f'product:{product_id}')
             if rows:
                 return InventoryItem(rows[0][0], rows[0][1], rows[0][2], rows[0][3])
             return None
         except Exception as e:
+            if is_serialization_failure(e):
+                raise  # let @transactional retry it
             print("Error adding/updating inventory:", e)
             return None
 
     @staticmethod
+    @transactional('inventory.set_quantity')
     def set_quantity(seller_id, product_id, quantity, price=None):
         """Set the exact quantity for a product in inventory."""
         try:
@@ -112,13 +123,17 @@ class InventoryItem:
                 ''',
                 seller_id=seller_id, product_id=product_id, quantity=quantity)
             if rows:
+                app.cache.invalidate('catalog', f'product:{product_id}')
                 return InventoryItem(rows[0][0], rows[0][1], rows[0][2], rows[0][3])
             return None
         except Exception as e:
+            if is_serialization_failure(e):
+                raise  # let @transactional retry it
             print("Error setting inventory quantity:", e)
             return None
 
     @staticmethod
+    @transactional('inventory.remove_from_inventory')
     def remove_from_inventory(seller_id, product_id):
         """Remove a product from seller's inventory entirely."""
         try:
@@ -127,8 +142,11 @@ class InventoryItem:
                 WHERE seller_id = :seller_id AND product_id = :product_id
             ''',
             seller_id=seller_id, product_id=product_id)
+            app.cache.invalidate('catalog', f'product:{product_id}')
             return True
         except Exception as e:
+            if is_serialization_failure(e):
+                raise  # let @transactional retry it
             print("Error removing from inventory:", e)
             return False
 
@@ -1,8 +1,13 @@
+import json
 import os
+import re
 import uuid
 import requests
 from flask import current_app as app
 
+from ..cache import cached
+from ..db import transactional
+
 def save_image_locally(image_url):
     """Download an image from an external URL and save it to static/product_images/."""
     
@@ -49,6 +54,7 @@ class Product:
         self.max_price = max_price
 
     @staticmethod
+    @cached('product.get_with_id', tags=('product:{id}',))
     def get_with_id(id):
         rows = app.db.execute('''
             SELECT id, name, description, image, category, created_by
@@ -63,19 +69,21 @@ class Product:
     def get_all():
         # Only return products that have at least one seller
         rows = app.db.execute('''
-            SELECT DISTINCT p.id, p.name, p.description, p.image, p.category, p.created_by
+            SELECT p.id, p.name, p.description, p.image, p.category, p.created_by
             FROM Products p
-            INNER JOIN Inventory i ON p.id = i.product_id
+            INNER JOIN product_offer_summary s ON s.product_id = p.id
         ''') 
         return [Product(*row) for row in rows]
     
     @staticmethod
+    @cached('product.get_categories', tags=('catalog',))
+    @transactional('product.get_categories', isolation_level='READ COMMITTED', read_only=True)
     def get_categories():
         # Only show categories for products that have sellers
         rows = app.db.execute('''
             SELECT DISTINCT p.category
             FROM Products p
-            INNER JOIN Inventory i ON p.id = i.product_id
+            INNER JOIN product_offer_summary s ON s.product_id = p.id
             WHERE p.category IS NOT NULL
             ORDER BY p.category
         ''')
@@ -90,11 +98,11 @@ class Product:
             rows = app.db.execute('''
                 INSERT INTO PRODUCTS(name, description, image, category, created_by)
                 VALUES (:name, :description, :image, :category, :created_by)
-                RETURNING id
+                RETURNING id, name, description, image, category, created_by
                 ''',
                 name=name, description=description, image=image, category=category, created_by=created_by)
-            id = rows[0][0]
-            return Product.get_with_id(id)
+            app.cache.invalidate('catalog')
+            return Product(*(rows[0]))
         except Exception as e:
             print(str(e))
             return None
@@ -116,16 +124,15 @@ class Product:
                 category = :category,
                 created_by = :created_by
             WHERE id = :product_id
-            RETURNING id
+            RETURNING id, name, description, image, category, created_by
         ''',
         name=name, description=description, image=image, category=category, created_by=created_by, product_id=product_id)
 
         if not rows:
             return None
 
-        id = rows[0][0]
-        # build and return a Product object (match the shape your app uses)
-        return Product.get_with_id(id)
+        app.cache.invalidate('catalog', f'product:{product_id}')
+        return Product(*(rows[0]))
     
     @staticmethod
     def delete_product(product_id):
@@ -140,31 +147,66 @@ class Product:
             DELETE FROM Products
             WHERE id = :product_id
         """, product_id=product_id)
+        app.cache.invalidate('catalog', f'product:{product_id}')
         
+    @staticmethod
     def getPriceRange(id):
         rows = app.db.execute('''
-            SELECT 
-                MIN(price) AS min_price,
-                MAX(price) AS max_price
-            FROM Inventory
+            SELECT min_price, max_price
+            FROM product_offer_summary
             WHERE product_id = :id
         ''',
         id=id)
 
-        # rows is a list of dictionaries; return the first row
         if rows:
-            return rows[0]['min_price'], rows[0]['max_price']
+            return rows[0].min_price, rows[0].max_price
         return None, None
 
 
     # Filters below
+
+    # sortBy value -> (column, id tiebreaker) the catalog is ordered and
+    # seeked by; each pair matches an index so a page is an index range scan
+    SORT_COLUMNS = {
+        "name": ("p.name", "p.id"),
+        "min_price": ("s.min_price", "s.product_id"),
+        "max_price": ("s.max_price", "s.product_id"),
+    }
+
     @staticmethod
-    def _build_filter_sql(category=None, keyword=None, min_price=None, max_price=None):
-        sql = [
+    def _prefix_tsquery(keyword):
+        """'grey ca' -> 'grey:* & ca:*': every word must match, as a prefix."""
+        return " & ".join(f"{term}:*" for term in re.findall(r"[^\W_]+", keyword))
+
+    @staticmethod
+    def _rank_expr(keyword):
+        """Relevance of a product for `keyword`: full-text rank plus name similarity."""
+        rank = "similarity(p.name, :keyword)"
+        if Product._prefix_tsquery(keyword):
+            rank = f"ts_rank_cd(p.search_vector, to_tsquery('english', :tsquery)) + {rank}"
+        return f"({rank})"
+
+    @staticmethod
+    def _build_filter_sql(category=None, keyword=None, min_price=None, max_price=None, seek=None, ranked=False):
+        """Build the catalog query over Products and product_offer_summary.
+
+        The summary holds one row per product that has sellers, so no
+        grouping over Inventory is needed. `seek` is (sort_column,
+        id_column, op, value, id) for keyset pagination: only rows whose
+        (sort_column, id_column) compare `op` to (value, id) are kept.
+
+        A keyword matches the full-text vector (GIN), or the name by
+        substring or trigram similarity (pg_trgm GIN). With `ranked`, the
+        rows also carry a `relevance` score and a highlighted `snippet`
+        (matches wrapped in [[[ ]]], see the `highlight` filter).
+        """
+        columns = [
             "SELECT p.id, p.name, p.description, p.image, p.category, p.created_by,",
-            "       MIN(i.price) AS min_price, MAX(i.price) AS max_price",
+            "       s.min_price, s.max_price"
+        ]
+        sql = [
             "FROM Products p",
-            "INNER JOIN Inventory i ON p.id = i.product_id"
+            "INNER JOIN product_offer_summary s ON s.product_id = p.id"
         ]
 
         conditions = []
@@ -175,39 +217,71 @@ class Product:
             params["category"] = category
         
         if keyword is not None:
-            conditions.append("(p.name ILIKE :keyword OR p.description ILIKE :keyword)")
-            params["keyword"] = f"%{keyword}%"
+            tsquery = Product._prefix_tsquery(keyword)
+            search = ["p.name ILIKE :keyword_like ESCAPE '\\'", "p.name % :keyword"]
+            params["keyword"] = keyword
+            # A literal substring: % and _ typed by the user match only themselves
+            escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params["keyword_like"] = f"%{escaped}%"
+            if tsquery:
+                search.insert(0, "p.search_vector @@ to_tsquery('english', :tsquery)")
+                params["tsquery"] = tsquery
+            conditions.append("(" + " OR ".join(search) + ")")
+
+            if ranked:
+                columns[-1] += ","
+                columns.append(f"       {Product._rank_expr(keyword)} AS relevance,")
+                if tsquery:
+                    columns.append("       ts_headline('english', p.description, to_tsquery('english', :tsquery),")
+                    columns.append("                   'StartSel=[[[, StopSel=]]], MaxWords=30, MinWords=12') AS snippet")
+                else:
+                    columns.append("       NULL AS snippet")
 
         if min_price is not None:
-            conditions.append("MIN(i.price) >= :min_price")
+            conditions.append("s.min_price >= :min_price")
             params["min_price"] = min_price
 
         if max_price is not None:
-            conditions.append("MIN(i.price) <= :max_price")
+            conditions.append("s.min_price <= :max_price")
             params["max_price"] = max_price
 
-        where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+        if seek is not None:
+            sort_column, id_column, op, value, last_id = seek
+            conditions.append(f"({sort_column}, {id_column}) {op} (:seek_value, :seek_id)")
+            params["seek_value"] = value
+            params["seek_id"] = last_id
 
-        # Must group by product to use MIN(i.price)
+        where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
         sql.append(where_clause)
-        sql.append("GROUP BY p.id, p.name, p.description, p.image, p.category, p.created_by")
 
-        return "\n".join(sql), params
+        return "\n".join(columns + sql), params
 
 
     @staticmethod
+    @cached('product.count_with_filters', tags=('catalog',))
+    @transactional('product.count_with_filters', isolation_level='READ COMMITTED', read_only=True)
     def count_with_filters(category=None, keyword=None, min_price=None, max_price=None):
         sql_query, params = Product._build_filter_sql(category, keyword, min_price, max_price)
 
-        # count distinct product IDs from grouped results
         sql = f"SELECT COUNT(*) FROM ({sql_query}) AS sub"
         
         row = app.db.execute(sql, params)[0]
         return int(row[0]) if row else 0
 
-        
-    
     @staticmethod
+    @cached('product.estimate_with_filters', tags=('catalog',))
+    @transactional('product.estimate_with_filters', isolation_level='READ COMMITTED', read_only=True)
+    def estimate_with_filters(category=None, keyword=None, min_price=None, max_price=None):
+        """Planner's row estimate for the filtered catalog (no scan; approximate)."""
+        sql_query, params = Product._build_filter_sql(category, keyword, min_price, max_price)
+        plan = app.db.execute(f"EXPLAIN (FORMAT JSON) {sql_query}", params)[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    @staticmethod
+    @cached('product.get_with_filters', tags=('catalog',))
+    @transactional('product.get_with_filters', isolation_level='READ COMMITTED', read_only=True)
     def get_with_filters(
         category=None,
         keyword=None,
@@ -216,22 +290,52 @@ class Product:
         sortBy=None,
         sortDir=None,
         limit=None,
-        offset=None
+        offset=None,
+        after=None,
+        before=None
     ):
+        """Filtered, sorted catalog rows.
 
-        sql_query, params = Product._build_filter_sql(category, keyword, min_price, max_price)
+        Pass `after` (or `before`) as the (sort value, id) key of the last
+        (or first) row of the current page to seek to the next (or
+        previous) page instead of using `offset`; page N then costs the
+        same as page 1. Rows always come back in display order.
+
+        sortBy='relevance' (best match first) needs a keyword; without
+        one it falls back to sorting by name.
+        """
 
         # Sorting
         if sortDir and sortDir.lower() not in {"asc", "desc"}:
             raise ValueError("sortDir must be 'asc' or 'desc'")
 
-        if sortBy and sortBy.lower() not in {"name", "min_price", "max_price"}:
-            raise ValueError("sortBy must be 'name' or 'min_price' or 'max_price'")
+        if sortBy and sortBy.lower() not in Product.SORT_COLUMNS and sortBy.lower() != "relevance":
+            raise ValueError("sortBy must be 'name' or 'min_price' or 'max_price' or 'relevance'")
 
-        sort_column = sortBy if sortBy else "p.id"
         sort_direction = sortDir.upper() if sortDir else "ASC"
-
-        sql = f"{sql_query}\nORDER BY {sort_column} {sort_direction}"
+        if sortBy and sortBy.lower() == "relevance":
+            if keyword is not None:
+                sort_column, id_column = Product._rank_expr(keyword), "p.id"
+                sort_direction = "DESC"
+            else:
+                sort_column, id_column = Product.SORT_COLUMNS["name"]
+        else:
+            sort_column, id_column = Product.SORT_COLUMNS[sortBy.lower()] if sortBy else ("p.id", "p.id")
+
+        seek = None
+        key = after if after is not None else before
+        backwards = before is not None and after is None
+        if key is not None:
+            forward_op = ">" if sort_direction == "ASC" else "<"
+            backward_op = "<" if forward_op == ">" else ">"
+            seek = (sort_column, id_column, backward_op if backwards else forward_op, key[0], key[1])
+            if backwards:
+                # Walk towards the start, then flip the rows back below
+                sort_direction = "DESC" if sort_direction == "ASC" else "ASC"
+
+        sql_query, params = Product._build_filter_sql(category, keyword, min_price, max_price, seek, ranked=True)
+
+        sql = f"{sql_query}\nORDER BY {sort_column} {sort_direction}, {id_column} {sort_direction}"
 
         if limit is not None:
             sql += "\nLIMIT :limit"
@@ -242,4 +346,6 @@ class Product:
             params["offset"] = offset
 
         rows = app.db.execute(sql, params)
+        if backwards:
+            rows = rows[::-1]
         return rows  # or build Product objects if needed
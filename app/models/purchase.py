@@ -1,5 +1,20 @@
+from decimal import Decimal
 from flask import current_app as app
 
+from ..db import transactional
+from .reservation import HELD_BY_OTHERS
+from .seller_sales import SellerSales
+from .user import User
+from .user_stats import UserStats
+
+
+class OutOfStock(Exception):
+    """Checkout found cart lines the sellers cannot cover; nothing was bought."""
+
+    def __init__(self, lines):
+        super().__init__(f'not enough stock for {len(lines)} cart line(s)')
+        self.lines = lines  # [{'product_id', 'product_name', 'seller_id', 'quantity'}]
+
 
 class Purchase:
     def __init__(self, purchase_id, address, date, buyer_id, fulfillment_status, items, totalprice):
@@ -12,67 +27,64 @@ class Purchase:
         self.totalprice = totalprice #summed up from all items
 
     @staticmethod
-    def get_all_purchanditems_for_user(buyer_id):
-        rows = app.db.execute(
-            '''
-            SELECT pur.purchase_id,
-                pur.address,
-                pur.date,
-                pur.fulfillment_status,
-                prod.id AS product_id,
-                prod.name AS product_name,
-                COALESCE(i.price, 0.0) AS price,
-                prod.category,
-                l.quantity,
-                l.seller_id,
-                l.fulfillment_status AS item_fulfillment_status
-            FROM Ledger l
-            JOIN Purchases pur ON l.purchase_id = pur.purchase_id
-            JOIN Products prod ON l.product_id = prod.id
-            LEFT JOIN Inventory i ON l.product_id = i.product_id AND l.seller_id = i.seller_id
-            WHERE pur.buyer_id = :buyer_id
-            ORDER BY pur.date DESC, pur.purchase_id
-            ''',
-            buyer_id=buyer_id
-        )
-        if not rows:
-            return None
-
-        # Group by purchase_id
-        purchases = {}
+    @transactional('purchase.history_page', isolation_level='READ COMMITTED', read_only=True)
+    def history_page(buyer_id, limit=10, after=None):
+        """One page of the buyer's purchases, newest first, with their items.
 
-        for row in rows:
-            purchase_id = row[0]
-            if purchase_id not in purchases:
-                purchases[purchase_id] = {
-                    'purchase_id': purchase_id,
-                    'address': row[1],
-                    'date': row[2],
-                    'buyer_id': buyer_id,
-                    'fulfillment_status': row[3],
-                    'items': [],
-                    'totalprice': 0.0  # initialize total cost
-                } #this creates a dictionary item in the purchases dictionary
-                #each one represents a purchase, and it has keys to show attributes (items is a list of more dictionaries representing items)
-
-            # extract item info
-            item = {
-                'product_id': row[4],
-                'product_name': row[5],
-                'price': float(row[6]),
-                'category': row[7],
-                'quantity': int(row[8]),
-                'seller_id': row[9],
-                'item_fulfillment_status': row[10],
-            }
-
-            purchases[purchase_id]['items'].append(item)
+        Keyset pagination on (date, purchase_id): pass the (date,
+        purchase_id) of the previous page's last purchase as `after`.
+        Order totals are summed in SQL; items are fetched (one query)
+        only for the purchases on this page. Returns [Purchase].
+        """
+        seek = ''
+        params = {'buyer_id': buyer_id, 'limit': limit}
+        if after is not None:
+            seek = 'AND (p.date, p.purchase_id) < (:after_date, :after_id)'
+            params['after_date'], params['after_id'] = after
+        rows = app.db.execute(f'''
+            SELECT p.purchase_id, p.address, p.date, p.fulfillment_status, t.total
+            FROM Purchases p
+            CROSS JOIN LATERAL (
+                SELECT COALESCE(SUM(l.line_total), 0) AS total
+                FROM Ledger l
+                WHERE l.purchase_id = p.purchase_id
+            ) t
+            WHERE p.buyer_id = :buyer_id
+              {seek}
+            ORDER BY p.date DESC, p.purchase_id DESC
+            LIMIT :limit
+        ''', **params)
+        if not rows:
+            return []
 
-            # add to total cost
-            purchases[purchase_id]['totalprice'] += item['price'] * item['quantity']
+        items = {row[0]: [] for row in rows}
+        lines = app.db.execute('''
+            SELECT l.purchase_id, l.product_id, prod.name, l.unit_price, prod.category,
+                   l.quantity, l.seller_id, l.fulfillment_status
+            FROM Ledger l
+            JOIN Products prod ON prod.id = l.product_id
+            WHERE l.purchase_id = ANY(CAST(:pids AS INT[]))
+            ORDER BY l.purchase_id, prod.name
+        ''', pids=list(items))
+        for purchase_id, product_id, name, price, category, quantity, seller_id, status in lines:
+            items[purchase_id].append({
+                'product_id': product_id,
+                'product_name': name,
+                'price': float(price),
+                'category': category,
+                'quantity': int(quantity),
+                'seller_id': seller_id,
+                'item_fulfillment_status': status,
+            })
 
-        # Convert to list of Purchase objects
-        return [Purchase(**p) for p in purchases.values()]
+        return [Purchase(purchase_id=purchase_id,
+                         address=address,
+                         date=date,
+                         buyer_id=buyer_id,
+                         fulfillment_status=fulfillment_status,
+                         items=items[purchase_id],
+                         totalprice=float(total))
+                for purchase_id, address, date, fulfillment_status, total in rows]
 
 
 
@@ -104,135 +116,166 @@ class Purchase:
 #         return [Purchase(*row) for row in rows]
 
     @staticmethod
+    @transactional('purchase.create_from_cart', isolation_level='READ COMMITTED')
     def create_from_cart(buyer_id, address):
         """Create a new purchase from the user's cart.
-        
-        1. Check buyer balance
-        2. Create purchase record
-        3. Copy cart items to ledger
-        4. Update buyer and seller balances
-        5. Clear the cart
+
+        Runs as one retried transaction with a fixed number of set-based
+        statements, however many lines the cart has:
+
+        1. Read (and lock) the cart lines with current prices once
+        2. Decrement the buyer balance, guarded by balance >= total
+        3. Create purchase record
+        4. Write the ledger lines with the unit prices read in step 1
+        5. Credit every seller their line totals with one aggregated UPDATE,
+           and add the purchase to the buyer's and sellers' user_stats
+        6. Clear the cart
+        7. Take the stock: lock every line's Inventory row, then one
+           guarded UPDATE of them, only where the units not held by other
+           buyers' stock reservations cover the line
+        8. Release the buyer's own reservations
+
+        Step 7 comes last so the Inventory rows of a popular product are
+        locked only for the moment before commit. It runs at READ
+        COMMITTED: a buyer queued behind another re-checks the guard
+        against the committed quantity instead of failing with a
+        serialization error, so a flash sale sells exactly the stock on
+        hand. If any line falls short, OutOfStock is raised and the whole
+        checkout rolls back.
+
         Returns the new Purchase object, 'insufficient_balance', or None if cart was empty.
         """
-        # Start transaction
-        with app.db.engine.begin() as conn:
-            # Get cart items first to check if empty
-            cart_items = app.db.execute('''
-                SELECT c.seller_id, c.product_id, c.quantity
-                FROM Cart c
-                WHERE c.account_id = :uid
-            ''', uid=buyer_id)
-            
-            if not cart_items:
-                return None
-
-            # Calculate total price first
-            items = []
-            totalprice = 0.0
-            seller_totals = {}  # Track total amount per seller
-
-            for seller_id, product_id, quantity in cart_items:
-                prod_rows = app.db.execute('''
-                    SELECT p.id, p.name, i.price, p.category
-                    FROM Products p
-                    JOIN Inventory i ON p.id = i.product_id AND i.seller_id = :sid
-                    WHERE p.id = :pid
-                ''', pid=product_id, sid=seller_id)
-                if prod_rows:
-                    prod = prod_rows[0]
-                    prod_name = prod[1]
-                    prod_price = float(prod[2]) if prod[2] is not None else 0.0
-                    prod_category = prod[3]
-                else:
-                    prod_name = None
-                    prod_price = 0.0
-                    prod_category = None
-
-                item = {
-                    'product_id': product_id,
-                    'product_name': prod_name,
-                    'price': prod_price,
-                    'category': prod_category,
-                    'quantity': int(quantity),
-                    'seller_id': seller_id,
-                    'item_fulfillment_status': 1,
-                }
-                items.append(item)
-                item_total = prod_price * int(quantity)
-                totalprice += item_total
-                
-                # Track seller totals
-                if seller_id not in seller_totals:
-                    seller_totals[seller_id] = 0.0
-                seller_totals[seller_id] += item_total
-
-            # Check buyer balance
-            buyer_balance_rows = app.db.execute('''
-                SELECT balance
-                FROM Users
-                WHERE id = :uid
-            ''', uid=buyer_id)
-            
-            if not buyer_balance_rows:
-                return None
-            
-            buyer_balance = float(buyer_balance_rows[0][0]) if buyer_balance_rows[0][0] is not None else 0.0
-            
-            # Check if balance is sufficient
-            if buyer_balance < totalprice:
-                return 'insufficient_balance'
-
-            # Create the purchase record with fulfillment_status=1
-            purchase_rows = app.db.execute('''
-                INSERT INTO Purchases (buyer_id, address, fulfillment_status)
-                VALUES (:uid, :addr, 1)
-                RETURNING purchase_id, buyer_id, date, address, fulfillment_status
-            ''', uid=buyer_id, addr=address)
-            
-            if not purchase_rows:
-                return None
-            
-            row = purchase_rows[0]
-            purchase_id = row[0]
-            buyer = row[1]
-            date = row[2]
-            address_db = row[3]
-            fulfillment_status = row[4]
-
-            # Insert ledger entries
-            for seller_id, product_id, quantity in cart_items:
-                app.db.execute('''
-                    INSERT INTO Ledger
-                    (purchase_id, seller_id, product_id, quantity, fulfillment_status)
-                    VALUES (:pid, :sid, :prod_id, :qty, 1)
-                ''', pid=purchase_id, sid=seller_id,
-                     prod_id=product_id, qty=quantity)
-
-            # Update buyer balance (decrement)
-            app.db.execute('''
-                UPDATE Users
-                SET balance = balance - :amount
-                WHERE id = :uid
-            ''', amount=totalprice, uid=buyer_id)
-
-            # Update seller balances (increment)
-            for seller_id, seller_total in seller_totals.items():
-                app.db.execute('''
-                    UPDATE Users
-                    SET balance = balance + :amount
-                    WHERE id = :sid
-                ''', amount=seller_total, sid=seller_id)
-
-            # Clear the cart
-            app.db.execute('''
-                DELETE FROM Cart
-                WHERE account_id = :uid
-            ''', uid=buyer_id)
-
-            return Purchase(purchase_id=purchase_id,
-                            address=address_db,
-                            date=date,
-                            buyer_id=buyer,
-                            fulfillment_status=fulfillment_status,
-                            items=items,
-                            totalprice=totalprice)
+        cart_rows = app.db.execute('''
+            SELECT c.seller_id, c.product_id, c.quantity,
+                   p.name, COALESCE(i.price, 0), p.category
+            FROM Cart c
+            JOIN Products p ON p.id = c.product_id
+            LEFT JOIN Inventory i ON i.product_id = c.product_id AND i.seller_id = c.seller_id
+            WHERE c.account_id = :uid
+            ORDER BY c.seller_id, c.product_id
+            FOR UPDATE OF c
+        ''', uid=buyer_id)
+
+        if not cart_rows:
+            return None
+
+        items = []
+        prices = []
+        total = Decimal('0.00')
+        for seller_id, product_id, quantity, name, price, category in cart_rows:
+            items.append({
+                'product_id': product_id,
+                'product_name': name,
+                'price': float(price),
+                'category': category,
+                'quantity': int(quantity),
+                'seller_id': seller_id,
+                'item_fulfillment_status': 1,
+            })
+            prices.append(Decimal(price))
+            total += Decimal(price) * int(quantity)
+
+        # Guarded decrement: no row back means the balance is too low.
+        charged = app.db.execute('''
+            UPDATE Users
+            SET balance = balance - :amount
+            WHERE id = :uid
+              AND balance >= :amount
+            RETURNING balance
+        ''', amount=total, uid=buyer_id)
+
+        if not charged:
+            return 'insufficient_balance'
+        User.invalidate(buyer_id)
+
+        # Create the purchase record with fulfillment_status=1
+        purchase_rows = app.db.execute('''
+            INSERT INTO Purchases (buyer_id, address, fulfillment_status)
+            VALUES (:uid, :addr, 1)
+            RETURNING purchase_id, buyer_id, date, address, fulfillment_status
+        ''', uid=buyer_id, addr=address)
+
+        purchase_id, buyer, date, address_db, fulfillment_status = purchase_rows[0]
+
+        # Ledger lines keep the price charged, whatever the listing does later
+        app.db.execute('''
+            INSERT INTO Ledger
+            (purchase_id, seller_id, product_id, quantity, fulfillment_status, unit_price, line_total)
+            SELECT :pid, w.seller_id, w.product_id, w.quantity, 1, w.unit_price, w.unit_price * w.quantity
+            FROM unnest(CAST(:sids AS INT[]), CAST(:pids AS INT[]), CAST(:qtys AS INT[]),
+                        CAST(:prices AS DECIMAL(12,2)[]))
+                 AS w(seller_id, product_id, quantity, unit_price)
+        ''', pid=purchase_id,
+            sids=[it['seller_id'] for it in items],
+            pids=[it['product_id'] for it in items],
+            qtys=[it['quantity'] for it in items],
+            prices=prices)
+
+        # Update seller balances (one aggregated increment per seller)
+        app.db.execute('''
+            UPDATE Users u
+            SET balance = u.balance + s.amount
+            FROM (
+                SELECT seller_id, SUM(line_total) AS amount
+                FROM Ledger
+                WHERE purchase_id = :pid
+                GROUP BY seller_id
+            ) s
+            WHERE u.id = s.seller_id
+        ''', pid=purchase_id)
+        UserStats.record_purchase(purchase_id, buyer_id)
+        SellerSales.record_purchase(purchase_id)
+
+        # Clear the cart
+        app.db.execute('''
+            DELETE FROM Cart
+            WHERE account_id = :uid
+        ''', uid=buyer_id)
+
+        # Take the stock: lock the rows first (in key order, so carts can't
+        # deadlock), then read the holds in a fresh snapshot (HELD_BY_OTHERS)
+        app.db.execute('''
+            SELECT 1
+            FROM Inventory i
+            JOIN unnest(CAST(:pids AS INT[]), CAST(:sids AS INT[])) AS w(product_id, seller_id)
+              ON w.product_id = i.product_id AND w.seller_id = i.seller_id
+            ORDER BY i.seller_id, i.product_id
+            FOR UPDATE OF i
+        ''', pids=[it['product_id'] for it in items],
+            sids=[it['seller_id'] for it in items])
+        taken = app.db.execute(f'''
+            WITH lines AS (
+                SELECT product_id, seller_id, quantity
+                FROM unnest(CAST(:pids AS INT[]), CAST(:sids AS INT[]), CAST(:qtys AS INT[]))
+                     AS w(product_id, seller_id, quantity)
+            ), held AS ({HELD_BY_OTHERS})
+            UPDATE Inventory i
+            SET quantity = i.quantity - l.quantity
+            FROM lines l
+            LEFT JOIN held h ON h.product_id = l.product_id AND h.seller_id = l.seller_id
+            WHERE i.product_id = l.product_id
+              AND i.seller_id = l.seller_id
+              AND i.quantity - COALESCE(h.quantity, 0) >= l.quantity
+            RETURNING i.product_id, i.seller_id
+        ''', uid=buyer_id,
+            pids=[it['product_id'] for it in items],
+            sids=[it['seller_id'] for it in items],
+            qtys=[it['quantity'] for it in items])
+
+        if len(taken) < len(items):
+            taken = {(pid, sid) for pid, sid in taken}
+            raise OutOfStock([it for it in items if (it['product_id'], it['seller_id']) not in taken])
+
+        app.db.execute('''
+            DELETE FROM stock_reservations
+            WHERE account_id = :uid
+        ''', uid=buyer_id)
+        app.cache.invalidate(*{f"product:{it['product_id']}" for it in items})
+
+        return Purchase(purchase_id=purchase_id,
+                        address=address_db,
+                        date=date,
+                        buyer_id=buyer,
+                        fulfillment_status=fulfillment_status,
+                        items=items,
+                        totalprice=float(total))
@@ -0,0 +1,120 @@
+import logging
+import threading
+
+from flask import current_app as app
+
+from ..db import transactional
+
+logger = logging.getLogger(__name__)
+
+# Units of each line in the `lines` CTE (product_id, seller_id, ...)
+# held by other buyers' unexpired reservations. Holds only change under
+# their Inventory row's lock, so lock the lines' rows in an earlier
+# statement: at READ COMMITTED a later statement's snapshot then includes
+# every hold committed while we waited for the locks.
+HELD_BY_OTHERS = '''
+    SELECT r.product_id, r.seller_id, SUM(r.quantity) AS quantity
+    FROM stock_reservations r
+    JOIN lines l ON l.product_id = r.product_id AND l.seller_id = r.seller_id
+    WHERE r.account_id <> :uid
+      AND r.expires_at > now()
+    GROUP BY r.product_id, r.seller_id
+'''
+
+
+class StockReservation:
+    """Short-lived holds on Inventory units for the lines in a buyer's cart.
+
+    With CART_RESERVATION_SECONDS > 0, changing the cart re-holds every
+    line for that long; a line is only held if the stock not held by
+    other buyers covers it. Checkout (Purchase.create_from_cart) cannot
+    take units other buyers hold, and releases the buyer's own holds.
+    Without reservations (the default) stock is only checked at checkout.
+    """
+
+    @staticmethod
+    def enabled():
+        return app.config.get('CART_RESERVATION_SECONDS', 0) > 0
+
+    @staticmethod
+    @transactional('reservation.hold_cart', isolation_level='READ COMMITTED')
+    def hold_cart(user_id):
+        """(Re)hold every line of the user's cart and drop all other holds,
+        including those of lines that can no longer be held. Returns the
+        (product_id, seller_id) lines that could not be held because other
+        buyers hold the remaining stock.
+
+        The Inventory rows are locked in key order (no deadlocks between
+        carts) for the length of this short transaction only, before the
+        holds are read (see HELD_BY_OTHERS).
+        """
+        locked = app.db.execute('''
+            SELECT i.product_id, i.seller_id
+            FROM Cart c
+            JOIN Inventory i ON i.product_id = c.product_id AND i.seller_id = c.seller_id
+            WHERE c.account_id = :uid
+            ORDER BY i.seller_id, i.product_id
+            FOR UPDATE OF i
+        ''', uid=user_id)
+
+        app.db.execute('''
+            DELETE FROM stock_reservations
+            WHERE account_id = :uid
+        ''', uid=user_id)
+
+        # Only the lines locked above: one added to the cart since is left
+        # to the hold_cart call of the request that added it
+        rows = app.db.execute(f'''
+            WITH lines AS (
+                SELECT c.product_id, c.seller_id, c.quantity, i.quantity AS stock
+                FROM Cart c
+                JOIN Inventory i ON i.product_id = c.product_id AND i.seller_id = c.seller_id
+                JOIN unnest(CAST(:pids AS INT[]), CAST(:sids AS INT[])) AS k(product_id, seller_id)
+                  ON k.product_id = c.product_id AND k.seller_id = c.seller_id
+                WHERE c.account_id = :uid
+            ), held AS ({HELD_BY_OTHERS})
+            INSERT INTO stock_reservations (account_id, product_id, seller_id, quantity, expires_at)
+            SELECT :uid, l.product_id, l.seller_id, l.quantity, now() + make_interval(secs => :ttl)
+            FROM lines l
+            LEFT JOIN held h ON h.product_id = l.product_id AND h.seller_id = l.seller_id
+            WHERE l.stock - COALESCE(h.quantity, 0) >= l.quantity
+            ON CONFLICT (account_id, product_id, seller_id)
+            DO UPDATE SET quantity = EXCLUDED.quantity, expires_at = EXCLUDED.expires_at
+            RETURNING product_id, seller_id
+        ''', uid=user_id, ttl=app.config['CART_RESERVATION_SECONDS'],
+            pids=[pid for pid, _ in locked], sids=[sid for _, sid in locked])
+        held = {(pid, sid) for pid, sid in rows}
+
+        lines = app.db.execute('''
+            SELECT product_id, seller_id FROM Cart WHERE account_id = :uid
+        ''', uid=user_id)
+        return [(pid, sid) for pid, sid in lines if (pid, sid) not in held]
+
+    @staticmethod
+    def expire():
+        """Delete expired reservations; returns how many went."""
+        return app.db.execute('''
+            DELETE FROM stock_reservations
+            WHERE expires_at <= now()
+        ''')
+
+
+def start_sweeper(app):
+    """Background thread deleting expired reservations every
+    CART_RESERVATION_SWEEP_SECONDS. Expired rows are already ignored by
+    every query, so this only keeps the table small."""
+    interval = app.config.get('CART_RESERVATION_SWEEP_SECONDS', 60)
+    stopped = threading.Event()
+
+    def sweep():
+        while not stopped.wait(interval):
+            try:
+                with app.app_context():
+                    count = StockReservation.expire()
+                if count:
+                    logger.info('expired %d stock reservations', count)
+            except Exception:
+                logger.exception('stock reservation sweep failed')
+
+    threading.Thread(target=sweep, name='reservation-sweeper', daemon=True).start()
+    return stopped
@@ -0,0 +1,198 @@
+from flask import current_app as app
+
+from ..db import transactional
+from .user_stats import UserStats
+
+
+class SellerOrder:
+    """One Ledger line sold by a seller, with its purchase and buyer.
+
+    Lines are listed newest purchase first: purchase ids are assigned in
+    checkout order, so (purchase_id, product_id) descending is the
+    chronological order and doubles as the keyset for pagination, served
+    by the Ledger (seller_id, [fulfillment_status,] purchase_id, product_id)
+    indexes.
+    """
+
+    # ?status= value -> Ledger.fulfillment_status (None: any)
+    STATUSES = {'all': None, 'incomplete': 0, 'complete': 1}
+
+    COLUMNS = '''
+        l.purchase_id, l.product_id, u.firstname, u.lastname, p.address,
+        l.quantity, l.line_total, p.date, l.fulfillment_status
+    '''
+
+    # Badge counts: all of a seller's lines by status, from the seller's
+    # user_stats row (one row even if there is none)
+    COUNTS = '''
+        SELECT COALESCE(MAX(lines_pending), 0) AS pending,
+               COALESCE(MAX(lines_sold - lines_pending), 0) AS complete
+        FROM user_stats
+        WHERE user_id = :seller_id
+    '''
+
+    def __init__(self, order_id, product_id, firstname, lastname, address,
+                 quantity, payment_amount, time_purchased, fulfillment_status):
+        self.order_id = order_id
+        self.product_id = product_id
+        self.buyer_name = f'{firstname} {lastname}'
+        self.address = address
+        self.quantity = int(quantity)
+        self.payment_amount = float(payment_amount)
+        self.time_purchased = time_purchased
+        self.status = 'Complete' if fulfillment_status == 1 else 'Pending'
+
+    def to_dict(self):
+        return {
+            'order_id': self.order_id,
+            'product_id': self.product_id,
+            'buyer_name': self.buyer_name,
+            'address': self.address,
+            'quantity': self.quantity,
+            'payment_amount': self.payment_amount,
+            'time_purchased': self.time_purchased.isoformat(),
+            'status': self.status,
+        }
+
+    @staticmethod
+    def _filters(seller_id, status='all', search=None):
+        """WHERE clause and params for a seller's lines.
+
+        `search` matches a substring of the order id, product id, buyer
+        name or shipping address, case-insensitively.
+        """
+        conditions = ['l.seller_id = :seller_id']
+        params = {'seller_id': seller_id}
+        if SellerOrder.STATUSES.get(status) is not None:
+            conditions.append('l.fulfillment_status = :status')
+            params['status'] = SellerOrder.STATUSES[status]
+        if search:
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append('''(
+                CAST(l.purchase_id AS TEXT) LIKE :pattern
+                OR CAST(l.product_id AS TEXT) LIKE :pattern
+                OR (u.firstname || ' ' || u.lastname) ILIKE :pattern
+                OR p.address ILIKE :pattern
+            )''')
+            params['pattern'] = f'%{escaped}%'
+        return ' AND '.join(conditions), params
+
+    @staticmethod
+    def counts(seller_id):
+        """(pending, complete) line counts for the seller."""
+        rows = app.db.execute(SellerOrder.COUNTS, seller_id=seller_id)
+        return rows[0][0], rows[0][1]
+
+    @staticmethod
+    def page(seller_id, status='all', search=None, after=None, limit=50):
+        """One page of the seller's lines plus the badge counts, in one query.
+
+        `after` is the (order_id, product_id) of the last line of the
+        previous page. Returns (lines, pending_count, complete_count); the
+        counts cover all of the seller's lines, whatever the filters.
+        """
+        where, params = SellerOrder._filters(seller_id, status, search)
+        if after is not None:
+            where += ' AND (l.purchase_id, l.product_id) < (:after_order, :after_product)'
+            params['after_order'], params['after_product'] = after
+        rows = app.db.execute(f'''
+            WITH counts AS ({SellerOrder.COUNTS}), page AS (
+                SELECT {SellerOrder.COLUMNS}
+                FROM Ledger l
+                JOIN Purchases p ON p.purchase_id = l.purchase_id
+                JOIN Users u ON u.id = p.buyer_id
+                WHERE {where}
+                ORDER BY l.purchase_id DESC, l.product_id DESC
+                LIMIT :limit
+            )
+            SELECT c.pending, c.complete, page.*
+            FROM counts c
+            LEFT JOIN page ON true
+            ORDER BY page.purchase_id DESC, page.product_id DESC
+        ''', limit=limit, **params)
+        pending, complete = rows[0][0], rows[0][1]
+        lines = [SellerOrder(*row[2:]) for row in rows if row[2] is not None]
+        return lines, pending, complete
+
+    @staticmethod
+    def export(seller_id, status='all', search=None):
+        """Every matching line, newest first, streamed (see DB.stream)."""
+        where, params = SellerOrder._filters(seller_id, status, search)
+        rows = app.db.stream(f'''
+            SELECT {SellerOrder.COLUMNS}
+            FROM Ledger l
+            JOIN Purchases p ON p.purchase_id = l.purchase_id
+            JOIN Users u ON u.id = p.buyer_id
+            WHERE {where}
+            ORDER BY l.purchase_id DESC, l.product_id DESC
+        ''', params)
+        return (SellerOrder(*row) for row in rows)
+
+    @staticmethod
+    @transactional('seller_order.set_fulfillment', isolation_level='READ COMMITTED')
+    def set_fulfillment(seller_id, fulfilled, lines=(), order_ids=()):
+        """Mark many of the seller's lines fulfilled (or back to pending) at once.
+
+        `lines` are (order_id, product_id) pairs; `order_ids` select every
+        one of the seller's lines in those orders. Lines already in the
+        target state, or not the seller's, are left alone. One UPDATE
+        changes the lines, then the status of just the purchases they
+        belong to is rolled up: a purchase is fulfilled once all of its
+        lines (from every seller) are.
+
+        The purchases are locked first, in id order, so sellers working
+        on the same purchase take turns and each roll-up sees the lines
+        the others committed.
+
+        Returns (changed lines as (order_id, product_id), purchases whose
+        status changed as (order_id, status)).
+        """
+        lines = [(int(order_id), int(product_id)) for order_id, product_id in lines]
+        order_ids = sorted({int(order_id) for order_id in order_ids})
+        purchase_ids = sorted({order_id for order_id, _ in lines} | set(order_ids))
+        if not purchase_ids:
+            return [], []
+
+        app.db.execute('''
+            SELECT purchase_id
+            FROM Purchases
+            WHERE purchase_id = ANY(CAST(:pids AS INT[]))
+            ORDER BY purchase_id
+            FOR UPDATE
+        ''', pids=purchase_ids)
+
+        changed = app.db.execute('''
+            UPDATE Ledger l
+            SET fulfillment_status = :status
+            WHERE l.purchase_id = ANY(CAST(:pids AS INT[]))
+              AND l.seller_id = :seller_id
+              AND l.fulfillment_status <> :status
+              AND (l.purchase_id = ANY(CAST(:whole AS INT[]))
+                   OR (l.purchase_id, l.product_id) IN (
+                       SELECT order_id, product_id
+                       FROM unnest(CAST(:orders AS INT[]), CAST(:products AS INT[]))
+                            AS w(order_id, product_id)))
+            RETURNING l.purchase_id, l.product_id
+        ''', status=1 if fulfilled else 0, seller_id=seller_id, pids=purchase_ids, whole=order_ids,
+            orders=[order_id for order_id, _ in lines],
+            products=[product_id for _, product_id in lines])
+        if not changed:
+            return [], []
+        UserStats.record_fulfillment(seller_id, fulfilled, len(changed))
+
+        rolled_up = app.db.execute('''
+            UPDATE Purchases p
+            SET fulfillment_status = s.status
+            FROM (
+                SELECT purchase_id, CASE WHEN bool_and(fulfillment_status = 1) THEN 1 ELSE 0 END AS status
+                FROM Ledger
+                WHERE purchase_id = ANY(CAST(:pids AS INT[]))
+                GROUP BY purchase_id
+            ) s
+            WHERE p.purchase_id = s.purchase_id
+              AND p.fulfillment_status <> s.status
+            RETURNING p.purchase_id, p.fulfillment_status
+        ''', pids=sorted({order_id for order_id, _ in changed}))
+
+        return ([(order_id, product_id) for order_id, product_id in changed],
+                [(order_id, status) for order_id, status in rolled_up])
@@ -0,0 +1,164 @@
+from flask import current_app as app
+
+from ..db import transactional
+
+
+class SellerSales:
+    """A seller's sales over time, for the analytics page.
+
+    Reads come from the seller_sales_daily and seller_product_sales_daily
+    rollups (one row per seller per UTC day, and per product), which
+    checkout adds to in the same transaction as the Ledger lines
+    (record_purchase); db/seller_sales.py rebuilds or verifies them.
+    Passing raw=True computes the same numbers from Ledger and Purchases
+    instead, to check the rollups against.
+    """
+
+    BUCKETS = ('day', 'week', 'month')
+
+    def __init__(self, bucket, orders=0, units=0, revenue=0):
+        self.bucket = bucket
+        self.orders = int(orders)
+        self.units = int(units)
+        self.revenue = float(revenue)
+
+    @staticmethod
+    def record_purchase(purchase_id):
+        """Add a just-written purchase to its sellers' rows for its day.
+
+        The purchase's day is locked in shared mode first, so a rebuild of
+        that day (refresh_seller_sales, which locks it exclusively) either
+        finishes before or counts this purchase after it commits; other
+        checkouts are not held up. Rows are locked in key order, so
+        concurrent checkouts selling for the same sellers cannot deadlock.
+        """
+        app.db.execute('''
+            SELECT pg_advisory_xact_lock_shared(hashtext('seller_sales_daily'),
+                                                (date AT TIME ZONE 'UTC')::DATE - DATE '2000-01-01')
+            FROM Purchases
+            WHERE purchase_id = :purchase_id
+        ''', purchase_id=purchase_id)
+        app.db.execute('''
+            INSERT INTO seller_sales_daily AS s (seller_id, day, orders, lines, units, revenue)
+            SELECT l.seller_id, (p.date AT TIME ZONE 'UTC')::DATE, 1, COUNT(*), SUM(l.quantity), SUM(l.line_total)
+            FROM Ledger l
+            JOIN Purchases p ON p.purchase_id = l.purchase_id
+            WHERE l.purchase_id = :purchase_id
+            GROUP BY l.seller_id, p.date
+            ORDER BY l.seller_id
+            ON CONFLICT (seller_id, day) DO UPDATE
+            SET orders = s.orders + EXCLUDED.orders,
+                lines = s.lines + EXCLUDED.lines,
+                units = s.units + EXCLUDED.units,
+                revenue = s.revenue + EXCLUDED.revenue
+        ''', purchase_id=purchase_id)
+        app.db.execute('''
+            INSERT INTO seller_product_sales_daily AS s (seller_id, day, product_id, orders, units, revenue)
+            SELECT l.seller_id, (p.date AT TIME ZONE 'UTC')::DATE, l.product_id, 1, l.quantity, l.line_total
+            FROM Ledger l
+            JOIN Purchases p ON p.purchase_id = l.purchase_id
+            WHERE l.purchase_id = :purchase_id
+            ORDER BY l.seller_id, l.product_id
+            ON CONFLICT (seller_id, day, product_id) DO UPDATE
+            SET orders = s.orders + EXCLUDED.orders,
+                units = s.units + EXCLUDED.units,
+                revenue = s.revenue + EXCLUDED.revenue
+        ''', purchase_id=purchase_id)
+
+    @staticmethod
+    @transactional('seller_sales.series', isolation_level='READ COMMITTED', read_only=True)
+    def series(seller_id, bucket, start, end, raw=False):
+        """Orders, units and revenue per `bucket` for days in [start, end).
+
+        Returns one SellerSales per bucket, oldest first, including the
+        empty ones; the first bucket starts at or before `start`.
+        """
+        if raw:
+            source = '''
+                SELECT (p.date AT TIME ZONE 'UTC')::DATE AS day,
+                       COUNT(DISTINCT l.purchase_id) AS orders, SUM(l.quantity) AS units,
+                       SUM(l.line_total) AS revenue
+                FROM Ledger l
+                JOIN Purchases p ON p.purchase_id = l.purchase_id
+                WHERE l.seller_id = :seller_id
+                  AND p.date >= CAST(:start AS TIMESTAMP) AT TIME ZONE 'UTC'
+                  AND p.date < CAST(:end AS TIMESTAMP) AT TIME ZONE 'UTC'
+                GROUP BY 1
+            '''
+        else:
+            source = '''
+                SELECT day, orders, units, revenue
+                FROM seller_sales_daily
+                WHERE seller_id = :seller_id
+                  AND day >= :start
+                  AND day < :end
+            '''
+        rows = app.db.execute(f'''
+            WITH days AS ({source}), totals AS (
+                SELECT CAST(date_trunc(:bucket, CAST(day AS TIMESTAMP)) AS DATE) AS bucket,
+                       SUM(orders) AS orders, SUM(units) AS units, SUM(revenue) AS revenue
+                FROM days
+                GROUP BY 1
+            )
+            SELECT CAST(b AS DATE), COALESCE(t.orders, 0), COALESCE(t.units, 0), COALESCE(t.revenue, 0)
+            FROM generate_series(date_trunc(:bucket, CAST(:start AS TIMESTAMP)),
+                                 CAST(:end AS TIMESTAMP) - INTERVAL '1 day',
+                                 CAST('1 ' || :bucket AS INTERVAL)) AS b
+            LEFT JOIN totals t ON t.bucket = CAST(b AS DATE)
+            ORDER BY 1
+        ''', seller_id=seller_id, bucket=bucket, start=start, end=end)
+        return [SellerSales(*row) for row in rows]
+
+    @staticmethod
+    @transactional('seller_sales.top_products', isolation_level='READ COMMITTED', read_only=True)
+    def top_products(seller_id, start, end, limit=10, raw=False):
+        """The seller's best-selling products by revenue for days in [start, end).
+
+        Returns (product_id, name, orders, units, revenue) tuples.
+        """
+        if raw:
+            source = '''
+                SELECT l.product_id, COUNT(*) AS orders, SUM(l.quantity) AS units,
+                       SUM(l.line_total) AS revenue
+                FROM Ledger l
+                JOIN Purchases p ON p.purchase_id = l.purchase_id
+                WHERE l.seller_id = :seller_id
+                  AND p.date >= CAST(:start AS TIMESTAMP) AT TIME ZONE 'UTC'
+                  AND p.date < CAST(:end AS TIMESTAMP) AT TIME ZONE 'UTC'
+                GROUP BY l.product_id
+            '''
+        else:
+            source = '''
+                SELECT product_id, SUM(orders) AS orders, SUM(units) AS units, SUM(revenue) AS revenue
+                FROM seller_product_sales_daily
+                WHERE seller_id = :seller_id
+                  AND day >= :start
+                  AND day < :end
+                GROUP BY product_id
+            '''
+        rows = app.db.execute(f'''
+            SELECT t.product_id, prod.name, t.orders, t.units, t.revenue
+            FROM ({source}) t
+            JOIN Products prod ON prod.id = t.product_id
+            ORDER BY t.revenue DESC, t.product_id
+            LIMIT :limit
+        ''', seller_id=seller_id, start=start, end=end, limit=limit)
+        return [(product_id, name, int(orders), int(units), float(revenue))
+                for product_id, name, orders, units, revenue in rows]
+
+    @staticmethod
+    def backlog(seller_id):
+        """The seller's unfulfilled lines: (lines, units, value, oldest purchase date).
+
+        Read live from Ledger through its (seller_id, fulfillment_status, ...)
+        index; only pending lines are visited.
+        """
+        rows = app.db.execute('''
+            SELECT COUNT(*), COALESCE(SUM(l.quantity), 0), COALESCE(SUM(l.line_total), 0), MIN(p.date)
+            FROM Ledger l
+            JOIN Purchases p ON p.purchase_id = l.purchase_id
+            WHERE l.seller_id = :seller_id
+              AND l.fulfillment_status = 0
+        ''', seller_id=seller_id)
+        lines, units, value, oldest = rows[0]
+        return lines, int(units), float(value), oldest
@@ -1,11 +1,26 @@
-from flask_login import UserMixin
-from flask import current_app as app
+import logging
+import time
+
+from flask_login import UserMixin, current_user
+from flask import current_app as app, has_request_context, session
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from .. import login
+from ..db import transactional
+from .user_stats import UserStats
 
+logger = logging.getLogger(__name__)
 
 class User(UserMixin):
+    # Kept in the signed (cookie) session so loading the logged-in user
+    # needs no query. Only small fixed-size fields: address and bio are
+    # unbounded text that could push the cookie past the browser's ~4KB
+    # limit, so they, like the balance, are fetched when a page uses them
+    IDENTITY_FIELDS = ('id', 'email', 'firstname', 'lastname')
+    IDENTITY_KEY = '_user_identity'
+
+    _UNLOADED = object()
+
     def __init__(self, id, email, firstname, lastname, address=None, balance=None, bio=None):
         self.id = id
         self.email = email
@@ -15,6 +30,44 @@ class User(UserMixin):
         self.balance = balance if balance is not None else 0.0
         self.bio = bio
 
+    @property
+    def address(self):
+        if self._address is User._UNLOADED:
+            self._load_profile()
+        return self._address
+
+    @address.setter
+    def address(self, value):
+        self._address = value
+
+    @property
+    def bio(self):
+        if self._bio is User._UNLOADED:
+            self._load_profile()
+        return self._bio
+
+    @bio.setter
+    def bio(self, value):
+        self._bio = value
+
+    def _load_profile(self):
+        rows = app.db.execute('''
+            SELECT address, bio
+            FROM Users
+            WHERE id = :id
+        ''', id=self.id)
+        self._address, self._bio = rows[0] if rows else (None, None)
+
+    @property
+    def balance(self):
+        if self._balance is None:
+            self._balance = User.get_balance(self.id)
+        return self._balance
+
+    @balance.setter
+    def balance(self, value):
+        self._balance = value
+
     @staticmethod
     def get_by_auth(email, password):
         rows = app.db.execute("""
@@ -62,7 +115,6 @@ RETURNING id
             return None
 
     @staticmethod
-    @login.user_loader
     def get(id):
         rows = app.db.execute("""
 SELECT id, email, firstname, lastname, address, balance, bio
@@ -72,6 +124,85 @@ WHERE id = :id
                               id=id)
         return User(*(rows[0])) if rows else None
 
+    @staticmethod
+    def get_balance(id):
+        rows = app.db.execute("""
+SELECT balance
+FROM Users
+WHERE id = :id
+""",
+                              id=id)
+        return rows[0][0] if rows else 0.0
+
+    @staticmethod
+    def _trust_identity():
+        """Whether the session copy can be used at all: only when the
+        cache's tag versions are shared by every worker (CACHE_BACKEND=redis).
+        With the in-process cache each worker has its own `user:<id>`
+        version, so an invalidation in one worker never reaches the others."""
+        return app.cache.enabled and app.cache.shared is not None
+
+    @staticmethod
+    def _identity_version(user_id):
+        """The user's current `user:<id>` version, or None if the cache cannot
+        be reached; the session copy is then not trusted (nor stored)."""
+        try:
+            return app.cache.version(f'user:{user_id}')
+        except Exception:
+            logger.exception('user version lookup failed for %s', user_id)
+            return None
+
+    @staticmethod
+    @login.user_loader
+    def load(id):
+        """user_loader: rebuild the logged-in user from the identity in the
+        session while it is younger than USER_CACHE_TTL and the user has not
+        been invalidated since; otherwise read Users and store it afresh."""
+        identity = session.get(User.IDENTITY_KEY)
+        # Read before Users, so an invalidation in between only makes the
+        # stored copy look stale, never a stale copy look current
+        version = User._identity_version(id) if User._trust_identity() else None
+        if identity and version is not None and str(identity['id']) == str(id) \
+                and time.time() - identity['at'] < app.config.get('USER_CACHE_TTL', 60) \
+                and identity['v'] == version:
+            user = User(*(identity[field] for field in User.IDENTITY_FIELDS))
+            # Loaded on first use
+            user.balance = None
+            user.address = user.bio = User._UNLOADED
+            return user
+        user = User.get(id)
+        if user is not None and version is not None:
+            user.remember(version)
+        return user
+
+    def remember(self, version=None):
+        """Store this user's identity in the session for User.load, tagged
+        with the user's cache `version` (looked up if not given)."""
+        if not User._trust_identity():
+            return
+        if version is None:
+            version = User._identity_version(self.id)
+            if version is None:
+                return
+        identity = {field: getattr(self, field) for field in User.IDENTITY_FIELDS}
+        identity['at'] = time.time()
+        identity['v'] = version
+        session[User.IDENTITY_KEY] = identity
+
+    @staticmethod
+    def invalidate(user_id):
+        """Drop cached copies of the user after a change to their row: the
+        identity in every session (through the version check in load) and
+        the balance already read in this request."""
+        app.cache.invalidate(f'user:{user_id}')
+        if not has_request_context():
+            return
+        identity = session.get(User.IDENTITY_KEY)
+        if identity and str(identity['id']) == str(user_id):
+            session.pop(User.IDENTITY_KEY)
+        if current_user.is_authenticated and str(current_user.id) == str(user_id):
+            current_user.balance = None
+
 
     @staticmethod
     def update(user_id, email, firstname, lastname, address, bio, password=None):
@@ -107,9 +238,11 @@ WHERE id = :id
             """, email=email, firstname=firstname, lastname=lastname,
             address=address, bio=bio, uid=user_id)
 
+        User.invalidate(user_id)
         return "ok"
     
     @staticmethod
+    @transactional('user.topup')
     def topup(user_id, amount):
         """Add amount to user's balance."""
         app.db.execute("""
@@ -118,8 +251,10 @@ WHERE id = :id
                        WHERE id= :id
                     """,
                        amount=amount, id=user_id)
+        User.invalidate(user_id)
         return "ok"
     @staticmethod
+    @transactional('user.withdraw')
     def withdraw(user_id, amount):
         """Deduct amount from user's balance."""
         app.db.execute("""
@@ -128,46 +263,22 @@ WHERE id = :id
                        WHERE id= :id
                     """,
                        amount=amount, id=user_id)
+        User.invalidate(user_id)
         return "ok"
     
     @staticmethod
     def getTotalSpending(userId):
-        """Gets sum of prices (quantity * price) for all items bought by the user.
-
-        Note: uses Inventory.price at query time (may differ from price at purchase time).
+        """Gets sum of line totals (quantity * price paid) for all items bought by the user.
 
-        Worth of Purchased Items
+        Worth of Purchased Items (kept in user_stats, see UserStats)
         """
-        rows = app.db.execute("""
-            SELECT SUM(l.quantity * COALESCE(i.price, 0))
-            FROM Ledger l
-            JOIN Purchases p ON p.purchase_id = l.purchase_id
-            LEFT JOIN Inventory i
-            ON i.seller_id = l.seller_id
-            AND i.product_id = l.product_id
-            WHERE p.buyer_id = :id
-        """, id=userId)
-
-        return float(rows[0][0]) if rows and rows[0][0] is not None else 0.0
+        return UserStats.get(userId).total_spent
 
 
     @staticmethod
     def getTotalProfit(userId):
-        """Gets sum of revenue (quantity * price) for all items sold by the user.
-
-        Note: uses Inventory.price at query time (may differ from price at purchase time).
+        """Gets sum of revenue (quantity * price paid) for all items sold by the user.
 
-        Value of Sold Inventory (at current prices)
+        Value of Sold Inventory (at the prices sold; kept in user_stats)
         """
-        rows = app.db.execute("""
-            SELECT SUM(l.quantity * COALESCE(i.price, 0))
-            FROM Ledger l
-            LEFT JOIN Inventory i
-            ON i.seller_id = l.seller_id
-            AND i.product_id = l.product_id
-            WHERE l.seller_id = :id
-        """, id=userId)
-
-        return float(rows[0][0]) if rows and rows[0][0] is not None else 0.0
-
-
+        return UserStats.get(userId).total_revenue
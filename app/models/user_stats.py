@@ -0,0 +1,86 @@
+from flask import current_app as app
+
+
+class UserStats:
+    """A user's lifetime totals as buyer and as seller (the user_stats table).
+
+    Checkout (record_purchase) and fulfillment (record_fulfillment) add
+    their changes in the same transaction as the Ledger writes, so reading
+    the totals is one primary-key lookup however long the history is.
+    db/user_stats.py rebuilds or verifies the table from Ledger.
+    """
+
+    FIELDS = ('orders_placed', 'total_spent', 'orders_sold', 'lines_sold',
+              'units_sold', 'total_revenue', 'lines_pending')
+
+    def __init__(self, user_id, orders_placed=0, total_spent=0, orders_sold=0, lines_sold=0,
+                 units_sold=0, total_revenue=0, lines_pending=0):
+        self.user_id = user_id
+        self.orders_placed = orders_placed
+        self.total_spent = float(total_spent)
+        self.orders_sold = orders_sold
+        self.lines_sold = lines_sold
+        self.units_sold = int(units_sold)
+        self.total_revenue = float(total_revenue)
+        self.lines_pending = lines_pending
+
+    @property
+    def lines_fulfilled(self):
+        return self.lines_sold - self.lines_pending
+
+    @staticmethod
+    def get(user_id):
+        """The user's totals; all zero for a user who never bought or sold."""
+        rows = app.db.execute(f'''
+            SELECT user_id, {', '.join(UserStats.FIELDS)}
+            FROM user_stats
+            WHERE user_id = :user_id
+        ''', user_id=user_id)
+        return UserStats(*rows[0]) if rows else UserStats(user_id)
+
+    @staticmethod
+    def record_purchase(purchase_id, buyer_id):
+        """Add a just-written purchase to its buyer's and sellers' totals.
+
+        One upsert for every user involved (the buyer may also be one of
+        the sellers), rows locked in user id order.
+        """
+        app.db.execute('''
+            INSERT INTO user_stats AS s (user_id, orders_placed, total_spent, orders_sold,
+                                         lines_sold, units_sold, total_revenue, lines_pending)
+            SELECT user_id, SUM(orders_placed), SUM(total_spent), SUM(orders_sold),
+                   SUM(lines_sold), SUM(units_sold), SUM(total_revenue), SUM(lines_pending)
+            FROM (
+                SELECT :buyer_id AS user_id, 1 AS orders_placed, SUM(line_total) AS total_spent,
+                       0 AS orders_sold, 0 AS lines_sold, 0 AS units_sold, 0 AS total_revenue,
+                       0 AS lines_pending
+                FROM Ledger
+                WHERE purchase_id = :purchase_id
+                UNION ALL
+                SELECT seller_id, 0, 0, 1, COUNT(*), SUM(quantity), SUM(line_total),
+                       COUNT(*) FILTER (WHERE fulfillment_status = 0)
+                FROM Ledger
+                WHERE purchase_id = :purchase_id
+                GROUP BY seller_id
+            ) d
+            GROUP BY user_id
+            ORDER BY user_id
+            ON CONFLICT (user_id) DO UPDATE
+            SET orders_placed = s.orders_placed + EXCLUDED.orders_placed,
+                total_spent = s.total_spent + EXCLUDED.total_spent,
+                orders_sold = s.orders_sold + EXCLUDED.orders_sold,
+                lines_sold = s.lines_sold + EXCLUDED.lines_sold,
+                units_sold = s.units_sold + EXCLUDED.units_sold,
+                total_revenue = s.total_revenue + EXCLUDED.total_revenue,
+                lines_pending = s.lines_pending + EXCLUDED.lines_pending
+        ''', purchase_id=purchase_id, buyer_id=buyer_id)
+
+    @staticmethod
+    def record_fulfillment(seller_id, fulfilled, count):
+        """`count` of the seller's lines just changed to fulfilled (or back to pending)."""
+        if count:
+            app.db.execute('''
+                UPDATE user_stats
+                SET lines_pending = lines_pending + :delta
+                WHERE user_id = :seller_id
+            ''', delta=-count if fulfilled else count, seller_id=seller_id)
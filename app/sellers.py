@@ -1,11 +1,19 @@
 # app/sellers.py
-from flask import Blueprint, jsonify, render_template, abort, flash, redirect, url_for, request
+import csv
+import io
+import json
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from flask import Blueprint, Response, jsonify, render_template, abort, flash, redirect, url_for, request, stream_with_context
 from flask_login import login_required, current_user
 from flask import current_app as app
 from math import ceil
 
 from .models.inventory import InventoryItem
 from .models.product import Product
+from .models.seller_order import SellerOrder
+from .models.seller_sales import SellerSales
 from .models.user import User
 
 
@@ -276,163 +284,181 @@ def add(product_id):
 # SELLER ORDER HISTORY / FULFILLMENT (using Purchases + Ledger)
 # ─────────────────────────────────────────────────────────────────────────────
 
+ORDERS_PER_PAGE = 50
+EXPORT_COLUMNS = ['order_id', 'product_id', 'buyer_name', 'address', 'quantity',
+                  'payment_amount', 'time_purchased', 'status']
+
+
+def _order_filters(args):
+    status_filter = args.get('status', 'all')  # 'incomplete' | 'complete' | 'all'
+    if status_filter not in SellerOrder.STATUSES:
+        status_filter = 'all'
+    search = args.get('q', '').strip()
+    return status_filter, search
+
+
+def _orders_page(args):
+    """Template context for one page of the orders list, as selected by
+    `args` (?status=, ?q= and the ?after_order=/?after_product= keyset)."""
+    status_filter, search = _order_filters(args)
+    after_order = args.get('after_order', type=int)
+    after_product = args.get('after_product', type=int)
+    after = (after_order, after_product) if after_order is not None and after_product is not None else None
+
+    # One extra row tells us whether there is an older page
+    transactions, pending_count, complete_count = SellerOrder.page(
+        current_user.id, status_filter, search, after, ORDERS_PER_PAGE + 1)
+    next_args = None
+    if len(transactions) > ORDERS_PER_PAGE:
+        transactions = transactions[:ORDERS_PER_PAGE]
+        last = transactions[-1]
+        next_args = {'status': status_filter, 'q': search,
+                     'after_order': last.order_id, 'after_product': last.product_id}
+
+    return {
+        'transactions': transactions,
+        'status_filter': status_filter,
+        'search': search,
+        'after': after,
+        'pending_count': pending_count,
+        'complete_count': complete_count,
+        'next_args': next_args,
+        'first_page': after is None,
+    }
+
+
 @bp.route('/orders', methods=['GET'])
 @login_required
 def seller_orders():
     """
     Show this seller's orders (each row is a line item),
-    sorted reverse‑chronologically.
-    Uses Purchases + Ledger + Users (+ Inventory for current price).
+    newest first, ORDERS_PER_PAGE at a time.
+    Filtering, search and paging all happen in SQL; ?after_order= and
+    ?after_product= name the last line of the previous page.
     """
-    seller_id = current_user.id
-
-    status_filter = request.args.get('status', 'all')  # 'incomplete' | 'complete' | 'all'
-    search = request.args.get('q', '').strip().lower()
-
-    # Pull all line items for this seller, newest purchases first.
-    # NOTE: schema from your create.sql:
-    #   Purchases(purchase_id, address, date, buyer_id, fulfillment_status)
-    #   Ledger(purchase_id, seller_id, product_id, quantity, fulfillment_status)
-    #   Users(id, firstname, lastname, address, ...)
-    #   Inventory(seller_id, product_id, price, ...)
-    rows = app.db.execute(
-        """
-        SELECT
-            p.purchase_id                    AS order_id,
-            l.product_id,
-            u.firstname,
-            u.lastname,
-            p.address                        AS buyer_address,
-            l.quantity,
-            COALESCE(i.price, 0) * l.quantity AS payment_amount,
-            p.date                           AS time_purchased,
-            l.fulfillment_status
-        FROM Purchases p
-        JOIN Ledger l
-          ON l.purchase_id = p.purchase_id
-        JOIN Users u
-          ON u.id = p.buyer_id
-        LEFT JOIN Inventory i
-          ON i.seller_id = l.seller_id
-         AND i.product_id = l.product_id
-        WHERE l.seller_id = :seller_id
-        ORDER BY p.date DESC
-        """,
-        seller_id=seller_id,
-    )
+    return render_template("seller_orders.html", **_orders_page(request.args))
 
-    transactions = []
-    for row in rows:
-        status_int = row[8]  # l.fulfillment_status
-        status_str = "Complete" if status_int == 1 else "Pending"
-
-        t = {
-            "order_id": row[0],
-            "product_id": row[1],
-            "buyer_name": f"{row[2]} {row[3]}",
-            "address": row[4],
-            "quantity": int(row[5]),
-            "payment_amount": float(row[6]),  # may be 0 if no Inventory row
-            "time_purchased": row[7],
-            "status": status_str,
-        }
-        transactions.append(t)
-
-    # Filter by status
-    if status_filter == "incomplete":
-        transactions = [t for t in transactions if t["status"] != "Complete"]
-    elif status_filter == "complete":
-        transactions = [t for t in transactions if t["status"] == "Complete"]
-    # 'all' → no extra filtering
-
-    # Simple text search (order id, product id, buyer, address)
-    if search:
-        search_lc = search.lower()
-        filtered = []
-        for t in transactions:
-            if (
-                search_lc in str(t["order_id"]).lower()
-                or search_lc in str(t["product_id"]).lower()
-                or search_lc in t["buyer_name"].lower()
-                or search_lc in (t["address"] or "").lower()
-            ):
-                filtered.append(t)
-        transactions = filtered
-
-    # Counts for summary badges
-    pending_count = app.db.execute(
-        """
-        SELECT COUNT(*)
-        FROM Ledger
-        WHERE seller_id = :seller_id AND fulfillment_status = 0
-        """,
-        seller_id=seller_id,
-    )[0][0]
 
-    complete_count = app.db.execute(
-        """
-        SELECT COUNT(*)
-        FROM Ledger
-        WHERE seller_id = :seller_id AND fulfillment_status = 1
-        """,
-        seller_id=seller_id,
-    )[0][0]
-
-    return render_template(
-        "seller_orders.html",
-        transactions=transactions,
-        status_filter=status_filter,
-        search=search,
-        pending_count=pending_count,
-        complete_count=complete_count,
-    )
+@bp.route('/orders/export.<fmt>', methods=['GET'])
+@login_required
+def export_orders(fmt):
+    """
+    Download the seller's full order history (same ?status= and ?q=
+    filters as the orders page) as CSV or JSON, streamed row by row.
+    """
+    if fmt not in ('csv', 'json'):
+        abort(404)
+    status_filter, search = _order_filters(request.args)
+    lines = SellerOrder.export(current_user.id, status_filter, search)
+
+    def as_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for line in lines:
+            writer.writerow([line.to_dict()[column] for column in EXPORT_COLUMNS])
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def as_json():
+        yield '['
+        separator = '\n'
+        for line in lines:
+            yield separator + json.dumps(line.to_dict())
+            separator = ',\n'
+        yield '\n]\n'
+
+    body = as_csv() if fmt == 'csv' else as_json()
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/json'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=orders-{current_user.id}.{fmt}'
+    response.cache_control.no_store = True
+    return response
+
+
+# Most lines one /orders/fulfillment request may name
+FULFILL_MAX_LINES = 500
+
+
+def _parse_line(raw):
+    """(order_id, product_id) from {"order_id": .., "product_id": ..} or "order_id:product_id"."""
+    if isinstance(raw, dict):
+        return int(raw['order_id']), int(raw['product_id'])
+    order_id, product_id = str(raw).split(':')
+    return int(order_id), int(product_id)
+
+
+@bp.route('/orders/fulfillment', methods=['POST'])
+@login_required
+def fulfill_lines():
+    """
+    Mark many of this seller's line items fulfilled (or pending again)
+    in one request and one transaction; see SellerOrder.set_fulfillment.
+
+    JSON: {"fulfilled": true|false (a JSON boolean), "lines": [{"order_id": .., "product_id": ..}, ...],
+           "orders": [order_id, ...]}  ("orders" = every line of yours in those orders)
+    Responds with the changed lines, the purchases whose status changed
+    and the new badge counts.
+
+    Form posts (the orders page) send `fulfilled`, repeated `line`
+    ("order_id:product_id") and `order` fields. Via HTMX they also send
+    the page's filters and get the re-rendered orders list back;
+    without it they are redirected back with a flash message.
+    """
+    data = request.get_json(silent=True)
+    try:
+        if data is None:
+            fulfilled = request.form.get('fulfilled', '1') not in ('0', 'false')
+            lines = [_parse_line(raw) for raw in request.form.getlist('line')]
+            order_ids = [int(raw) for raw in request.form.getlist('order')]
+        else:
+            fulfilled = data.get('fulfilled', True)
+            lines = [_parse_line(raw) for raw in data.get('lines') or []]
+            order_ids = [int(raw) for raw in data.get('orders') or []]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return jsonify({'error': 'expected "lines" as order_id/product_id pairs and "orders" as ids'}), 400
+    if not isinstance(fulfilled, bool):
+        # "false" or 0 must not be read as true
+        return jsonify({'error': '"fulfilled" must be true or false'}), 400
+    if len(lines) + len(order_ids) > FULFILL_MAX_LINES:
+        return jsonify({'error': f'at most {FULFILL_MAX_LINES} lines and orders per request'}), 400
+
+    changed, purchases = SellerOrder.set_fulfillment(current_user.id, fulfilled, lines, order_ids)
+
+    if data is None:
+        message = f"Marked {len(changed)} line item(s) {'fulfilled' if fulfilled else 'pending'}."
+        if not request.headers.get('HX-Request'):
+            flash(message, "success")
+            return redirect(request.referrer or url_for('sellers.seller_orders'))
+        context = _orders_page(request.form)
+        context['message'] = message
+        return render_template("_seller_orders_table.html", **context)
+
+    pending_count, complete_count = SellerOrder.counts(current_user.id)
+    return jsonify({
+        'ok': True,
+        'updated': [{'order_id': o, 'product_id': p} for o, p in changed],
+        'orders': [{'order_id': o, 'fulfilled': status == 1} for o, status in purchases],
+        'pending_count': pending_count,
+        'complete_count': complete_count,
+    })
 
 
 @bp.route('/orders/<int:order_id>/product/<int:product_id>/fulfill', methods=['POST'])
 @login_required
 def mark_line_item_fulfilled(order_id, product_id):
     """
-    Mark a single line item as fulfilled for the current seller.
-    Uses Ledger.fulfillment_status.
+    Mark a single line item as fulfilled for the current seller
+    (the form fallback for the orders page; see fulfill_lines).
     Does NOT touch Inventory (stock was updated at purchase time).
     """
-    seller_id = current_user.id
-
-    rows = app.db.execute(
-        """
-        UPDATE Ledger
-        SET fulfillment_status = 1
-        WHERE purchase_id       = :purchase_id
-          AND product_id        = :product_id
-          AND seller_id         = :seller_id
-          AND fulfillment_status = 0
-        RETURNING purchase_id
-        """,
-        purchase_id=order_id,
-        product_id=product_id,
-        seller_id=seller_id,
-    )
+    changed, _ = SellerOrder.set_fulfillment(current_user.id, True, [(order_id, product_id)])
 
-    if rows:
+    if changed:
         flash(f"Marked order #{order_id}, product {product_id} as fulfilled.", "success")
-        purchase_id = rows[0][0]
-
-        # OPTIONAL: If you want to also update Purchases.fulfillment_status once
-        # all items are fulfilled, you can uncomment this block:
-        #
-        # app.db.execute(
-        #     """
-        #     UPDATE Purchases
-        #     SET fulfillment_status = 1
-        #     WHERE purchase_id = :purchase_id
-        #       AND NOT EXISTS (
-        #           SELECT 1 FROM Ledger
-        #           WHERE purchase_id = :purchase_id
-        #             AND fulfillment_status = 0
-        #       )
-        #     """,
-        #     purchase_id=purchase_id,
-        # )
     else:
         flash(
             "Could not mark this line item as fulfilled. "
@@ -449,24 +475,9 @@ def mark_line_item_unfulfilled(order_id, product_id):
     Reverse fulfillment for a single line item.
     Marks Ledger.fulfillment_status back to 0.
     """
-    seller_id = current_user.id
-
-    rows = app.db.execute(
-        """
-        UPDATE Ledger
-        SET fulfillment_status = 0
-        WHERE purchase_id       = :purchase_id
-          AND product_id        = :product_id
-          AND seller_id         = :seller_id
-          AND fulfillment_status = 1
-        RETURNING purchase_id
-        """,
-        purchase_id=order_id,
-        product_id=product_id,
-        seller_id=seller_id,
-    )
+    changed, _ = SellerOrder.set_fulfillment(current_user.id, False, [(order_id, product_id)])
 
-    if rows:
+    if changed:
         flash(f"Marked order #{order_id}, product {product_id} as UNFULFILLED.", "warning")
     else:
         flash(
@@ -476,3 +487,73 @@ def mark_line_item_unfulfilled(order_id, product_id):
         )
 
     return redirect(request.referrer or url_for('sellers.seller_orders'))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# SALES ANALYTICS (from the seller_sales_daily rollups)
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Range shown when ?from= is not given, per bucket
+ANALYTICS_DEFAULT_DAYS = {'day': 30, 'week': 182, 'month': 365}
+ANALYTICS_MAX_DAYS = 3 * 366
+TOP_PRODUCTS = 10
+
+
+def _analytics_range(args, bucket):
+    """[start, end) dates from ?from= and ?to= (both inclusive, YYYY-MM-DD),
+    defaulting to the last ANALYTICS_DEFAULT_DAYS[bucket] days (UTC)."""
+    today = datetime.now(timezone.utc).date()
+    try:
+        end = date.fromisoformat(args['to']) + timedelta(days=1) if args.get('to') else today + timedelta(days=1)
+        start = (date.fromisoformat(args['from']) if args.get('from')
+                 else end - timedelta(days=ANALYTICS_DEFAULT_DAYS[bucket]))
+    except ValueError:
+        abort(400, description='from and to must be dates (YYYY-MM-DD)')
+    if start >= end:
+        abort(400, description='from must not be after to')
+    return max(start, end - timedelta(days=ANALYTICS_MAX_DAYS)), end
+
+
+@bp.route('/analytics', methods=['GET'])
+@login_required
+def sales_analytics():
+    """
+    Revenue, units and orders per day, week or month, top products and the
+    fulfillment backlog for this seller.
+    ?bucket=day|week|month, ?from= and ?to= pick the range (UTC days);
+    ?source=raw recomputes everything from Ledger instead of the rollups,
+    to check them against.
+    """
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in SellerSales.BUCKETS:
+        bucket = 'day'
+    raw = request.args.get('source') == 'raw'
+    start, end = _analytics_range(request.args, bucket)
+
+    started = time.perf_counter()
+    series = SellerSales.series(current_user.id, bucket, start, end, raw=raw)
+    top_products = SellerSales.top_products(current_user.id, start, end, TOP_PRODUCTS, raw=raw)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    pending_lines, pending_units, pending_value, oldest_pending = SellerSales.backlog(current_user.id)
+
+    return render_template(
+        'seller_analytics.html',
+        series=series,
+        top_products=top_products,
+        bucket=bucket,
+        buckets=SellerSales.BUCKETS,
+        start=start,
+        last_day=end - timedelta(days=1),
+        raw=raw,
+        elapsed_ms=elapsed_ms,
+        totals={
+            'orders': sum(s.orders for s in series),
+            'units': sum(s.units for s in series),
+            'revenue': sum(s.revenue for s in series),
+        },
+        peak_revenue=max((s.revenue for s in series), default=0),
+        pending_lines=pending_lines,
+        pending_units=pending_units,
+        pending_value=pending_value,
+        oldest_pending=oldest_pending,
+    )
@@ -0,0 +1,279 @@
+"""Per-request SQL instrumentation (enabled with SQL_PROFILE=1).
+
+Every statement run through `DB.execute` during a request is recorded
+with its fingerprint (the SQL with literals and whitespace normalized),
+duration, row count and the model method that issued it. At the end of
+the request:
+
+* the response carries X-DB-Queries, X-DB-Time-Ms and a Server-Timing
+  entry (browser dev tools show it next to the request);
+* repeated statements are flagged: the same fingerprint from the same
+  caller SQL_N_PLUS_ONE_THRESHOLD+ times is an N+1 loop, and the same
+  statement with the same parameters twice is a redundant re-fetch;
+  both are logged as warnings;
+* the request is kept in a short history shown at /debug/sql, and
+  process-wide counters are exported at /metrics in the Prometheus
+  text format.
+
+Parameter values are never kept: the log shows only their types and
+lengths (login emails, password hashes and addresses pass through
+here). /debug/sql and /metrics answer only in debug mode or to the
+client addresses listed in SQL_PROFILE_ALLOW; everyone else gets a 404.
+
+Statements slower than SQL_SLOW_QUERY_MS are logged whether or not they
+repeat.
+"""
+import hashlib
+import json
+import logging
+import re
+import sys
+import threading
+from collections import Counter, defaultdict, deque
+
+from flask import Blueprint, Response, abort, current_app, g, request
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_SPACE = re.compile(r'\s+')
+
+# Statement latency buckets (seconds) for the Prometheus histogram
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def fingerprint(sql):
+    """Normalize SQL so statements that differ only in literals compare equal."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _LIST.sub('(?)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint_id(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def caller():
+    """'Class.method' of the innermost app.models frame issuing the statement."""
+    frame = sys._getframe(2)
+    fallback = None
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if '/app/models/' in filename.replace('\\', '/'):
+            return frame.f_code.co_qualname
+        if fallback is None and '/app/' in filename.replace('\\', '/') \
+                and not filename.endswith(('db.py', 'sqlprofile.py')):
+            fallback = frame.f_code.co_qualname
+        frame = frame.f_back
+    return fallback or '?'
+
+
+def redact(params):
+    """Parameter shapes without their values, e.g. {'email': 'str[17]', 'id': 'int'}."""
+    def shape(value):
+        if isinstance(value, (str, bytes, list, tuple)):
+            return f'{type(value).__name__}[{len(value)}]'
+        return type(value).__name__
+    if isinstance(params, dict):
+        return {name: shape(value) for name, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [shape(value) for value in params]
+    return shape(params)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class SQLProfiler:
+    def __init__(self, app):
+        self.n_plus_one_threshold = app.config.get('SQL_N_PLUS_ONE_THRESHOLD', 5)
+        self.slow_ms = app.config.get('SQL_SLOW_QUERY_MS', 0)
+        self.history = deque(maxlen=app.config.get('SQL_PROFILE_HISTORY', 50))
+        self._lock = threading.Lock()
+        self.fingerprints = {}  # id -> fingerprint text
+        # (caller, fingerprint id) -> [count, seconds, rows, bucket counts...]
+        self.statements = defaultdict(lambda: [0, 0.0, 0] + [0] * len(BUCKETS))
+        self.requests = Counter()           # endpoint -> requests
+        self.request_statements = Counter()  # endpoint -> statements
+        self.flags = Counter()              # (kind, caller, fingerprint id) -> times flagged
+
+        app.db.profiler = self
+        app.after_request(self._finish_request)
+        app.register_blueprint(bp)
+
+    def record(self, sql, params, seconds, rows):
+        """Called by DB.execute for each statement run inside a request."""
+        log = g.get('_sql_log')
+        if log is None:
+            log = g._sql_log = []
+        text = fingerprint(sql)
+        entry = {
+            'fingerprint': text,
+            'id': fingerprint_id(text),
+            'caller': caller(),
+            'ms': round(seconds * 1000, 3),
+            'rows': rows,
+            'params': redact(params),
+            # Tells the same parameters apart without keeping them; dropped
+            # before the request goes into the history
+            'params_key': hash(repr(params)),
+        }
+        log.append(entry)
+        if self.slow_ms and entry['ms'] >= self.slow_ms:
+            logger.warning('slow statement (%.1f ms) from %s: %s', entry['ms'], entry['caller'], text[:300])
+
+    def _finish_request(self, response):
+        log = g.pop('_sql_log', [])
+        endpoint = request.endpoint or request.path
+        total_ms = sum(e['ms'] for e in log)
+        flags = self._flag(log)
+        for entry in log:
+            entry.pop('params_key', None)
+
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.request_statements[endpoint] += len(log)
+            for entry in log:
+                self.fingerprints[entry['id']] = entry['fingerprint']
+                stats = self.statements[(entry['caller'], entry['id'])]
+                stats[0] += 1
+                stats[1] += entry['ms'] / 1000
+                stats[2] += entry['rows'] or 0
+                for i, bound in enumerate(BUCKETS):
+                    if entry['ms'] / 1000 <= bound:
+                        stats[3 + i] += 1
+            for flag in flags:
+                self.flags[(flag['kind'], flag['caller'], flag['id'])] += 1
+            self.history.append({
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'endpoint': endpoint,
+                'status': response.status_code,
+                'statements': len(log),
+                'db_ms': round(total_ms, 3),
+                'flags': flags,
+                'log': log,
+            })
+
+        for flag in flags:
+            logger.warning('%s in %s: %s ran %d times (%s)', flag['kind'], endpoint,
+                           flag['caller'], flag['count'], flag['fingerprint'][:200])
+        response.headers['X-DB-Queries'] = str(len(log))
+        response.headers['X-DB-Time-Ms'] = f'{total_ms:.1f}'
+        response.headers.add('Server-Timing', f'db;dur={total_ms:.1f};desc="{len(log)} statements"')
+        return response
+
+    def _flag(self, log):
+        flags = []
+        by_site = Counter((e['caller'], e['id']) for e in log)
+        for (site, fid), count in by_site.items():
+            if count >= self.n_plus_one_threshold:
+                text = next(e['fingerprint'] for e in log if e['id'] == fid)
+                flags.append({'kind': 'n+1', 'caller': site, 'id': fid, 'count': count, 'fingerprint': text})
+        exact = Counter((e['caller'], e['id'], e['params_key']) for e in log)
+        for (site, fid, _), count in exact.items():
+            if count > 1 and by_site[(site, fid)] < self.n_plus_one_threshold:
+                text = next(e['fingerprint'] for e in log if e['id'] == fid)
+                flags.append({'kind': 'duplicate', 'caller': site, 'id': fid, 'count': count, 'fingerprint': text})
+        return flags
+
+    def prometheus(self):
+        """Counters and histograms in the Prometheus text exposition format."""
+        lines = [
+            '# HELP db_statements_total Statements executed, by issuing model method and fingerprint.',
+            '# TYPE db_statements_total counter',
+        ]
+        with self._lock:
+            statements = {k: list(v) for k, v in self.statements.items()}
+            requests, request_statements = dict(self.requests), dict(self.request_statements)
+            flags = dict(self.flags)
+        for (site, fid), stats in sorted(statements.items()):
+            lines.append(f'db_statements_total{{caller="{_label(site)}",query="{fid}"}} {stats[0]}')
+        lines += ['# HELP db_statement_rows_total Rows returned or affected.',
+                  '# TYPE db_statement_rows_total counter']
+        for (site, fid), stats in sorted(statements.items()):
+            lines.append(f'db_statement_rows_total{{caller="{_label(site)}",query="{fid}"}} {stats[2]}')
+        lines += ['# HELP db_statement_duration_seconds Statement latency.',
+                  '# TYPE db_statement_duration_seconds histogram']
+        for (site, fid), stats in sorted(statements.items()):
+            labels = f'caller="{_label(site)}",query="{fid}"'
+            for i, bound in enumerate(BUCKETS):
+                lines.append(f'db_statement_duration_seconds_bucket{{{labels},le="{bound}"}} {stats[3 + i]}')
+            lines.append(f'db_statement_duration_seconds_bucket{{{labels},le="+Inf"}} {stats[0]}')
+            lines.append(f'db_statement_duration_seconds_sum{{{labels}}} {stats[1]:.6f}')
+            lines.append(f'db_statement_duration_seconds_count{{{labels}}} {stats[0]}')
+        lines += ['# HELP http_requests_total Requests served, by endpoint.',
+                  '# TYPE http_requests_total counter']
+        for endpoint, count in sorted(requests.items()):
+            lines.append(f'http_requests_total{{endpoint="{_label(endpoint)}"}} {count}')
+        lines += ['# HELP db_request_statements_total Statements issued while serving each endpoint.',
+                  '# TYPE db_request_statements_total counter']
+        for endpoint, count in sorted(request_statements.items()):
+            lines.append(f'db_request_statements_total{{endpoint="{_label(endpoint)}"}} {count}')
+        lines += ['# HELP db_repeated_statements_total Requests flagged for N+1 loops or duplicate statements.',
+                  '# TYPE db_repeated_statements_total counter']
+        for (kind, site, fid), count in sorted(flags.items()):
+            lines.append(f'db_repeated_statements_total{{kind="{kind}",caller="{_label(site)}",query="{fid}"}} {count}')
+        lines += ['# HELP db_retries_total Serialization-failure retries, by transaction.',
+                  '# TYPE db_retries_total counter']
+        for label, stats in sorted(current_app.db.retry_stats.items()):
+            lines.append(f'db_retries_total{{transaction="{_label(label)}"}} {stats["retries"]}')
+        cache = getattr(current_app, 'cache', None)
+        if cache is not None:
+            snapshot = cache.snapshot()
+            lines += ['# HELP cache_requests_total Cache lookups, by cached function and result.',
+                      '# TYPE cache_requests_total counter']
+            for name, stats in sorted(snapshot['calls'].items()):
+                for result in ('hits', 'misses', 'errors'):
+                    lines.append(f'cache_requests_total{{name="{_label(name)}",result="{result}"}} {stats[result]}')
+            lines += ['# HELP cache_invalidations_total Tag version bumps.',
+                      '# TYPE cache_invalidations_total counter']
+            for tag, count in sorted(snapshot['invalidations'].items()):
+                lines.append(f'cache_invalidations_total{{tag="{_label(tag)}"}} {count}')
+            lines += ['# HELP cache_evictions_total Entries dropped from the in-process LRU.',
+                      '# TYPE cache_evictions_total counter',
+                      f'cache_evictions_total{{reason="size"}} {snapshot["evictions"]}',
+                      f'cache_evictions_total{{reason="ttl"}} {snapshot["expirations"]}',
+                      '# HELP cache_entries Entries in the in-process LRU.',
+                      '# TYPE cache_entries gauge',
+                      f'cache_entries {snapshot["entries"]}']
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        """Recent requests plus the statements costing the most time overall."""
+        with self._lock:
+            top = sorted(self.statements.items(), key=lambda kv: kv[1][1], reverse=True)[:25]
+            return {
+                'top_statements': [{
+                    'caller': site, 'id': fid, 'fingerprint': self.fingerprints[fid],
+                    'count': stats[0], 'total_ms': round(stats[1] * 1000, 1),
+                    'mean_ms': round(stats[1] * 1000 / stats[0], 3), 'rows': stats[2],
+                } for (site, fid), stats in top],
+                'recent_requests': list(reversed(self.history)),
+                'pool': current_app.db.pool_status(),
+                'cache': current_app.cache.snapshot() if hasattr(current_app, 'cache') else None,
+            }
+
+
+bp = Blueprint('sqlprofile', __name__)
+
+
+@bp.before_request
+def _restrict():
+    if not current_app.debug and request.remote_addr not in current_app.config.get('SQL_PROFILE_ALLOW', ()):
+        abort(404)
+
+
+@bp.route('/debug/sql')
+def debug_sql():
+    body = json.dumps(current_app.sql_profiler.report(), indent=2, default=str)
+    return Response(body, mimetype='application/json')
+
+
+@bp.route('/metrics')
+def metrics():
+    return Response(current_app.sql_profiler.prometheus(), mimetype='text/plain; version=0.0.4')
@@ -1,12 +1,15 @@
-from flask import render_template, redirect, url_for, flash, request
+from datetime import datetime
+
+from flask import render_template, redirect, url_for, flash, request, session
 from werkzeug.urls import url_parse
-from flask_login import login_user, logout_user, current_user
+from flask_login import login_user, logout_user, current_user, login_required
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField
 from wtforms.validators import ValidationError, DataRequired, Email, EqualTo, Optional
 
 from .models.purchase import Purchase
 from .models.user import User
+from .models.user_stats import UserStats
 from .models.inventory import InventoryItem
 
 from flask import Blueprint
@@ -31,6 +34,7 @@ def login():
             flash('Invalid email or password')
             return redirect(url_for('users.login'))
         login_user(user)
+        user.remember()
         next_page = request.args.get('next')
         if not next_page or url_parse(next_page).netloc != '':
             next_page = url_for('index.index')
@@ -76,28 +80,71 @@ def register():
 @bp.route('/logout')
 def logout():
     logout_user()
+    session.pop(User.IDENTITY_KEY, None)
     return redirect(url_for('index.index'))
 
 #PROFILE PAGE
+HISTORY_PER_PAGE = 10
+PROFILE_LISTINGS = 10
+
+
+def _history_page(args):
+    """Template context for one page of the order history, as selected by
+    the ?after_date=/?after_id= keyset (the last purchase of the page before)."""
+    after = None
+    after_id = args.get('after_id', type=int)
+    try:
+        after_date = datetime.fromisoformat(args.get('after_date', ''))
+    except ValueError:
+        after_date = None
+    if after_date is not None and after_id is not None:
+        after = (after_date, after_id)
+
+    # One extra purchase tells us whether there is an older page
+    purchases = Purchase.history_page(current_user.id, HISTORY_PER_PAGE + 1, after)
+    next_args = None
+    if len(purchases) > HISTORY_PER_PAGE:
+        purchases = purchases[:HISTORY_PER_PAGE]
+        last = purchases[-1]
+        next_args = {'after_date': last.date.isoformat(), 'after_id': last.purchase_id}
+    return {'purchases': purchases, 'next_args': next_args}
+
+
 @bp.route('/profile')
 def profile():
     # Only logged-in users can see this page
     if current_user.is_authenticated:
-        purchases = Purchase.get_all_purchanditems_for_user(current_user.id)
-        selling_products = InventoryItem.get_for_seller(current_user.id)
-        profit = User.getTotalProfit(current_user.id)
-        spending = User.getTotalSpending(current_user.id)
+        history = _history_page(request.args)
+        stats = UserStats.get(current_user.id)
     else:
         flash("Please log in to view your profile.", "warning")
         return redirect(url_for('users.login'))  
     return render_template('userprofile.html', 
-                           user=current_user, purchases=purchases,
-                           selling_products=selling_products,
+                           user=current_user,
                            balance=current_user.balance,
-                           profit=profit,
-                           spending=spending
+                           stats=stats,
+                           profit=stats.total_revenue,
+                           spending=stats.total_spent,
+                           **history
                            )
 
+
+@bp.route('/profile/orders')
+@login_required
+def profile_orders():
+    """The next page of the order history, as table rows (HTMX "Load more")."""
+    return render_template('_purchase_rows.html', **_history_page(request.args))
+
+
+@bp.route('/profile/listings')
+@login_required
+def profile_listings():
+    """The first few of the user's listings, loaded once the profile is open."""
+    listings = InventoryItem.get_for_seller(current_user.id, PROFILE_LISTINGS + 1)
+    return render_template('_profile_listings.html',
+                           listings=listings[:PROFILE_LISTINGS],
+                           more=len(listings) > PROFILE_LISTINGS)
+
 #FORM TO UPDATE PROFILE
 class UpdateProfileForm(FlaskForm):
     firstname = StringField('First Name', validators=[DataRequired()])
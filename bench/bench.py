@@ -0,0 +1,339 @@
+"""Load-test the real routes with mixed traffic and record latency percentiles.
+
+Each virtual user logs in as a different seller, tops up its balance and
+then loops over a weighted mix of requests for --duration seconds:
+
+    index          /  (plain, keyword search, price sort, category)
+    product        /product/<id>
+    cart_add       POST /cart/add
+    purchase       POST /cart/purchase
+    seller_orders  /seller/orders
+    profile        /profile
+
+This runs at every --concurrency level in turn. For each level it
+reports p50/p95/p99 latency, throughput, error count and database
+statements per request, overall and per endpoint. The results are
+written as JSON to bench/results/ (or --out).
+
+    python bench/bench.py                              # app served in-process
+    python bench/bench.py --concurrency 1,8,32 --duration 30
+    python bench/bench.py --seed-scale 0.01            # rebuild the database first
+    python bench/bench.py --url http://localhost:8080  # an already running server
+    python bench/bench.py --compare bench/results/baseline.json
+
+--seed-scale regenerates the data with db/generated/gen_bulk.py and
+reloads it through db/setup.sh (this DROPS the database). Without it
+the benchmark runs against whatever is loaded; either way it writes
+(carts, purchases, balances), so don't point it at data you care about.
+
+With --compare, any endpoint whose p95 got worse by more than
+--max-regression (default 20%) at the same concurrency is listed, and
+the exit status is 1.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(ROOT, '.flaskenv'))
+except ImportError:
+    pass
+
+from app import create_app
+from app.sqlprofile import SQLProfiler
+
+DEFAULT_MIX = 'index=40,product=25,cart_add=15,purchase=3,seller_orders=7,profile=10'
+QUERY_HEADER = 'X-DB-Queries'
+CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(s[0] for s in samples)
+    queries = [s[2] for s in samples if s[2] is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for s in samples if s[1]),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': latencies[-1] if latencies else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+class Fixture:
+    """Ids the traffic is drawn from, read from the database being tested."""
+
+    def __init__(self, app, users, password_pool):
+        with app.app_context():
+            db = app.db
+            sellers = db.execute('''
+                SELECT u.id, u.email FROM Users u
+                WHERE EXISTS (SELECT 1 FROM Inventory i WHERE i.seller_id = u.id)
+                ORDER BY u.id LIMIT :n
+            ''', n=users)
+            self.products = [r[0] for r in db.execute('''
+                SELECT product_id FROM product_offer_summary
+                WHERE total_stock > 0 ORDER BY random() LIMIT 2000
+            ''')]
+            self.categories = [r[0] for r in db.execute(
+                'SELECT DISTINCT category FROM Products LIMIT 50')]
+        if not sellers or not self.products:
+            raise SystemExit('the database has no sellers/products to benchmark against')
+        # gen_bulk.py users log in with pass{id % pool}; gen.py users with pass{id}
+        self.accounts = [(email, f'pass{uid % password_pool}' if password_pool else f'pass{uid}')
+                         for uid, email in sellers]
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, base, account, fixture, mix, deadline, seed):
+        super().__init__(daemon=True)
+        self.base = base
+        self.account = account
+        self.fixture = fixture
+        self.names = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.samples = []  # (endpoint, milliseconds, error, queries)
+        self.error = None
+
+    def login(self):
+        page = self.session.get(f'{self.base}/login')
+        token = CSRF.search(page.text)
+        email, password = self.account
+        r = self.session.post(f'{self.base}/login', data={
+            'email': email, 'password': password,
+            'csrf_token': token.group(1) if token else ''}, allow_redirects=False)
+        if r.status_code != 302 or r.headers.get('Location', '').endswith('/login'):
+            raise RuntimeError(f'could not log in as {email}')
+        self.session.post(f'{self.base}/profile/topup', data={'amount': 100000}, allow_redirects=False)
+
+    def request(self, endpoint):
+        rng, fx = self.rng, self.fixture
+        if endpoint == 'index':
+            params = rng.choice([{}, {'keyword': 'cat'}, {'sortBy': 'min_price', 'sortDir': 'asc'},
+                                 {'category': rng.choice(fx.categories)}])
+            return self.session.get(f'{self.base}/', params=params)
+        if endpoint == 'product':
+            return self.session.get(f'{self.base}/product/{rng.choice(fx.products)}')
+        if endpoint == 'cart_add':
+            return self.session.post(f'{self.base}/cart/add',
+                                     json={'product_id': rng.choice(fx.products), 'quantity': 1})
+        if endpoint == 'purchase':
+            return self.session.post(f'{self.base}/cart/purchase', data={'address': 'benchmark'},
+                                     allow_redirects=False)
+        if endpoint == 'seller_orders':
+            return self.session.get(f'{self.base}/seller/orders')
+        if endpoint == 'profile':
+            return self.session.get(f'{self.base}/profile')
+        raise ValueError(endpoint)
+
+    def run(self):
+        try:
+            self.login()
+        except Exception as e:
+            self.error = e
+            return
+        while time.monotonic() < self.deadline:
+            endpoint = self.rng.choices(self.names, self.weights)[0]
+            started = time.perf_counter()
+            try:
+                r = self.request(endpoint)
+                error = r.status_code >= 400
+                queries = r.headers.get(QUERY_HEADER)
+            except requests.RequestException:
+                error, queries = True, None
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+            self.samples.append((endpoint, elapsed_ms, error, int(queries) if queries else None))
+
+
+def run_level(base, fixture, mix, concurrency, duration, warmup, seed):
+    deadline = time.monotonic() + warmup + duration
+    users = [VirtualUser(base, fixture.accounts[i % len(fixture.accounts)], fixture, mix, deadline, seed + i)
+             for i in range(concurrency)]
+    for user in users:
+        user.start()
+    time.sleep(warmup)
+    # Only requests started after the warmup count
+    marks = [len(user.samples) for user in users]
+    started = time.monotonic()
+    for user in users:
+        user.join()
+    elapsed = time.monotonic() - started
+    failed = [user.error for user in users if user.error]
+    if failed:
+        raise SystemExit(f'{len(failed)} virtual user(s) failed to start: {failed[0]}')
+
+    samples = [s for user, mark in zip(users, marks) for s in user.samples[mark:]]
+    result = summarize([s[1:] for s in samples], elapsed)
+    result['concurrency'] = concurrency
+    result['endpoints'] = {
+        name: summarize([s[1:] for s in samples if s[0] == name], elapsed)
+        for name, _ in mix
+    }
+    return result
+
+
+def serve(app):
+    from werkzeug.serving import make_server
+    # One access-log line per request would drown the report
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def reseed(scale, seed):
+    out = os.path.join(ROOT, 'db', 'generated', f'bench-{scale}-{seed}')
+    if not os.path.exists(os.path.join(out, 'manifest.json')):
+        subprocess.run([sys.executable, os.path.join(ROOT, 'db', 'generated', 'gen_bulk.py'),
+                        '--scale', str(scale), '--seed', str(seed), '--out', out], check=True)
+    subprocess.run([os.path.join(ROOT, 'db', 'setup.sh'), out], check=True)
+
+
+def database_size(app):
+    with app.app_context():
+        return {table: app.db.execute(f'SELECT COUNT(*) FROM {table}')[0][0]
+                for table in ['Users', 'Products', 'Inventory', 'Purchases', 'Ledger']}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(result, baseline, max_regression):
+    """Lines describing p95 regressions against a previous result file."""
+    previous = {level['concurrency']: level for level in baseline['levels']}
+    regressions = []
+    for level in result['levels']:
+        old = previous.get(level['concurrency'])
+        if not old:
+            continue
+        for name, stats in [('all', level)] + list(level['endpoints'].items()):
+            before = old if name == 'all' else old['endpoints'].get(name)
+            if not before or not before.get('p95_ms') or not stats.get('p95_ms'):
+                continue
+            change = stats['p95_ms'] / before['p95_ms'] - 1
+            if change > max_regression:
+                regressions.append(f'c={level["concurrency"]} {name}: p95 {before["p95_ms"]}ms -> '
+                                   f'{stats["p95_ms"]}ms (+{change:.0%})')
+    return regressions
+
+
+def print_level(level):
+    print(f'\nconcurrency {level["concurrency"]}: {level["requests"]} requests, '
+          f'{level["throughput_rps"]} req/s, {level["errors"]} errors')
+    print(f'  {"endpoint":15} {"n":>6} {"p50":>8} {"p95":>8} {"p99":>8} {"queries":>8}')
+    for name, stats in [('all', level)] + list(level['endpoints'].items()):
+        if not stats['requests']:
+            continue
+        print(f'  {name:15} {stats["requests"]:>6} {stats["p50_ms"]:>8} {stats["p95_ms"]:>8} '
+              f'{stats["p99_ms"]:>8} {stats["queries_per_request"] if stats["queries_per_request"] is not None else "-":>8}')
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the app with mixed traffic.')
+    parser.add_argument('--url', help='benchmark a running server instead of serving the app in-process')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated virtual user counts')
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds per level')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds per level')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'endpoint weights (default {DEFAULT_MIX})')
+    parser.add_argument('--seed-scale', type=float, help='regenerate and reload the database at this gen_bulk scale')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--password-pool', type=int, default=16,
+                        help='gen_bulk --hash-pool the data was made with (0 for gen.py data)')
+    parser.add_argument('--out', help='result file (default bench/results/<time>.json)')
+    parser.add_argument('--compare', help='previous result file to check for regressions')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    levels = [int(c) for c in args.concurrency.split(',')]
+    if args.seed_scale:
+        reseed(args.seed_scale, args.seed)
+
+    app = create_app()
+    if not args.url and not hasattr(app, 'sql_profiler'):
+        # Per-response statement counts (QUERY_HEADER) come from the profiler
+        app.sql_profiler = SQLProfiler(app)
+    fixture = Fixture(app, max(levels), args.password_pool)
+    server = None
+    if args.url:
+        base = args.url.rstrip('/')
+    else:
+        server, base = serve(app)
+
+    result = {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'target': args.url or 'in-process',
+        'mix': dict(mix),
+        'duration_s': args.duration,
+        'database': database_size(app),
+        'levels': [],
+    }
+    try:
+        for concurrency in levels:
+            level = run_level(base, fixture, mix, concurrency, args.duration, args.warmup, args.seed)
+            result['levels'].append(level)
+            print_level(level)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    out = args.out or os.path.join(ROOT, 'bench', 'results',
+                                   datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'\nresults written to {out}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
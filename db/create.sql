@@ -1,3 +1,6 @@
+-- Trigram matching for product keyword search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Users / Accounts
 CREATE TABLE Users (
     id INT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
@@ -18,9 +21,17 @@ CREATE TABLE Products (
     image TEXT,
     category VARCHAR(255) NOT NULL,
     created_by INT,
+    -- weighted full-text vector for keyword search (name = A, description = B)
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED,
     FOREIGN KEY (created_by) REFERENCES Users(id)
 );
 
+CREATE INDEX products_search_vector_idx ON Products USING GIN (search_vector);
+CREATE INDEX products_name_trgm_idx ON Products USING GIN (name gin_trgm_ops);
+
 CREATE TABLE Cart (
     account_id INT NOT NULL,
     product_id INT NOT NULL,
@@ -42,6 +53,21 @@ CREATE TABLE Inventory (
     FOREIGN KEY (product_id) REFERENCES Products(id)
 );
 
+-- Units held for a buyer's cart until expires_at (see app/models/reservation.py)
+CREATE TABLE stock_reservations (
+    account_id INT NOT NULL,
+    product_id INT NOT NULL,
+    seller_id INT NOT NULL,
+    quantity INT NOT NULL CHECK (quantity > 0),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (account_id, product_id, seller_id),
+    FOREIGN KEY (account_id) REFERENCES Users(id),
+    FOREIGN KEY (seller_id, product_id) REFERENCES Inventory(seller_id, product_id) ON DELETE CASCADE
+);
+
+CREATE INDEX stock_reservations_item_idx ON stock_reservations (product_id, seller_id, expires_at);
+CREATE INDEX stock_reservations_expires_idx ON stock_reservations (expires_at);
+
 -- Purchases (order-level)
 CREATE TABLE Purchases (
     purchase_id INT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
@@ -59,8 +85,272 @@ CREATE TABLE Ledger (
     product_id INT NOT NULL,
     quantity INT NOT NULL CHECK (quantity > 0),
     fulfillment_status INT NOT NULL DEFAULT 0 CHECK (fulfillment_status IN (0, 1)),
+    -- Price per unit and quantity * unit_price, as charged at checkout
+    unit_price DECIMAL(12,2) NOT NULL,
+    line_total DECIMAL(14,2) NOT NULL,
     PRIMARY KEY (purchase_id, seller_id, product_id),
     FOREIGN KEY (purchase_id) REFERENCES Purchases(purchase_id),
     FOREIGN KEY (seller_id) REFERENCES Users(id),
     FOREIGN KEY (product_id) REFERENCES Products(id)
-);
\ No newline at end of file
+);
+
+-- Per-product offer summary (one row per product with at least one seller),
+-- kept in sync with Inventory by statement-level triggers so catalog
+-- browsing never has to aggregate Inventory.
+CREATE TABLE product_offer_summary (
+    product_id INT PRIMARY KEY,
+    min_price DECIMAL(12,2) NOT NULL,
+    max_price DECIMAL(12,2) NOT NULL,
+    seller_count INT NOT NULL,
+    total_stock INT NOT NULL,
+    FOREIGN KEY (product_id) REFERENCES Products(id) ON DELETE CASCADE
+);
+
+CREATE INDEX product_offer_summary_min_price_idx ON product_offer_summary (min_price, product_id);
+CREATE INDEX product_offer_summary_max_price_idx ON product_offer_summary (max_price, product_id);
+
+-- Recompute the summary rows for the given products from Inventory.
+-- The rows are created and locked (in product order) before Inventory is
+-- aggregated, so of two transactions changing the same product's
+-- listings the second waits and counts the first's committed changes,
+-- rather than overwriting the summary with what its older snapshot saw.
+CREATE OR REPLACE FUNCTION refresh_product_offer_summary(pids INT[]) RETURNS void AS $$
+BEGIN
+    INSERT INTO product_offer_summary (product_id, min_price, max_price, seller_count, total_stock)
+    SELECT DISTINCT product_id, 0, 0, 0, 0
+    FROM Inventory
+    WHERE product_id = ANY(pids)
+    ORDER BY product_id
+    ON CONFLICT (product_id) DO NOTHING;
+
+    PERFORM 1 FROM product_offer_summary WHERE product_id = ANY(pids) ORDER BY product_id FOR UPDATE;
+
+    UPDATE product_offer_summary s
+    SET min_price = c.min_price,
+        max_price = c.max_price,
+        seller_count = c.seller_count,
+        total_stock = c.total_stock
+    FROM (
+        SELECT product_id, MIN(price) AS min_price, MAX(price) AS max_price,
+               COUNT(*) AS seller_count, SUM(quantity) AS total_stock
+        FROM Inventory
+        WHERE product_id = ANY(pids)
+        GROUP BY product_id
+    ) c
+    WHERE s.product_id = c.product_id;
+
+    DELETE FROM product_offer_summary s
+    WHERE s.product_id = ANY(pids)
+      AND NOT EXISTS (SELECT 1 FROM Inventory i WHERE i.product_id = s.product_id);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION inventory_refresh_offer_summary() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_product_offer_summary(ARRAY(SELECT DISTINCT product_id FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_product_offer_summary(ARRAY(SELECT DISTINCT product_id FROM old_rows));
+    ELSE
+        PERFORM refresh_product_offer_summary(ARRAY(
+            SELECT product_id FROM new_rows
+            UNION
+            SELECT product_id FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER inventory_offer_summary_ins
+    AFTER INSERT ON Inventory
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_refresh_offer_summary();
+
+CREATE TRIGGER inventory_offer_summary_upd
+    AFTER UPDATE ON Inventory
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_refresh_offer_summary();
+
+CREATE TRIGGER inventory_offer_summary_del
+    AFTER DELETE ON Inventory
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_refresh_offer_summary();
+
+
+-- Per-user lifetime totals, as buyer and as seller, so the profile and
+-- the seller pages never aggregate Ledger. Checkout and fulfillment
+-- (app/models/user_stats.py) keep it up to date in their own
+-- transactions; refresh_user_stats recomputes rows from Ledger (see
+-- db/user_stats.py rebuild/verify).
+CREATE TABLE user_stats (
+    user_id INT PRIMARY KEY,
+    orders_placed INT NOT NULL DEFAULT 0,              -- purchases made
+    total_spent DECIMAL(14,2) NOT NULL DEFAULT 0,
+    orders_sold INT NOT NULL DEFAULT 0,                -- purchases with a line sold by the user
+    lines_sold INT NOT NULL DEFAULT 0,
+    units_sold BIGINT NOT NULL DEFAULT 0,
+    total_revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    lines_pending INT NOT NULL DEFAULT 0,              -- lines sold, not yet fulfilled
+    FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+);
+
+-- user_stats rows for the given users, computed from Purchases and Ledger.
+CREATE OR REPLACE FUNCTION compute_user_stats(uids INT[])
+RETURNS TABLE (user_id INT, orders_placed INT, total_spent DECIMAL(14,2), orders_sold INT,
+               lines_sold INT, units_sold BIGINT, total_revenue DECIMAL(14,2), lines_pending INT) AS $$
+    WITH bought AS (
+        SELECT p.buyer_id AS user_id, COUNT(DISTINCT p.purchase_id) AS orders, SUM(l.line_total) AS spent
+        FROM Purchases p
+        JOIN Ledger l ON l.purchase_id = p.purchase_id
+        WHERE p.buyer_id = ANY(uids)
+        GROUP BY p.buyer_id
+    ), sold AS (
+        SELECT l.seller_id AS user_id,
+               COUNT(DISTINCT l.purchase_id) AS orders,
+               COUNT(*) AS lines,
+               SUM(l.quantity) AS units,
+               SUM(l.line_total) AS revenue,
+               COUNT(*) FILTER (WHERE l.fulfillment_status = 0) AS pending
+        FROM Ledger l
+        WHERE l.seller_id = ANY(uids)
+        GROUP BY l.seller_id
+    )
+    SELECT u.id,
+           COALESCE(b.orders, 0)::INT, COALESCE(b.spent, 0),
+           COALESCE(d.orders, 0)::INT, COALESCE(d.lines, 0)::INT, COALESCE(d.units, 0),
+           COALESCE(d.revenue, 0), COALESCE(d.pending, 0)::INT
+    FROM Users u
+    LEFT JOIN bought b ON b.user_id = u.id
+    LEFT JOIN sold d ON d.user_id = u.id
+    WHERE u.id = ANY(uids)
+$$ LANGUAGE sql STABLE;
+
+-- Recompute the stats rows of the given users; returns how many.
+-- Safe alongside live checkouts: the rows are created and locked (in id
+-- order) before anything is counted, so a checkout either commits before
+-- the count (and is in it) or waits and adds its increment afterwards.
+CREATE OR REPLACE FUNCTION refresh_user_stats(uids INT[]) RETURNS INT AS $$
+DECLARE
+    refreshed INT;
+BEGIN
+    INSERT INTO user_stats (user_id)
+    SELECT id FROM Users WHERE id = ANY(uids)
+    ORDER BY id
+    ON CONFLICT (user_id) DO NOTHING;
+
+    PERFORM 1 FROM user_stats WHERE user_id = ANY(uids) ORDER BY user_id FOR UPDATE;
+
+    UPDATE user_stats s
+    SET orders_placed = c.orders_placed,
+        total_spent = c.total_spent,
+        orders_sold = c.orders_sold,
+        lines_sold = c.lines_sold,
+        units_sold = c.units_sold,
+        total_revenue = c.total_revenue,
+        lines_pending = c.lines_pending
+    FROM compute_user_stats(uids) c
+    WHERE s.user_id = c.user_id;
+
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+    RETURN refreshed;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Sales per seller per day (UTC), and per seller, day and product, so the
+-- seller analytics page sums a few hundred rows instead of scanning
+-- Ledger. Checkout (app/models/seller_sales.py) adds each purchase in its
+-- own transaction; refresh_seller_sales recomputes a range of days from
+-- Ledger (see db/seller_sales.py rebuild/verify). Rows arrive in day
+-- order, so a BRIN index on day is enough for the range scans across
+-- sellers.
+CREATE TABLE seller_sales_daily (
+    seller_id INT NOT NULL,
+    day DATE NOT NULL,
+    orders INT NOT NULL DEFAULT 0,                     -- purchases with a line sold by the seller
+    lines INT NOT NULL DEFAULT 0,
+    units BIGINT NOT NULL DEFAULT 0,
+    revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (seller_id, day),
+    FOREIGN KEY (seller_id) REFERENCES Users(id) ON DELETE CASCADE
+);
+CREATE INDEX seller_sales_daily_day_brin ON seller_sales_daily USING brin (day);
+
+CREATE TABLE seller_product_sales_daily (
+    seller_id INT NOT NULL,
+    day DATE NOT NULL,
+    product_id INT NOT NULL,
+    orders INT NOT NULL DEFAULT 0,
+    units BIGINT NOT NULL DEFAULT 0,
+    revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (seller_id, day, product_id),
+    FOREIGN KEY (seller_id) REFERENCES Users(id) ON DELETE CASCADE,
+    FOREIGN KEY (product_id) REFERENCES Products(id) ON DELETE CASCADE
+);
+CREATE INDEX seller_product_sales_daily_day_brin ON seller_product_sales_daily USING brin (day);
+
+-- seller_sales_daily rows for days in [from_day, to_day), computed from
+-- Purchases and Ledger.
+CREATE OR REPLACE FUNCTION compute_seller_sales_daily(from_day DATE, to_day DATE)
+RETURNS TABLE (seller_id INT, day DATE, orders INT, lines INT, units BIGINT, revenue DECIMAL(14,2)) AS $$
+    SELECT l.seller_id, (p.date AT TIME ZONE 'UTC')::DATE,
+           COUNT(DISTINCT l.purchase_id)::INT, COUNT(*)::INT, SUM(l.quantity), SUM(l.line_total)
+    FROM Purchases p
+    JOIN Ledger l ON l.purchase_id = p.purchase_id
+    WHERE p.date >= from_day::TIMESTAMP AT TIME ZONE 'UTC'
+      AND p.date < to_day::TIMESTAMP AT TIME ZONE 'UTC'
+    GROUP BY 1, 2
+$$ LANGUAGE sql STABLE;
+
+-- seller_product_sales_daily rows for days in [from_day, to_day).
+CREATE OR REPLACE FUNCTION compute_seller_product_sales_daily(from_day DATE, to_day DATE)
+RETURNS TABLE (seller_id INT, day DATE, product_id INT, orders INT, units BIGINT, revenue DECIMAL(14,2)) AS $$
+    SELECT l.seller_id, (p.date AT TIME ZONE 'UTC')::DATE, l.product_id,
+           COUNT(*)::INT, SUM(l.quantity), SUM(l.line_total)
+    FROM Purchases p
+    JOIN Ledger l ON l.purchase_id = p.purchase_id
+    WHERE p.date >= from_day::TIMESTAMP AT TIME ZONE 'UTC'
+      AND p.date < to_day::TIMESTAMP AT TIME ZONE 'UTC'
+    GROUP BY 1, 2, 3
+$$ LANGUAGE sql STABLE;
+
+-- Recompute both tables for days in [from_day, to_day); returns how many
+-- seller_sales_daily rows that makes. Safe alongside live checkouts: each
+-- day in the range is locked first (an advisory lock per UTC day, which
+-- checkout takes in shared mode before adding a purchase, see
+-- SellerSales.record_purchase), so checkouts that already added to those
+-- days are committed (and counted), and the rest wait and add their
+-- purchase afterwards. Checkouts on other days are not held up.
+CREATE OR REPLACE FUNCTION refresh_seller_sales(from_day DATE, to_day DATE) RETURNS INT AS $$
+DECLARE
+    refreshed INT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('seller_sales_daily'), d::DATE - DATE '2000-01-01')
+    FROM generate_series(from_day::TIMESTAMP, (to_day - 1)::TIMESTAMP, INTERVAL '1 day') AS g(d)
+    ORDER BY d;
+
+    DELETE FROM seller_sales_daily WHERE day >= from_day AND day < to_day;
+    DELETE FROM seller_product_sales_daily WHERE day >= from_day AND day < to_day;
+
+    INSERT INTO seller_sales_daily (seller_id, day, orders, lines, units, revenue)
+    SELECT * FROM compute_seller_sales_daily(from_day, to_day);
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+
+    INSERT INTO seller_product_sales_daily (seller_id, day, product_id, orders, units, revenue)
+    SELECT * FROM compute_seller_product_sales_daily(from_day, to_day);
+
+    RETURN refreshed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Secondary indexes for the hot access paths
+-- (see migrations/0005_add_hot_path_indexes.sql, 0008_add_seller_order_indexes.sql,
+-- 0010_add_purchases_history_index.sql and 0011_add_seller_sales.sql for what
+-- each one serves)
+CREATE INDEX inventory_product_price_idx ON Inventory (product_id, price) INCLUDE (seller_id, quantity);
+CREATE INDEX inventory_in_stock_idx ON Inventory (product_id, price) WHERE quantity > 0;
+CREATE INDEX ledger_seller_status_order_idx ON Ledger (seller_id, fulfillment_status, purchase_id, product_id);
+CREATE INDEX ledger_seller_order_idx ON Ledger (seller_id, purchase_id, product_id);
+CREATE INDEX purchases_buyer_date_id_idx ON Purchases (buyer_id, date DESC, purchase_id DESC);
+CREATE INDEX products_category_name_idx ON Products (category, name);
+CREATE INDEX purchases_date_brin ON Purchases USING brin (date);
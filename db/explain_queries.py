@@ -0,0 +1,191 @@
+"""EXPLAIN every query the models in app/models issue and flag sequential scans.
+
+Runs each model method against the configured database with sample ids
+picked from the data, captures every statement it sends, and EXPLAINs it
+(plans only; nothing is ANALYZEd). Writes happen inside one transaction
+that is rolled back at the end, so the database is left untouched.
+
+Usage (from the repository root, with .flaskenv in place):
+
+    python db/explain_queries.py              # flag seq scans on tables >= 10000 rows
+    python db/explain_queries.py --min-rows 0 # flag every seq scan
+    python db/explain_queries.py --verbose    # also print each plan's top nodes
+
+Exits with status 1 if anything was flagged.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.flaskenv'))
+except ImportError:
+    pass
+
+from app import create_app
+from app.models.cart import Cart
+from app.models.inventory import InventoryItem
+from app.models.product import Product
+from app.models.purchase import Purchase
+from app.models.seller_order import SellerOrder
+from app.models.seller_sales import SellerSales
+from app.models.user import User
+from app.models.user_stats import UserStats
+
+
+class _Rollback(Exception):
+    pass
+
+
+def sample_ids(db):
+    """Busiest seller, buyer and product, so plans reflect the worst case."""
+    def one(sql):
+        rows = db.execute(sql)
+        return rows[0][0] if rows and rows[0][0] is not None else 0
+
+    return {
+        'seller': one('SELECT seller_id FROM Inventory GROUP BY seller_id ORDER BY COUNT(*) DESC LIMIT 1'),
+        'buyer': one('SELECT account_id FROM Cart GROUP BY account_id ORDER BY COUNT(*) DESC LIMIT 1'),
+        'history': one('SELECT buyer_id FROM Purchases GROUP BY buyer_id ORDER BY COUNT(*) DESC LIMIT 1'),
+        'product': one('SELECT product_id FROM Inventory GROUP BY product_id ORDER BY COUNT(*) DESC LIMIT 1'),
+        'category': one('SELECT category FROM Products GROUP BY category ORDER BY COUNT(*) DESC LIMIT 1'),
+        'email': one('SELECT email FROM Users ORDER BY id LIMIT 1'),
+        'purchase': one('SELECT MAX(purchase_id) FROM Purchases'),
+    }
+
+
+def model_calls(ids):
+    """(label, thunk) for every model method worth planning."""
+    seller, buyer, product = ids['seller'], ids['buyer'], ids['product']
+    today = datetime.now(timezone.utc).date()
+    year_ago = today - timedelta(days=365)
+    return [
+        ('Product.get_with_id', lambda: Product.get_with_id(product)),
+        ('Product.get_all', Product.get_all),
+        ('Product.get_categories', Product.get_categories),
+        ('Product.getPriceRange', lambda: Product.getPriceRange(product)),
+        ('Product.count_with_filters', lambda: Product.count_with_filters(category=ids['category'])),
+        ('Product.get_with_filters(name)', lambda: Product.get_with_filters(sortBy='name', sortDir='asc', limit=9)),
+        ('Product.get_with_filters(min_price, seek)', lambda: Product.get_with_filters(
+            sortBy='min_price', sortDir='asc', limit=9, after=['100', 0])),
+        ('Product.get_with_filters(category)', lambda: Product.get_with_filters(
+            category=ids['category'], sortBy='name', sortDir='asc', limit=9)),
+        ('Product.get_with_filters(keyword)', lambda: Product.get_with_filters(
+            keyword='cat', sortBy='relevance', limit=9)),
+        ('InventoryItem.get_for_seller', lambda: InventoryItem.get_for_seller(seller)),
+        ('InventoryItem.get_sellers_from_product', lambda: InventoryItem.get_sellers_from_product(product)),
+        ('InventoryItem.get_item', lambda: InventoryItem.get_item(seller, product)),
+        ('InventoryItem.get_products_not_in_inventory', lambda: InventoryItem.get_products_not_in_inventory(seller)),
+        ('InventoryItem.set_quantity', lambda: InventoryItem.set_quantity(seller, product, 5)),
+        ('Cart.get_user_cart', lambda: Cart.get_user_cart(buyer)),
+        ('Cart.get_cart_item_count', lambda: Cart.get_cart_item_count(buyer)),
+        ('Cart.get_cart_total', lambda: Cart.get_cart_total(buyer)),
+        ('Cart.summary', lambda: Cart.summary(buyer)),
+        ('Cart.get_default_seller', lambda: Cart.get_default_seller(product)),
+        ('Cart.add_item', lambda: Cart.add_item(buyer, product, seller, 1)),
+        ('Cart.update_item', lambda: Cart.update_item(buyer, product, seller, 2)),
+        ('Cart.apply_batch', lambda: Cart.apply_batch(buyer, [
+            {'op': 'add', 'product_id': product, 'seller_id': None, 'quantity': 1},
+            {'op': 'set', 'product_id': product, 'seller_id': seller, 'quantity': 3},
+            {'op': 'remove', 'product_id': product, 'seller_id': seller, 'quantity': 0}])),
+        ('Purchase.history_page', lambda: Purchase.history_page(ids['history'], limit=11)),
+        ('Purchase.history_page(seek)', lambda: Purchase.history_page(
+            ids['history'], limit=11, after=(datetime.now(timezone.utc), 2 ** 31 - 1))),
+        ('Purchase.create_from_cart', lambda: Purchase.create_from_cart(buyer, 'explain')),
+        ('SellerOrder.page', lambda: SellerOrder.page(seller, limit=51)),
+        ('SellerOrder.page(incomplete, seek)', lambda: SellerOrder.page(
+            seller, status='incomplete', after=(2 ** 31 - 1, 0), limit=51)),
+        ('SellerOrder.page(search)', lambda: SellerOrder.page(seller, search='12', limit=51)),
+        ('SellerOrder.set_fulfillment', lambda: SellerOrder.set_fulfillment(
+            seller, False, lines=[(1, product)], order_ids=[2, 3])),
+        ('SellerSales.record_purchase', lambda: SellerSales.record_purchase(ids['purchase'])),
+        ('SellerSales.series', lambda: SellerSales.series(seller, 'week', year_ago, today)),
+        ('SellerSales.series(raw)', lambda: SellerSales.series(seller, 'week', year_ago, today, raw=True)),
+        ('SellerSales.top_products', lambda: SellerSales.top_products(seller, year_ago, today)),
+        ('SellerSales.top_products(raw)', lambda: SellerSales.top_products(seller, year_ago, today, raw=True)),
+        ('SellerSales.backlog', lambda: SellerSales.backlog(seller)),
+        ('User.get', lambda: User.get(seller)),
+        ('User.email_exists', lambda: User.email_exists(ids['email'])),
+        ('User.getTotalSpending', lambda: User.getTotalSpending(ids['history'])),
+        ('User.getTotalProfit', lambda: User.getTotalProfit(seller)),
+        ('UserStats.get', lambda: UserStats.get(seller)),
+        ('UserStats.record_fulfillment', lambda: UserStats.record_fulfillment(seller, True, 1)),
+    ]
+
+
+def walk(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk(child)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--min-rows', type=int, default=10000,
+                        help='flag seq scans only on tables with at least this many rows')
+    parser.add_argument('--verbose', action='store_true', help='print every plan')
+    args = parser.parse_args()
+
+    app = create_app()
+    db = app.db
+    flagged = []
+    sizes = {}
+    current = {'label': None}
+    run = db._run
+
+    def explain_then_run(conn, stmt, params, kwargs):
+        sql = stmt.text.strip()
+        if not sql.upper().startswith('EXPLAIN'):
+            plan = conn.execute(text('EXPLAIN (FORMAT JSON) ' + sql), params if params is not None else kwargs)
+            plan = plan.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            report(conn, current['label'], sql, plan[0]['Plan'])
+        return run(conn, stmt, params, kwargs)
+
+    def report(conn, label, sql, plan):
+        nodes = list(walk(plan))
+        for node in nodes:
+            if node['Node Type'] != 'Seq Scan':
+                continue
+            rel = node['Relation Name']
+            if rel not in sizes:
+                sizes[rel] = int(conn.execute(
+                    text('SELECT reltuples FROM pg_class WHERE oid = CAST(:rel AS regclass)'),
+                    {'rel': rel}).scalar() or 0)
+            if sizes[rel] >= args.min_rows:
+                flagged.append((label, rel, sizes[rel]))
+                print(f'SEQ SCAN  {label}: {rel} (~{sizes[rel]} rows)')
+        if args.verbose:
+            print(f'--- {label}: {" ".join(sql.split())[:120]}')
+            for node in nodes[:6]:
+                target = node.get('Index Name') or node.get('Relation Name') or ''
+                print(f'    {node["Node Type"]} {target} (cost {node["Total Cost"]}, rows {node["Plan Rows"]})')
+
+    with app.app_context():
+        ids = sample_ids(db)
+        db._run = explain_then_run
+        try:
+            with db.transaction():
+                for label, call in model_calls(ids):
+                    current['label'] = label
+                    call()
+                raise _Rollback()
+        except _Rollback:
+            pass
+        finally:
+            db._run = run
+
+    print(f'{len(flagged)} sequential scan(s) on tables with >= {args.min_rows} rows')
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
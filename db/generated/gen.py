@@ -129,7 +129,7 @@ def gen_inventory(sellers, products):
                 price = f"{random.uniform(5, 1000):.2f}"
                 
                 writer.writerow([seller_id, prod['id'], qty, price])
-                product_to_sellers[prod['id']].append({'seller_id': seller_id, 'qty': qty})
+                product_to_sellers[prod['id']].append({'seller_id': seller_id, 'qty': qty, 'price': price})
         
         print('\nInventory written')
     
@@ -227,7 +227,7 @@ def gen_purchases_and_order_items(num_purchases, users, products, product_to_sel
                 max_possible = seller_entry['qty'] if seller_entry['qty'] > 0 else 1
                 qty = random.randint(1, min(3, max_possible))
                 
-                unit_price = round(random.uniform(5, 1000), 2)
+                unit_price = seller_entry['price']
                 items_for_this_purchase.append({
                     'seller_id': seller_entry['seller_id'],
                     'product_id': pid,
@@ -257,7 +257,9 @@ def gen_purchases_and_order_items(num_purchases, users, products, product_to_sel
                 key = (purchase_id, item['seller_id'], item['product_id'])
                 if key in used_keys:
                     continue
-                o_writer.writerow([purchase_id, item['seller_id'], item['product_id'], item['quantity'], 0])
+                line_total = f"{float(item['unit_price']) * item['quantity']:.2f}"
+                o_writer.writerow([purchase_id, item['seller_id'], item['product_id'], item['quantity'], 0,
+                                   item['unit_price'], line_total])
                 order_items_rows.append({
                     'purchase_id': purchase_id,
                     'seller_id': item['seller_id'],
@@ -0,0 +1,400 @@
+# gen_bulk.py
+"""Production-scale seed data: millions of rows with realistic skew.
+
+gen.py builds every row in Python and hashes every password, which is
+fine for ~100 users. This generator samples whole columns at once with
+numpy instead:
+
+* product popularity is Zipfian (--product-skew): popular products get
+  more sellers, more cart lines and more orders;
+* sellers are heavy-tailed (--seller-skew): a few sellers carry much of
+  the inventory; buyers likewise (--buyer-skew);
+* passwords come from a small pool of precomputed hashes: user i logs in
+  with pass{i % hash_pool} (Thomas, user 0, keeps pass0);
+* names/addresses are drawn from pools made with Faker once;
+* rows are streamed to CSV in chunks, optionally by several processes
+  (--shards) each writing its own part file.
+
+The output is the CSV layout load.sql expects (with a header row), plus a
+manifest.json of files and row counts. With --shards N > 1 each table is
+split into Table.000.csv, Table.001.csv, ... The data only depends on
+--seed and the sizes (dates are relative to today), not on --shards.
+
+    python db/generated/gen_bulk.py                  # 1M users, 100k products, 10M inventory/ledger rows
+    python db/generated/gen_bulk.py --scale 0.01     # same shape, 1% of the rows
+    python db/generated/gen_bulk.py --shards 8 --out /tmp/bulk
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from faker import Faker
+from werkzeug.security import generate_password_hash
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Rows formatted per chunk; users are also seeded per chunk, which keeps
+# the output independent of how chunks are spread over shards.
+CHUNK = 100_000
+
+BIOS = [
+    "Above average cat enjoyer",
+    "Professional feline enthusiast",
+    "Dedicated to finding the perfect cat for every occasion",
+    "Cat collector extraordinaire",
+    "Part-time cat whisperer, full-time cat admirer",
+    "I love Chat-GPT but I like cats more",
+]
+SAYINGS = ["meow", "hello", "goodbye", "prr"]
+TAGS = ["cute", "grumpy", "fluffy", "orange", "black", "white", "tabby", "sleepy", "tiny", "two"]
+
+TABLES = {
+    # table: (file stem, header)
+    'users': ('Users', ['id', 'firstname', 'lastname', 'email', 'password', 'address', 'balance', 'bio']),
+    'products': ('Products', ['id', 'name', 'description', 'image', 'category', 'created_by']),
+    'inventory': ('Inventory', ['seller_id', 'product_id', 'quantity', 'price']),
+    'carts': ('Carts', ['account_id', 'product_id', 'seller_id', 'quantity']),
+    'purchases': ('Purchases', ['purchase_id', 'address', 'date', 'buyer_id', 'fulfillment_status']),
+    'ledger': ('Order_items', ['purchase_id', 'seller_id', 'product_id', 'quantity', 'fulfillment_status',
+                               'unit_price', 'line_total']),
+}
+
+# Filled in by the parent before forking workers (shared copy-on-write)
+_DATA = {}
+
+
+def rng_for(seed, *stream):
+    return np.random.default_rng([seed, *stream])
+
+
+def zipf_weights(n, skew, rng):
+    """Zipf weights 1/rank^skew, with ranks shuffled so popularity is not tied to id."""
+    weights = 1.0 / np.arange(1, n + 1, dtype=np.float64) ** skew
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def sample(weights_cdf, size, rng):
+    """Draw `size` indices according to a cumulative weight array."""
+    return np.searchsorted(weights_cdf, rng.random(size) * weights_cdf[-1], side='right')
+
+
+def existing_products():
+    """Tags and image URLs from the checked-in Products.csv, so bulk products look alike."""
+    tags, images = set(), []
+    try:
+        with open(os.path.join(HERE, 'Products.csv'), newline='') as f:
+            for row in csv.DictReader(f):
+                tag = row['description'].split(' cat saying ')[0]
+                if tag and ' ' not in tag:
+                    tags.add(tag)
+                if row['image']:
+                    images.append(row['image'])
+    except FileNotFoundError:
+        pass
+    return sorted(tags) or TAGS, images
+
+
+def make_pools(seed, hash_pool, processes):
+    Faker.seed(seed)
+    fake = Faker()
+    print(f'Hashing {hash_pool} passwords...', flush=True)
+    passwords = [f'pass{i}' for i in range(hash_pool)]
+    if processes > 1:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            hashes = pool.map(generate_password_hash, passwords)
+    else:
+        hashes = [generate_password_hash(p) for p in passwords]
+    tags, images = existing_products()
+    return {
+        'hashes': hashes,
+        'first': [fake.first_name() for _ in range(2000)],
+        'last': [fake.last_name() for _ in range(2000)],
+        'addresses': [fake.address().replace('\n', ', ') for _ in range(5000)],
+        'tags': tags,
+        'images': images,
+    }
+
+
+def plan(args):
+    """Sample every table except Users (generated per chunk by the writers)."""
+    seed = args.seed
+    n_users, n_products = args.users, args.products
+    started = time.monotonic()
+
+    n_sellers = max(1, int(n_users * args.seller_fraction))
+    sellers = rng_for(seed, 1).choice(n_users, n_sellers, replace=False)
+    seller_cdf = np.cumsum(zipf_weights(n_sellers, args.seller_skew, rng_for(seed, 2)))
+    product_weights = zipf_weights(n_products, args.product_skew, rng_for(seed, 3))
+    product_cdf = np.cumsum(product_weights)
+    buyer_cdf = np.cumsum(zipf_weights(n_users, args.buyer_skew, rng_for(seed, 4)))
+
+    # Products
+    rng = rng_for(seed, 5)
+    product_ids = np.arange(1, n_products + 1)
+    base_price = np.clip(rng.lognormal(np.log(40), 1.0, n_products), 1, 5000)
+    _DATA['products'] = {
+        'tag': rng.integers(0, len(_DATA['tags']), n_products),
+        'first': rng.integers(0, len(_DATA['first']), n_products),
+        'saying': sample(np.cumsum([0.4, 0.3, 0.2, 0.1]), n_products, rng),
+        'image': rng.integers(0, max(1, len(_DATA['images'])), n_products),
+        'created_by': sellers[sample(seller_cdf, n_products, rng)],
+    }
+
+    # Inventory: every product gets one seller plus a popularity-weighted
+    # share of the rest; (seller, product) pairs are unique (the PK).
+    rng = rng_for(seed, 6)
+    target = max(args.inventory, n_products)
+    per_product = 1 + rng.multinomial(target - n_products, product_weights)
+    for _ in range(5):
+        # A product can't have more sellers than exist: spread the excess
+        excess = int(np.maximum(per_product - n_sellers, 0).sum())
+        per_product = np.minimum(per_product, n_sellers)
+        room = n_sellers - per_product
+        if not excess or not room.any():
+            break
+        per_product += rng.multinomial(min(excess, int(room.sum())), room / room.sum())
+    slot_product = np.repeat(np.arange(n_products), per_product)
+    keys = np.unique(slot_product.astype(np.int64) * n_sellers + sample(seller_cdf, len(slot_product), rng))
+    for _ in range(5):
+        # Top up slots lost to duplicate picks (heavy-tail sellers collide a lot)
+        missing = per_product - np.bincount(keys // n_sellers, minlength=n_products)
+        if not missing.any():
+            break
+        refill = np.repeat(np.arange(n_products), missing)
+        keys = np.unique(np.concatenate([keys, refill.astype(np.int64) * n_sellers
+                                         + rng.integers(0, n_sellers, len(refill))]))
+    inv_product = (keys // n_sellers).astype(np.int64)
+    inv_seller = sellers[keys % n_sellers]
+    n_inventory = len(keys)
+    # Inventory is product-major: product p's offers are rows offers[p]:offers[p+1]
+    offers = np.searchsorted(inv_product, np.arange(n_products + 1))
+    quantity = rng.integers(0, 101, n_inventory)
+    quantity[rng.random(n_inventory) < 0.1] = 0
+    _DATA['inventory'] = {
+        'seller': inv_seller,
+        'product': product_ids[inv_product],
+        'quantity': quantity,
+        'price': np.round(base_price[inv_product] * rng.uniform(0.8, 1.3, n_inventory), 2),
+    }
+
+    def pick_offers(count, rng):
+        """Popularity-weighted products, each with one of its sellers."""
+        product = sample(product_cdf, count, rng)
+        start, size = offers[product], offers[product + 1] - offers[product]
+        return start + (rng.random(count) * size).astype(np.int64)
+
+    # Carts: unique (account, offer) lines from skewed buyers
+    rng = rng_for(seed, 7)
+    keys = np.unique(sample(buyer_cdf, args.carts, rng).astype(np.int64) * n_inventory
+                     + pick_offers(args.carts, rng))
+    offer = keys % n_inventory
+    _DATA['carts'] = {
+        'account': keys // n_inventory,
+        'product': product_ids[inv_product[offer]],
+        'seller': inv_seller[offer],
+        'quantity': rng.integers(1, 6, len(keys)),
+    }
+
+    # Purchases over the last year, ids in date order; each gets one line
+    # plus a share of the rest, lines unique per (purchase, offer).
+    rng = rng_for(seed, 8)
+    n_purchases = args.purchases
+    now = np.datetime64('now', 's')
+    age = np.sort(rng.integers(0, 365 * 86400, n_purchases))[::-1]
+    lines = 1 + rng.multinomial(max(args.ledger, n_purchases) - n_purchases,
+                                np.full(n_purchases, 1.0 / n_purchases))
+    purchase = np.repeat(np.arange(n_purchases), lines)
+    keys = np.unique(purchase.astype(np.int64) * n_inventory + pick_offers(len(purchase), rng))
+    purchase, offer = keys // n_inventory, keys % n_inventory
+    # Older orders are more likely fulfilled; an order is fulfilled once all its lines are
+    line_status = (rng.random(len(keys)) < np.minimum(1.0, age[purchase] / (14 * 86400))).astype(np.int8)
+    starts = np.searchsorted(purchase, np.arange(n_purchases))
+    # Lines keep the price the offer sells at now, as checkout captures it
+    line_quantity = rng.integers(1, 4, len(keys))
+    unit_price = _DATA['inventory']['price'][offer]
+    _DATA['ledger'] = {
+        'purchase': purchase + 1,
+        'seller': inv_seller[offer],
+        'product': product_ids[inv_product[offer]],
+        'quantity': line_quantity,
+        'status': line_status,
+        'unit_price': unit_price,
+        'line_total': np.round(unit_price * line_quantity, 2),
+    }
+    _DATA['purchases'] = {
+        'address': rng.integers(0, len(_DATA['addresses']), n_purchases),
+        'date': np.datetime_as_string(now - age.astype('timedelta64[s]'), unit='s'),
+        'buyer': sample(buyer_cdf, n_purchases, rng),
+        'status': np.minimum.reduceat(line_status, starts),
+    }
+
+    print(f'Sampled {n_inventory} inventory, {len(_DATA["carts"]["account"])} cart, '
+          f'{n_purchases} purchase and {len(keys)} ledger rows '
+          f'in {time.monotonic() - started:.1f}s', flush=True)
+    return {'users': n_users, 'products': n_products, 'inventory': n_inventory,
+            'carts': len(_DATA['carts']['account']), 'purchases': n_purchases, 'ledger': len(keys)}
+
+
+def user_rows(start, stop, seed):
+    rng = rng_for(seed, 0, start // CHUNK)
+    n = stop - start
+    first, last = _DATA['first'], _DATA['last']
+    addresses, hashes = _DATA['addresses'], _DATA['hashes']
+    fi = rng.integers(0, len(first), n).tolist()
+    la = rng.integers(0, len(last), n).tolist()
+    ad = rng.integers(0, len(addresses), n).tolist()
+    balance = rng.uniform(0, 1000, n).round(2).tolist()
+    bio = rng.integers(0, len(BIOS), n).tolist()
+    for j, uid in enumerate(range(start, stop)):
+        if uid == 0:
+            yield [0, 'Thomas', 'Lee', 'thomas15@yahoo.com', hashes[0], addresses[ad[j]],
+                   f'{balance[j]:.2f}', 'Avid fan of cats that say meow']
+            continue
+        f, l = first[fi[j]], last[la[j]]
+        yield [uid, f, l, f'{f.lower()}.{l.lower()}{uid}@example.com', hashes[uid % len(hashes)],
+               addresses[ad[j]], f'{balance[j]:.2f}', BIOS[bio[j]]]
+
+
+def product_rows(start, stop, seed):
+    d = _DATA['products']
+    tags, first, images = _DATA['tags'], _DATA['first'], _DATA['images']
+    for i in range(start, stop):
+        pid = i + 1
+        tag, name, saying = tags[d['tag'][i]], first[d['first'][i]], SAYINGS[d['saying'][i]]
+        # the id keeps names unique however large the catalog
+        yield [pid, f'{tag} {name} {pid}', f'{tag} cat saying {saying} named {name}',
+               images[d['image'][i]] if images else '', saying, int(d['created_by'][i])]
+
+
+def column_rows(table, columns):
+    def rows(start, stop, seed):
+        d = _DATA[table]
+        cols = [d[c][start:stop].tolist() for c in columns]
+        return zip(*cols)
+    return rows
+
+
+def purchase_rows(start, stop, seed):
+    d = _DATA['purchases']
+    addresses = _DATA['addresses']
+    address = d['address'][start:stop].tolist()
+    date = d['date'][start:stop].tolist()
+    buyer = d['buyer'][start:stop].tolist()
+    status = d['status'][start:stop].tolist()
+    for j in range(stop - start):
+        yield [start + j + 1, addresses[address[j]], date[j] + '+00:00', buyer[j], status[j]]
+
+
+ROWS = {
+    'users': user_rows,
+    'products': product_rows,
+    'inventory': column_rows('inventory', ['seller', 'product', 'quantity', 'price']),
+    'carts': column_rows('carts', ['account', 'product', 'seller', 'quantity']),
+    'purchases': purchase_rows,
+    'ledger': column_rows('ledger', ['purchase', 'seller', 'product', 'quantity', 'status',
+                                     'unit_price', 'line_total']),
+}
+
+
+def csv_chunks(table, start, stop, seed, header=True):
+    """CSV text for rows [start, stop) of one table, CHUNK rows per string."""
+    if header:
+        yield ','.join(TABLES[table][1]) + '\n'
+    for chunk in range(start, stop, CHUNK):
+        buf = io.StringIO()
+        csv.writer(buf, dialect='unix', quoting=csv.QUOTE_MINIMAL).writerows(
+            ROWS[table](chunk, min(chunk + CHUNK, stop), seed))
+        yield buf.getvalue()
+
+
+def write_part(task):
+    """Write rows [start, stop) of one table to one file, a chunk at a time."""
+    table, path, start, stop, seed = task
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for text in csv_chunks(table, start, stop, seed):
+            f.write(text)
+    return table, stop - start
+
+
+def split(table, total, shards, out):
+    """Tasks writing `total` rows as `shards` part files, cut on CHUNK boundaries."""
+    stem = TABLES[table][0]
+    if shards <= 1:
+        return [(os.path.join(out, f'{stem}.csv'), 0, total)]
+    chunks = -(-total // CHUNK)
+    per_shard = -(-chunks // shards) * CHUNK
+    return [(os.path.join(out, f'{stem}.{i:03d}.csv'), start, min(start + per_shard, total))
+            for i, start in enumerate(range(0, total, per_shard))]
+
+
+def add_arguments(parser):
+    """Data-shape options, shared with db/load.py --generate."""
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every row count')
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--inventory', type=int, default=10_000_000)
+    parser.add_argument('--carts', type=int, default=1_000_000)
+    parser.add_argument('--purchases', type=int, default=2_500_000)
+    parser.add_argument('--ledger', type=int, default=10_000_000)
+    parser.add_argument('--seller-fraction', type=float, default=0.25)
+    parser.add_argument('--product-skew', type=float, default=1.1, help='Zipf exponent for product popularity')
+    parser.add_argument('--seller-skew', type=float, default=1.2, help='Zipf exponent for seller inventory share')
+    parser.add_argument('--buyer-skew', type=float, default=0.8, help='Zipf exponent for buyer activity')
+    parser.add_argument('--hash-pool', type=int, default=16, help='distinct password hashes to compute')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def prepare(args, processes=1):
+    """Apply --scale, build the pools and sample every table; returns row counts."""
+    for name in ['users', 'products', 'inventory', 'carts', 'purchases', 'ledger']:
+        setattr(args, name, max(1, int(getattr(args, name) * args.scale)))
+    _DATA.update(make_pools(args.seed, args.hash_pool, processes))
+    return plan(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate production-scale seed CSVs.')
+    add_arguments(parser)
+    parser.add_argument('--shards', type=int, default=1, help='parallel writer processes / part files per table')
+    parser.add_argument('--out', default=os.path.join(HERE, 'bulk'))
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    started = time.monotonic()
+    counts = prepare(args, args.shards)
+
+    tasks = []
+    files = {}
+    for table, total in counts.items():
+        parts = split(table, total, args.shards, args.out)
+        files[table] = [os.path.basename(path) for path, _, _ in parts]
+        tasks += [(table, path, start, stop, args.seed) for path, start, stop in parts]
+    # Biggest first, so no shard is left writing a huge table alone at the end
+    tasks.sort(key=lambda t: t[3] - t[2], reverse=True)
+
+    print(f'Writing {sum(counts.values())} rows to {args.out} ({args.shards} shard(s))...', flush=True)
+    if args.shards > 1:
+        with multiprocessing.get_context('fork').Pool(args.shards) as pool:
+            for table, rows in pool.imap_unordered(write_part, tasks):
+                print(f'  {table}: {rows} rows', flush=True)
+    else:
+        for task in tasks:
+            table, rows = write_part(task)
+            print(f'  {table}: {rows} rows', flush=True)
+
+    with open(os.path.join(args.out, 'manifest.json'), 'w') as f:
+        json.dump({'seed': args.seed, 'counts': counts, 'files': files,
+                   'columns': {t: TABLES[t][1] for t in TABLES}}, f, indent=2)
+    elapsed = time.monotonic() - started
+    total = sum(counts.values())
+    print(f'Done: {total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
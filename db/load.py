@@ -0,0 +1,355 @@
+"""Bulk-load seed data with parallel COPY (the fast path for large data sets).
+
+load.sql \\COPYs each CSV serially into tables whose primary keys, foreign
+keys, indexes and triggers are all live, so every row pays for them.
+This loader instead:
+
+1. checks the target tables are empty (a database fresh from create.sql),
+   saves and drops their foreign keys, primary/unique keys and indexes,
+   and disables their triggers;
+2. COPYs every CSV part into UNLOGGED staging tables over --jobs
+   connections at once (no WAL, no constraint checks);
+3. moves each staging table into its real table with one INSERT ... SELECT;
+4. rebuilds keys and indexes (in parallel), then foreign keys, then
+   fixes the identity sequences, rebuilds product_offer_summary,
+   user_stats and the seller sales rollups, re-enables the triggers, and
+   ANALYZEs.
+
+Input is a directory of CSVs as written by db/generated/gen_bulk.py
+(Table.csv or Table.000.csv, Table.001.csv, ... with a header row), or,
+with --generate, gen_bulk.py's output streamed straight into COPY
+without touching the disk (the gen_bulk.py options apply):
+
+    python db/load.py db/generated/bulk
+    python db/load.py --generate --scale 0.1 --jobs 8
+
+db/setup.sh uses it for any data directory that has a manifest.json.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+DB_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(DB_DIR))
+sys.path.insert(0, os.path.join(DB_DIR, 'generated'))
+
+# gen_bulk table -> (file stem, database table, columns); in load order
+TABLES = {
+    'users': ('Users', 'Users', ['id', 'firstname', 'lastname', 'email', 'password', 'address', 'balance', 'bio']),
+    'products': ('Products', 'Products', ['id', 'name', 'description', 'image', 'category', 'created_by']),
+    'inventory': ('Inventory', 'Inventory', ['seller_id', 'product_id', 'quantity', 'price']),
+    'carts': ('Carts', 'Cart', ['account_id', 'product_id', 'seller_id', 'quantity']),
+    'purchases': ('Purchases', 'Purchases', ['purchase_id', 'address', 'date', 'buyer_id', 'fulfillment_status']),
+    'ledger': ('Order_items', 'Ledger', ['purchase_id', 'seller_id', 'product_id', 'quantity', 'fulfillment_status',
+                                         'unit_price', 'line_total']),
+}
+IDENTITY_COLUMNS = {'Users': 'id', 'Products': 'id', 'Purchases': 'purchase_id'}
+
+# Shared with forked COPY workers
+_URL = None
+_PROGRESS = None
+
+
+def connect(url):
+    raw = create_engine(url, poolclass=NullPool).raw_connection()
+    with raw.cursor() as cur:
+        # Nothing here needs to survive a crash until the final commit
+        cur.execute("SET synchronous_commit = off")
+        cur.execute("SET statement_timeout = 0")
+        # Index and foreign key builds sort a lot
+        cur.execute("SET maintenance_work_mem = '512MB'")
+    raw.commit()
+    return raw
+
+
+def run(conn, sql):
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        return cur.fetchall() if cur.description else cur.rowcount
+
+
+def staging(table):
+    return f'load_{TABLES[table][1].lower()}'
+
+
+class _Stream:
+    """File-like object over text chunks, counting rows as COPY reads them."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = ''
+        self.pos = 0
+
+    def read(self, size=-1):
+        while self.pos >= len(self.buf):
+            try:
+                self.buf, self.pos = next(self.chunks), 0
+            except StopIteration:
+                return ''
+        end = len(self.buf) if size < 0 else self.pos + size
+        data = self.buf[self.pos:end]
+        self.pos += len(data)
+        with _PROGRESS.get_lock():
+            _PROGRESS.value += data.count('\n')
+        return data
+
+
+def file_chunks(path, size=1 << 20):
+    with open(path, encoding='utf-8') as f:
+        while True:
+            data = f.read(size)
+            if not data:
+                return
+            yield data
+
+
+def copy_task(task):
+    """COPY one file or generated slice into its staging table; returns (table, rows)."""
+    table, source = task
+    if isinstance(source, str):
+        chunks = file_chunks(source)
+    else:
+        import gen_bulk
+        start, stop, seed = source
+        chunks = gen_bulk.csv_chunks(table, start, stop, seed)
+    conn = connect(_URL)
+    try:
+        columns = ', '.join(TABLES[table][2])
+        with conn.cursor() as cur:
+            cur.copy_expert(f'COPY {staging(table)} ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)',
+                            _Stream(chunks), size=1 << 18)
+            rows = cur.rowcount
+        conn.commit()
+        # The header line was counted as a row
+        with _PROGRESS.get_lock():
+            _PROGRESS.value -= 1
+        return table, rows
+    finally:
+        conn.close()
+
+
+def parallel(jobs, fn, tasks):
+    """Run fn over tasks in `jobs` forked processes, yielding results as they finish."""
+    if jobs <= 1:
+        for task in tasks:
+            yield fn(task)
+        return
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+        yield from pool.imap_unordered(fn, tasks)
+
+
+def ddl_task(statement):
+    conn = connect(_URL)
+    try:
+        started = time.monotonic()
+        run(conn, statement)
+        conn.commit()
+        return statement, time.monotonic() - started
+    finally:
+        conn.close()
+
+
+def find_files(directory):
+    """table -> CSV paths in `directory`, from manifest.json or by name."""
+    manifest = os.path.join(directory, 'manifest.json')
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            files = json.load(f)['files']
+        return {table: [os.path.join(directory, name) for name in files.get(table, [])] for table in TABLES}
+    found = {}
+    for table, (stem, _, _) in TABLES.items():
+        parts = sorted(glob.glob(os.path.join(directory, f'{stem}.[0-9]*.csv')))
+        single = os.path.join(directory, f'{stem}.csv')
+        found[table] = parts or ([single] if os.path.exists(single) else [])
+    return found
+
+
+def table_names():
+    return [TABLES[t][1].lower() for t in TABLES]
+
+
+def deferred_ddl(conn):
+    """(drop, keys, foreign_keys) statements for everything on the target tables
+    that slows loading down. Indexes that back a constraint come back with it."""
+    names = "', '".join(table_names())
+    fks = run(conn, f'''
+        SELECT c.conrelid::regclass, c.conname, pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        WHERE c.contype = 'f'
+          AND (c.conrelid::regclass::text IN ('{names}') OR c.confrelid::regclass::text IN ('{names}'))
+        ORDER BY 1, 2
+    ''')
+    keys = run(conn, f'''
+        SELECT c.conrelid::regclass, c.conname, pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        WHERE c.contype IN ('p', 'u') AND c.conrelid::regclass::text IN ('{names}')
+        ORDER BY 1, 2
+    ''')
+    indexes = run(conn, f'''
+        SELECT i.indexrelid::regclass, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid::regclass::text IN ('{names}')
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+        ORDER BY 1
+    ''')
+    drop = ([f'ALTER TABLE {t} DROP CONSTRAINT {n}' for t, n, _ in fks]
+            + [f'ALTER TABLE {t} DROP CONSTRAINT {n}' for t, n, _ in keys]
+            + [f'DROP INDEX {n}' for n, _ in indexes])
+    rebuild = ([f'ALTER TABLE {t} ADD CONSTRAINT {n} {d}' for t, n, d in keys]
+               + [d for _, d in indexes])
+    restore_fks = [f'ALTER TABLE {t} ADD CONSTRAINT {n} {d}' for t, n, d in fks]
+    return drop, rebuild, restore_fks
+
+
+class Progress(threading.Thread):
+    """Prints rows copied so far and the rate every few seconds."""
+
+    def __init__(self, total=None, every=3.0):
+        super().__init__(daemon=True)
+        self.total = total
+        self.every = every
+        self.started = time.monotonic()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.every):
+            self.report()
+
+    def report(self):
+        rows = _PROGRESS.value
+        elapsed = time.monotonic() - self.started
+        of = f' of {self.total}' if self.total else ''
+        print(f'  {rows}{of} rows, {rows / elapsed:.0f} rows/s', flush=True)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def phase(name, started):
+    print(f'{name} ({time.monotonic() - started:.1f}s)', flush=True)
+
+
+def main():
+    global _URL, _PROGRESS
+    parser = argparse.ArgumentParser(description='Bulk-load seed CSVs with parallel COPY.',
+                                     usage='%(prog)s [options] DIRECTORY | --generate [gen_bulk.py options]')
+    parser.add_argument('--generate', action='store_true', help='stream gen_bulk.py output instead of files')
+    parser.add_argument('--jobs', type=int, default=min(8, os.cpu_count() or 1),
+                        help='parallel connections (default: CPUs, up to 8)')
+    parser.add_argument('--url', help='database URL (default: from .flaskenv)')
+    args, rest = parser.parse_known_args()
+
+    if args.generate:
+        import gen_bulk
+        gen_parser = argparse.ArgumentParser(prog=f'{parser.prog} --generate')
+        gen_bulk.add_arguments(gen_parser)
+        gen_args = gen_parser.parse_args(rest)
+        counts = gen_bulk.prepare(gen_args, args.jobs)
+        tasks = []
+        for table, total in counts.items():
+            # One slice per job, so every table's COPY is spread over connections
+            for _, start, stop in gen_bulk.split(table, total, args.jobs, ''):
+                tasks.append((table, (start, stop, gen_args.seed)))
+        total = sum(counts.values())
+    else:
+        if len(rest) != 1 or rest[0].startswith('-'):
+            parser.error('give a data directory, or --generate with gen_bulk.py options')
+        directory = rest[0]
+        files = find_files(directory)
+        tasks = [(table, path) for table, paths in files.items() for path in paths]
+        total = None
+        manifest = os.path.join(directory, 'manifest.json')
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                total = sum(json.load(f)['counts'].values())
+    if not tasks:
+        print('nothing to load', file=sys.stderr)
+        return 1
+
+    from migrate import database_url
+    _URL = args.url or database_url()
+    _PROGRESS = multiprocessing.Value('q', 0)
+    started = time.monotonic()
+    conn = connect(_URL)
+    conn.driver_connection.autocommit = True
+
+    for table in TABLES:
+        name = TABLES[table][1]
+        if run(conn, f'SELECT EXISTS (SELECT 1 FROM {name})')[0][0]:
+            print(f'{name} is not empty; load into a fresh database (db/setup.sh)', file=sys.stderr)
+            return 1
+
+    drop, rebuild, restore_fks = deferred_ddl(conn)
+    try:
+        # 1. Constraints, indexes and triggers off; unlogged staging tables
+        for statement in drop:
+            run(conn, statement)
+        for table in TABLES:
+            name, columns = TABLES[table][1], ', '.join(TABLES[table][2])
+            run(conn, f'ALTER TABLE {name} DISABLE TRIGGER USER')
+            run(conn, f'DROP TABLE IF EXISTS {staging(table)}')
+            run(conn, f'CREATE UNLOGGED TABLE {staging(table)} AS SELECT {columns} FROM {name} WITH NO DATA')
+        phase(f'Dropped {len(drop)} constraints/indexes', started)
+
+        # 2. Parallel COPY into staging, biggest tasks first
+        print(f'Copying {len(tasks)} part(s) over {args.jobs} connection(s)...', flush=True)
+        progress = Progress(total)
+        progress.start()
+        copied = {}
+        try:
+            for table, rows in parallel(args.jobs, copy_task, tasks):
+                copied[table] = copied.get(table, 0) + rows
+        finally:
+            progress.stop()
+        progress.report()
+        phase('Copied ' + ', '.join(f'{TABLES[t][1]} {n}' for t, n in copied.items()), started)
+
+        # 3. Staging -> tables (no keys or indexes yet, so these are plain appends)
+        moves = [f'INSERT INTO {TABLES[t][1]} ({", ".join(TABLES[t][2])}) '
+                 f'SELECT {", ".join(TABLES[t][2])} FROM {staging(t)}' for t in copied]
+        for statement, seconds in parallel(args.jobs, ddl_task, moves):
+            print(f'  {statement.split()[2]}: {seconds:.1f}s', flush=True)
+        phase('Moved staging tables', started)
+
+        # 4. Keys and indexes, then foreign keys (which need the keys)
+        for statements, label in [(rebuild, 'keys/indexes'), (restore_fks, 'foreign keys')]:
+            for statement, seconds in parallel(args.jobs, ddl_task, statements):
+                print(f'  {seconds:6.1f}s {statement[:90]}', flush=True)
+            phase(f'Rebuilt {len(statements)} {label}', started)
+        drop, rebuild, restore_fks = [], [], []
+    finally:
+        for table in TABLES:
+            run(conn, f'DROP TABLE IF EXISTS {staging(table)}')
+            run(conn, f'ALTER TABLE {TABLES[table][1]} ENABLE TRIGGER USER')
+        if rebuild or restore_fks:
+            print('load failed: the database is missing keys/indexes; re-run db/setup.sh', file=sys.stderr)
+
+    for name, column in IDENTITY_COLUMNS.items():
+        run(conn, f'''SELECT setval(pg_get_serial_sequence('{name}', '{column}'),
+                                    (SELECT COALESCE(MAX({column}), 0) FROM {name}) + 1, false)''')
+    # The summary triggers were off while Inventory loaded
+    run(conn, 'SELECT refresh_product_offer_summary(ARRAY(SELECT DISTINCT product_id FROM Inventory))')
+    run(conn, 'SELECT refresh_user_stats(ARRAY(SELECT id FROM Users))')
+    run(conn, '''SELECT refresh_seller_sales(MIN(date AT TIME ZONE 'UTC')::DATE,
+                                             MAX(date AT TIME ZONE 'UTC')::DATE + 1) FROM Purchases''')
+    run(conn, 'ANALYZE')
+    phase('Fixed sequences, rebuilt product_offer_summary, user_stats and seller sales, analyzed', started)
+
+    elapsed = time.monotonic() - started
+    rows = sum(copied.values())
+    print(f'Loaded {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s overall)')
+    conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
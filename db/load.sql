@@ -34,4 +34,11 @@ SELECT pg_catalog.setval(
 \echo 'Loading Ledger...'
 \COPY Ledger FROM 'Order_items.csv' WITH DELIMITER ',' NULL '' CSV HEADER
 
+\echo 'Computing user stats...'
+SELECT refresh_user_stats(ARRAY(SELECT id FROM Users));
+
+\echo 'Computing seller sales...'
+SELECT refresh_seller_sales(MIN(date AT TIME ZONE 'UTC')::DATE, MAX(date AT TIME ZONE 'UTC')::DATE + 1)
+FROM Purchases;
+
 \echo 'All CSV imports finished.'
\ No newline at end of file
@@ -0,0 +1,342 @@
+"""Versioned schema migrations for a live database.
+
+Migrations live in db/migrations/ as NNNN_description.sql or
+NNNN_description.py and are applied in version order. Each applied
+migration is recorded in the schema_version table with a checksum of its
+file, so an edited migration is reported instead of silently skipped.
+
+    python db/migrate.py status      # applied / pending / changed migrations
+    python db/migrate.py up          # apply everything pending
+    python db/migrate.py up --to 4   # ... up to and including version 4
+    python db/migrate.py baseline    # record all migrations as applied without
+                                     # running them (a database just built from
+                                     # create.sql, see setup.sh)
+    python db/migrate.py verify      # exit 1 if any applied migration changed
+
+SQL migrations run in one transaction, together with their schema_version
+row, unless the file starts with the directive
+
+    -- migrate: no-transaction
+
+in which case each statement runs (and commits) on its own, as
+CREATE INDEX CONCURRENTLY requires. Such a file must be safe to re-run
+(IF NOT EXISTS etc.): a failure halfway leaves the earlier statements in
+place and the migration unrecorded.
+
+Python migrations define `upgrade(m)` and run outside a transaction; `m`
+(a MigrationContext) offers `m.execute(sql)` for single statements and
+`m.backfill(sql)` for batched data changes that commit batch by batch, so
+no single long transaction holds row locks on a big table:
+
+    def upgrade(m):
+        m.execute('ALTER TABLE Ledger ADD COLUMN IF NOT EXISTS unit_price DECIMAL(12,2)')
+        m.backfill('''
+            UPDATE Ledger SET unit_price = ...
+            WHERE (purchase_id, product_id, seller_id) IN (
+                SELECT purchase_id, product_id, seller_id FROM Ledger
+                WHERE unit_price IS NULL LIMIT :batch_size)
+        ''')
+
+Only one runner works on a database at a time (advisory lock), and DDL
+gives up after --lock-timeout rather than queueing behind a long
+transaction and blocking every query on the table meanwhile.
+"""
+import argparse
+import hashlib
+import importlib.util
+import os
+import re
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+
+DB_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(DB_DIR, 'migrations')
+FILENAME = re.compile(r'^(\d+)_(\w+)\.(sql|py)$')
+NO_TRANSACTION = re.compile(r'^--\s*migrate:\s*no-transaction\s*$', re.MULTILINE)
+# Arbitrary key for pg_advisory_lock, shared by every runner
+LOCK_KEY = 316516
+
+sys.path.insert(0, os.path.dirname(DB_DIR))
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    def __init__(self, path):
+        match = FILENAME.match(os.path.basename(path))
+        self.path = path
+        self.version = int(match.group(1))
+        self.name = match.group(2)
+        self.kind = match.group(3)
+        with open(path, 'rb') as f:
+            self.source = f.read()
+        self.checksum = hashlib.sha256(self.source).hexdigest()
+
+    @property
+    def transactional(self):
+        return self.kind == 'sql' and not NO_TRANSACTION.search(self.source.decode())
+
+    def __str__(self):
+        return f'{self.version:04d}_{self.name}'
+
+
+class MigrationContext:
+    """What a Python migration's `upgrade(m)` gets to work with."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, **params):
+        """Run one statement, committed on its own; returns rows or rowcount."""
+        result = self.conn.execute(text(sql), params)
+        return result.fetchall() if result.returns_rows else result.rowcount
+
+    def backfill(self, sql, batch_size=5000, pause=0.0, **params):
+        """Run `sql` repeatedly, one committed transaction per batch, until it
+        touches no rows. `sql` must limit itself with :batch_size and skip
+        rows it already handled. Returns the total row count."""
+        total = 0
+        started = time.monotonic()
+        while True:
+            count = self.execute(sql, batch_size=batch_size, **params)
+            if not count:
+                break
+            total += count
+            elapsed = time.monotonic() - started
+            print(f'    {total} rows ({total / elapsed:.0f} rows/s)', flush=True)
+            if pause:
+                time.sleep(pause)
+        return total
+
+
+def split_statements(sql):
+    """Split a SQL script on top-level semicolons (quotes, dollar-quoted
+    bodies and comments are respected)."""
+    statements = []
+    current = []
+    i = 0
+    while i < len(sql):
+        ch = sql[i]
+        if sql.startswith('--', i):
+            end = sql.find('\n', i)
+            end = len(sql) if end == -1 else end
+            current.append(sql[i:end])
+            i = end
+            continue
+        if sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            end = len(sql) if end == -1 else end + 2
+            current.append(sql[i:end])
+            i = end
+            continue
+        if ch == "'":
+            end = i + 1
+            while end < len(sql):
+                if sql[end] == "'" and sql.startswith("''", end):
+                    end += 2
+                    continue
+                if sql[end] == "'":
+                    break
+                end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+            continue
+        dollar = re.match(r'\$\w*\$', sql[i:]) if ch == '$' else None
+        if dollar:
+            tag = dollar.group(0)
+            end = sql.find(tag, i + len(tag))
+            end = len(sql) if end == -1 else end + len(tag)
+            current.append(sql[i:end])
+            i = end
+            continue
+        if ch == ';':
+            statements.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    statements.append(''.join(current))
+
+    def has_code(stmt):
+        return re.sub(r'--[^\n]*|/\*.*?\*/', '', stmt, flags=re.DOTALL).strip()
+    return [s.strip() for s in statements if has_code(s)]
+
+
+def discover(directory=MIGRATIONS_DIR):
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        if FILENAME.match(filename):
+            migrations.append(Migration(os.path.join(directory, filename)))
+    migrations.sort(key=lambda m: m.version)
+    for prev, cur in zip(migrations, migrations[1:]):
+        if prev.version == cur.version:
+            raise MigrationError(f'duplicate migration version: {prev} and {cur}')
+    return migrations
+
+
+class Runner:
+    def __init__(self, url, lock_timeout='5s'):
+        self.engine = create_engine(url)
+        self.conn = self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        self.conn.execute(text("SELECT set_config('lock_timeout', :t, false)"), {'t': lock_timeout})
+        self.conn.execute(text("SET statement_timeout = 0"))
+        self.conn.execute(text('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT NOT NULL PRIMARY KEY,
+                name TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (current_timestamp AT TIME ZONE 'UTC'),
+                duration_ms INT NOT NULL DEFAULT 0
+            )
+        '''))
+        if not self.conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': LOCK_KEY}).scalar():
+            raise MigrationError('another migration runner holds the lock on this database')
+
+    def close(self):
+        self.conn.close()
+        self.engine.dispose()
+
+    def applied(self):
+        rows = self.conn.execute(text('SELECT version, name, checksum FROM schema_version ORDER BY version'))
+        return {row.version: row for row in rows}
+
+    def changed(self, migrations):
+        applied = self.applied()
+        return [m for m in migrations if m.version in applied and applied[m.version].checksum != m.checksum]
+
+    def pending(self, migrations, to=None):
+        applied = self.applied()
+        return [m for m in migrations
+                if m.version not in applied and (to is None or m.version <= to)]
+
+    def _record(self, migration, duration_ms=0):
+        self.conn.execute(text('''
+            INSERT INTO schema_version (version, name, checksum, duration_ms)
+            VALUES (:version, :name, :checksum, :duration_ms)
+        '''), {'version': migration.version, 'name': migration.name,
+               'checksum': migration.checksum, 'duration_ms': duration_ms})
+
+    def _raw(self, sql):
+        # The DBAPI cursor, so % and : in migration files are left alone
+        with self.conn.connection.cursor() as cursor:
+            cursor.execute(sql)
+
+    def apply(self, migration):
+        """Run one migration and record it; returns the elapsed seconds."""
+        started = time.monotonic()
+        source = migration.source.decode()
+
+        if migration.transactional:
+            # The script and its schema_version row commit together
+            self._raw('BEGIN')
+            try:
+                self._raw(source)
+                self._record(migration, int((time.monotonic() - started) * 1000))
+            except Exception:
+                self._raw('ROLLBACK')
+                raise
+            self._raw('COMMIT')
+            return time.monotonic() - started
+
+        try:
+            if migration.kind == 'py':
+                spec = importlib.util.spec_from_file_location(f'migration_{migration.version}', migration.path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                module.upgrade(MigrationContext(self.conn))
+            else:
+                for statement in split_statements(source):
+                    self._raw(statement)
+        except Exception:
+            self._report_invalid_indexes()
+            raise
+        elapsed = time.monotonic() - started
+        self._record(migration, int(elapsed * 1000))
+        return elapsed
+
+    def _report_invalid_indexes(self):
+        """A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind,
+        which IF NOT EXISTS would then skip over on the next run."""
+        rows = self.conn.execute(text('''
+            SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE NOT i.indisvalid
+        ''')).fetchall()
+        for row in rows:
+            print(f'  invalid index left behind: {row.relname} (DROP INDEX CONCURRENTLY {row.relname}; then re-run)',
+                  file=sys.stderr)
+
+    def baseline(self, migrations, to=None):
+        for migration in self.pending(migrations, to):
+            self._record(migration)
+            print(f'baselined {migration}')
+
+
+def database_url():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(os.path.dirname(DB_DIR), '.flaskenv'))
+    except ImportError:
+        pass
+    from app.config import Config
+    return Config.SQLALCHEMY_DATABASE_URI
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply versioned schema migrations.')
+    parser.add_argument('command', nargs='?', default='status', choices=['status', 'up', 'baseline', 'verify'])
+    parser.add_argument('--to', type=int, help='stop after this version')
+    parser.add_argument('--url', help='database URL (default: from .flaskenv)')
+    parser.add_argument('--lock-timeout', default='5s',
+                        help="how long DDL may wait for a table lock before failing (default 5s)")
+    args = parser.parse_args()
+
+    migrations = discover()
+    runner = Runner(args.url or database_url(), args.lock_timeout)
+    try:
+        changed = runner.changed(migrations)
+        for migration in changed:
+            print(f'CHANGED since applied: {migration}', file=sys.stderr)
+
+        if args.command == 'status':
+            applied = runner.applied()
+            for migration in migrations:
+                state = 'applied' if migration.version in applied else 'pending'
+                if migration in changed:
+                    state = 'changed'
+                print(f'{state:8} {migration}')
+            return 0
+
+        if args.command == 'verify':
+            return 1 if changed else 0
+
+        if args.command == 'baseline':
+            runner.baseline(migrations, args.to)
+            return 0
+
+        if changed:
+            print('refusing to migrate: applied migrations were edited (add a new migration instead)',
+                  file=sys.stderr)
+            return 1
+        pending = runner.pending(migrations, args.to)
+        if not pending:
+            print('database is up to date')
+        for migration in pending:
+            mode = 'transaction' if migration.transactional else 'no transaction'
+            print(f'applying {migration} ({mode})', flush=True)
+            elapsed = runner.apply(migration)
+            print(f'  done in {elapsed:.2f}s')
+        return 0
+    finally:
+        runner.close()
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except MigrationError as e:
+        print(f'error: {e}', file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,75 @@
+-- Migration script to add the product_offer_summary table (min/max price,
+-- seller count and total stock per product) and the Inventory triggers
+-- that keep it up to date, then populate it from existing Inventory rows.
+
+-- Step 1: Create the summary table and its sort indexes if they don't exist
+CREATE TABLE IF NOT EXISTS product_offer_summary (
+    product_id INT PRIMARY KEY,
+    min_price DECIMAL(12,2) NOT NULL,
+    max_price DECIMAL(12,2) NOT NULL,
+    seller_count INT NOT NULL,
+    total_stock INT NOT NULL,
+    FOREIGN KEY (product_id) REFERENCES Products(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS product_offer_summary_min_price_idx ON product_offer_summary (min_price, product_id);
+CREATE INDEX IF NOT EXISTS product_offer_summary_max_price_idx ON product_offer_summary (max_price, product_id);
+
+-- Step 2: Maintenance functions and triggers (safe to re-run)
+
+-- Recompute the summary rows for the given products from Inventory.
+CREATE OR REPLACE FUNCTION refresh_product_offer_summary(pids INT[]) RETURNS void AS $$
+BEGIN
+    DELETE FROM product_offer_summary s
+    WHERE s.product_id = ANY(pids)
+      AND NOT EXISTS (SELECT 1 FROM Inventory i WHERE i.product_id = s.product_id);
+
+    INSERT INTO product_offer_summary (product_id, min_price, max_price, seller_count, total_stock)
+    SELECT product_id, MIN(price), MAX(price), COUNT(*), SUM(quantity)
+    FROM Inventory
+    WHERE product_id = ANY(pids)
+    GROUP BY product_id
+    ON CONFLICT (product_id) DO UPDATE
+    SET min_price = EXCLUDED.min_price,
+        max_price = EXCLUDED.max_price,
+        seller_count = EXCLUDED.seller_count,
+        total_stock = EXCLUDED.total_stock;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION inventory_refresh_offer_summary() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_product_offer_summary(ARRAY(SELECT DISTINCT product_id FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_product_offer_summary(ARRAY(SELECT DISTINCT product_id FROM old_rows));
+    ELSE
+        PERFORM refresh_product_offer_summary(ARRAY(
+            SELECT product_id FROM new_rows
+            UNION
+            SELECT product_id FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS inventory_offer_summary_ins ON Inventory;
+CREATE TRIGGER inventory_offer_summary_ins
+    AFTER INSERT ON Inventory
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_refresh_offer_summary();
+
+DROP TRIGGER IF EXISTS inventory_offer_summary_upd ON Inventory;
+CREATE TRIGGER inventory_offer_summary_upd
+    AFTER UPDATE ON Inventory
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_refresh_offer_summary();
+
+DROP TRIGGER IF EXISTS inventory_offer_summary_del ON Inventory;
+CREATE TRIGGER inventory_offer_summary_del
+    AFTER DELETE ON Inventory
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_refresh_offer_summary();
+
+-- Step 3: Backfill from the current inventory
+SELECT refresh_product_offer_summary(ARRAY(SELECT DISTINCT product_id FROM Inventory));
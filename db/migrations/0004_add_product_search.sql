@@ -0,0 +1,25 @@
+-- Migration script to add keyword search support to Products:
+-- a weighted full-text vector (name = A, description = B) with a GIN
+-- index, and a pg_trgm GIN index on name for substring/typo matching.
+
+-- Step 1: Enable pg_trgm (trusted extension; the database owner can create it)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Step 2: Add search_vector column to Products table if it doesn't exist
+DO $$ 
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns 
+        WHERE table_name = 'products' AND column_name = 'search_vector'
+    ) THEN
+        ALTER TABLE Products ADD COLUMN search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(description, '')), 'B')
+            ) STORED;
+    END IF;
+END $$;
+
+-- Step 3: Search indexes
+CREATE INDEX IF NOT EXISTS products_search_vector_idx ON Products USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS products_name_trgm_idx ON Products USING GIN (name gin_trgm_ops);
@@ -0,0 +1,35 @@
+-- migrate: no-transaction
+-- Migration script to add secondary indexes for the hot access paths.
+-- Built CONCURRENTLY so a live database keeps serving reads and writes;
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so
+-- db/migrate.py runs each statement on its own (see the directive above).
+--
+-- Cart lookups by account_id and Ledger lookups by purchase_id are
+-- already served by the leading column of their primary keys.
+
+-- Step 1: Inventory by product (seller list on the product page, ordered
+-- by price; summary refresh). Covering, so the seller list is index-only.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS inventory_product_price_idx
+    ON Inventory (product_id, price) INCLUDE (seller_id, quantity);
+
+-- Step 2: In-stock offers only (Cart.get_default_seller)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS inventory_in_stock_idx
+    ON Inventory (product_id, price) WHERE quantity > 0;
+
+-- Step 3: Ledger by seller and status (seller orders, badges, profit)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ledger_seller_status_idx
+    ON Ledger (seller_id, fulfillment_status);
+
+-- Step 4: A buyer's purchases, newest first (order history)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS purchases_buyer_date_idx
+    ON Purchases (buyer_id, date DESC);
+
+-- Step 5: Category browse, ordered by name
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_category_name_idx
+    ON Products (category, name);
+
+-- Refresh planner statistics so the new indexes get used right away
+ANALYZE Inventory;
+ANALYZE Ledger;
+ANALYZE Purchases;
+ANALYZE Products;
@@ -0,0 +1,18 @@
+-- Migration script to add short-lived stock reservations: units a
+-- buyer's cart holds for a few minutes (CART_RESERVATION_SECONDS), which
+-- other buyers' checkouts and reservations cannot take. Expired rows are
+-- ignored by every query and deleted by the app's sweeper thread.
+
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    account_id INT NOT NULL,
+    product_id INT NOT NULL,
+    seller_id INT NOT NULL,
+    quantity INT NOT NULL CHECK (quantity > 0),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (account_id, product_id, seller_id),
+    FOREIGN KEY (account_id) REFERENCES Users(id),
+    FOREIGN KEY (seller_id, product_id) REFERENCES Inventory(seller_id, product_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS stock_reservations_item_idx ON stock_reservations (product_id, seller_id, expires_at);
+CREATE INDEX IF NOT EXISTS stock_reservations_expires_idx ON stock_reservations (expires_at);
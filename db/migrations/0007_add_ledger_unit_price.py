@@ -0,0 +1,61 @@
+"""Migration to capture each Ledger line's price: unit_price and
+line_total (quantity * unit_price) as charged at checkout, so order
+history and totals stop joining the current Inventory row (whose price
+may have changed, or which may be gone).
+
+Existing lines get the listing's current price, the best record there
+is, or 0 where the listing was removed, matching what the history pages
+showed before. Each step is safe to re-run after a failure.
+"""
+
+
+def upgrade(m):
+    # Step 1: Nullable columns without a default: a catalog-only change,
+    # no table rewrite
+    m.execute('ALTER TABLE Ledger ADD COLUMN IF NOT EXISTS unit_price DECIMAL(12,2)')
+    m.execute('ALTER TABLE Ledger ADD COLUMN IF NOT EXISTS line_total DECIMAL(14,2)')
+
+    # Step 2: Index the rows still to fill, so each batch finds them
+    # without rescanning the part of the table already done
+    m.execute('''
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ledger_unit_price_missing_idx
+        ON Ledger (purchase_id, seller_id, product_id) WHERE unit_price IS NULL
+    ''')
+
+    # Step 3: Backfill in short transactions. Lines written meanwhile by
+    # an app version that doesn't set the price are picked up too.
+    m.backfill('''
+        WITH batch AS (
+            SELECT purchase_id, seller_id, product_id
+            FROM Ledger
+            WHERE unit_price IS NULL
+            LIMIT :batch_size
+        )
+        UPDATE Ledger l
+        SET unit_price = COALESCE(i.price, 0),
+            line_total = COALESCE(i.price, 0) * l.quantity
+        FROM batch b
+        LEFT JOIN Inventory i ON i.seller_id = b.seller_id AND i.product_id = b.product_id
+        WHERE l.purchase_id = b.purchase_id
+          AND l.seller_id = b.seller_id
+          AND l.product_id = b.product_id
+    ''')
+    m.execute('DROP INDEX CONCURRENTLY IF EXISTS ledger_unit_price_missing_idx')
+
+    # Step 4: NOT NULL without a long exclusive lock: a NOT VALID check is
+    # validated under a lock that lets reads and writes go on, and SET NOT
+    # NULL then trusts it instead of scanning the table again
+    for column in ('unit_price', 'line_total'):
+        m.execute(f'''
+            DO $$ BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ledger_{column}_not_null') THEN
+                    ALTER TABLE Ledger ADD CONSTRAINT ledger_{column}_not_null
+                        CHECK ({column} IS NOT NULL) NOT VALID;
+                END IF;
+            END $$
+        ''')
+        m.execute(f'ALTER TABLE Ledger VALIDATE CONSTRAINT ledger_{column}_not_null')
+        m.execute(f'ALTER TABLE Ledger ALTER COLUMN {column} SET NOT NULL')
+        m.execute(f'ALTER TABLE Ledger DROP CONSTRAINT ledger_{column}_not_null')
+
+    m.execute('ANALYZE Ledger')
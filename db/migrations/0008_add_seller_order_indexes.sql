@@ -0,0 +1,19 @@
+-- migrate: no-transaction
+-- Migration script to serve the seller orders page from the index: lines
+-- are filtered by seller (and status) and paged newest first by
+-- (purchase_id, product_id), so both orderings get an index that hands
+-- them back already sorted and the page stops after LIMIT rows.
+--
+-- Step 1: Seller + status, then the page order. Also serves the badge
+-- counts (index-only), so it replaces ledger_seller_status_idx.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ledger_seller_status_order_idx
+    ON Ledger (seller_id, fulfillment_status, purchase_id, product_id);
+
+-- Step 2: Seller, then the page order (the unfiltered "All" view)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ledger_seller_order_idx
+    ON Ledger (seller_id, purchase_id, product_id);
+
+-- Step 3: The old index is a prefix of the one from step 1
+DROP INDEX CONCURRENTLY IF EXISTS ledger_seller_status_idx;
+
+ANALYZE Ledger;
@@ -0,0 +1,90 @@
+-- Migration script to add user_stats: per-user lifetime totals as buyer
+-- and seller, kept up to date by checkout and fulfillment, so the
+-- profile and seller pages stop aggregating Ledger on every load.
+--
+-- The table starts empty. Fill it once the app version that maintains it
+-- is deployed:
+--
+--     python db/user_stats.py rebuild
+--
+-- which recomputes it from Ledger in batches and is safe to run against
+-- live traffic (see refresh_user_stats).
+
+-- Per-user lifetime totals, as buyer and as seller, so the profile and
+-- the seller pages never aggregate Ledger. Checkout and fulfillment
+-- (app/models/user_stats.py) keep it up to date in their own
+-- transactions; refresh_user_stats recomputes rows from Ledger (see
+-- db/user_stats.py rebuild/verify).
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INT PRIMARY KEY,
+    orders_placed INT NOT NULL DEFAULT 0,              -- purchases made
+    total_spent DECIMAL(14,2) NOT NULL DEFAULT 0,
+    orders_sold INT NOT NULL DEFAULT 0,                -- purchases with a line sold by the user
+    lines_sold INT NOT NULL DEFAULT 0,
+    units_sold BIGINT NOT NULL DEFAULT 0,
+    total_revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    lines_pending INT NOT NULL DEFAULT 0,              -- lines sold, not yet fulfilled
+    FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+);
+
+-- user_stats rows for the given users, computed from Purchases and Ledger.
+CREATE OR REPLACE FUNCTION compute_user_stats(uids INT[])
+RETURNS TABLE (user_id INT, orders_placed INT, total_spent DECIMAL(14,2), orders_sold INT,
+               lines_sold INT, units_sold BIGINT, total_revenue DECIMAL(14,2), lines_pending INT) AS $$
+    WITH bought AS (
+        SELECT p.buyer_id AS user_id, COUNT(DISTINCT p.purchase_id) AS orders, SUM(l.line_total) AS spent
+        FROM Purchases p
+        JOIN Ledger l ON l.purchase_id = p.purchase_id
+        WHERE p.buyer_id = ANY(uids)
+        GROUP BY p.buyer_id
+    ), sold AS (
+        SELECT l.seller_id AS user_id,
+               COUNT(DISTINCT l.purchase_id) AS orders,
+               COUNT(*) AS lines,
+               SUM(l.quantity) AS units,
+               SUM(l.line_total) AS revenue,
+               COUNT(*) FILTER (WHERE l.fulfillment_status = 0) AS pending
+        FROM Ledger l
+        WHERE l.seller_id = ANY(uids)
+        GROUP BY l.seller_id
+    )
+    SELECT u.id,
+           COALESCE(b.orders, 0)::INT, COALESCE(b.spent, 0),
+           COALESCE(d.orders, 0)::INT, COALESCE(d.lines, 0)::INT, COALESCE(d.units, 0),
+           COALESCE(d.revenue, 0), COALESCE(d.pending, 0)::INT
+    FROM Users u
+    LEFT JOIN bought b ON b.user_id = u.id
+    LEFT JOIN sold d ON d.user_id = u.id
+    WHERE u.id = ANY(uids)
+$$ LANGUAGE sql STABLE;
+
+-- Recompute the stats rows of the given users; returns how many.
+-- Safe alongside live checkouts: the rows are created and locked (in id
+-- order) before anything is counted, so a checkout either commits before
+-- the count (and is in it) or waits and adds its increment afterwards.
+CREATE OR REPLACE FUNCTION refresh_user_stats(uids INT[]) RETURNS INT AS $$
+DECLARE
+    refreshed INT;
+BEGIN
+    INSERT INTO user_stats (user_id)
+    SELECT id FROM Users WHERE id = ANY(uids)
+    ORDER BY id
+    ON CONFLICT (user_id) DO NOTHING;
+
+    PERFORM 1 FROM user_stats WHERE user_id = ANY(uids) ORDER BY user_id FOR UPDATE;
+
+    UPDATE user_stats s
+    SET orders_placed = c.orders_placed,
+        total_spent = c.total_spent,
+        orders_sold = c.orders_sold,
+        lines_sold = c.lines_sold,
+        units_sold = c.units_sold,
+        total_revenue = c.total_revenue,
+        lines_pending = c.lines_pending
+    FROM compute_user_stats(uids) c
+    WHERE s.user_id = c.user_id;
+
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+    RETURN refreshed;
+END;
+$$ LANGUAGE plpgsql;
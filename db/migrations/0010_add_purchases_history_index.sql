@@ -0,0 +1,14 @@
+-- migrate: no-transaction
+-- Migration script to page the profile order history from the index: a
+-- buyer's purchases are listed newest first by (date, purchase_id), with
+-- the purchase id breaking ties between purchases placed at the same
+-- moment, so the keyset needs both columns in the index.
+--
+-- Step 1: Buyer, then the page order
+CREATE INDEX CONCURRENTLY IF NOT EXISTS purchases_buyer_date_id_idx
+    ON Purchases (buyer_id, date DESC, purchase_id DESC);
+
+-- Step 2: The old index is a prefix of the new one
+DROP INDEX CONCURRENTLY IF EXISTS purchases_buyer_date_idx;
+
+ANALYZE Purchases;
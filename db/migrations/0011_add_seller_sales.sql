@@ -0,0 +1,106 @@
+-- migrate: no-transaction
+-- Migration script to add the seller sales rollups behind
+-- /seller/analytics: revenue, units and orders per seller per day (and
+-- per product), added to by checkout, so a chart over a year reads at
+-- most a few hundred rows per seller instead of joining all of the
+-- seller's Ledger lines to Purchases.
+--
+-- The tables start empty. Fill them once the app version that maintains
+-- them is deployed:
+--
+--     python db/seller_sales.py rebuild
+--
+-- which recomputes them from Ledger a few days at a time and is safe to
+-- run against live traffic (see refresh_seller_sales). Every statement
+-- can be re-run.
+
+-- Step 1: A BRIN index on the purchase date, for the range scans of the
+-- rebuild and of the analytics page's raw mode. Purchases are inserted in
+-- date order, so a few pages of summaries stand in for a B-tree.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS purchases_date_brin
+    ON Purchases USING brin (date);
+
+-- Step 2: The rollup tables and the functions that recompute them
+-- Sales per seller per day (UTC), and per seller, day and product, so the
+-- seller analytics page sums a few hundred rows instead of scanning
+-- Ledger. Checkout (app/models/seller_sales.py) adds each purchase in its
+-- own transaction; refresh_seller_sales recomputes a range of days from
+-- Ledger (see db/seller_sales.py rebuild/verify). Rows arrive in day
+-- order, so a BRIN index on day is enough for the range scans across
+-- sellers.
+CREATE TABLE IF NOT EXISTS seller_sales_daily (
+    seller_id INT NOT NULL,
+    day DATE NOT NULL,
+    orders INT NOT NULL DEFAULT 0,                     -- purchases with a line sold by the seller
+    lines INT NOT NULL DEFAULT 0,
+    units BIGINT NOT NULL DEFAULT 0,
+    revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (seller_id, day),
+    FOREIGN KEY (seller_id) REFERENCES Users(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS seller_sales_daily_day_brin ON seller_sales_daily USING brin (day);
+
+CREATE TABLE IF NOT EXISTS seller_product_sales_daily (
+    seller_id INT NOT NULL,
+    day DATE NOT NULL,
+    product_id INT NOT NULL,
+    orders INT NOT NULL DEFAULT 0,
+    units BIGINT NOT NULL DEFAULT 0,
+    revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (seller_id, day, product_id),
+    FOREIGN KEY (seller_id) REFERENCES Users(id) ON DELETE CASCADE,
+    FOREIGN KEY (product_id) REFERENCES Products(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS seller_product_sales_daily_day_brin ON seller_product_sales_daily USING brin (day);
+
+-- seller_sales_daily rows for days in [from_day, to_day), computed from
+-- Purchases and Ledger.
+CREATE OR REPLACE FUNCTION compute_seller_sales_daily(from_day DATE, to_day DATE)
+RETURNS TABLE (seller_id INT, day DATE, orders INT, lines INT, units BIGINT, revenue DECIMAL(14,2)) AS $$
+    SELECT l.seller_id, (p.date AT TIME ZONE 'UTC')::DATE,
+           COUNT(DISTINCT l.purchase_id)::INT, COUNT(*)::INT, SUM(l.quantity), SUM(l.line_total)
+    FROM Purchases p
+    JOIN Ledger l ON l.purchase_id = p.purchase_id
+    WHERE p.date >= from_day::TIMESTAMP AT TIME ZONE 'UTC'
+      AND p.date < to_day::TIMESTAMP AT TIME ZONE 'UTC'
+    GROUP BY 1, 2
+$$ LANGUAGE sql STABLE;
+
+-- seller_product_sales_daily rows for days in [from_day, to_day).
+CREATE OR REPLACE FUNCTION compute_seller_product_sales_daily(from_day DATE, to_day DATE)
+RETURNS TABLE (seller_id INT, day DATE, product_id INT, orders INT, units BIGINT, revenue DECIMAL(14,2)) AS $$
+    SELECT l.seller_id, (p.date AT TIME ZONE 'UTC')::DATE, l.product_id,
+           COUNT(*)::INT, SUM(l.quantity), SUM(l.line_total)
+    FROM Purchases p
+    JOIN Ledger l ON l.purchase_id = p.purchase_id
+    WHERE p.date >= from_day::TIMESTAMP AT TIME ZONE 'UTC'
+      AND p.date < to_day::TIMESTAMP AT TIME ZONE 'UTC'
+    GROUP BY 1, 2, 3
+$$ LANGUAGE sql STABLE;
+
+-- Recompute both tables for days in [from_day, to_day); returns how many
+-- seller_sales_daily rows that makes. Safe alongside live checkouts: the
+-- tables are locked against writes first, so checkouts that already
+-- added to them are committed (and counted), and the rest wait and add
+-- their purchase afterwards.
+CREATE OR REPLACE FUNCTION refresh_seller_sales(from_day DATE, to_day DATE) RETURNS INT AS $$
+DECLARE
+    refreshed INT;
+BEGIN
+    LOCK TABLE seller_sales_daily, seller_product_sales_daily IN EXCLUSIVE MODE;
+
+    DELETE FROM seller_sales_daily WHERE day >= from_day AND day < to_day;
+    DELETE FROM seller_product_sales_daily WHERE day >= from_day AND day < to_day;
+
+    INSERT INTO seller_sales_daily (seller_id, day, orders, lines, units, revenue)
+    SELECT * FROM compute_seller_sales_daily(from_day, to_day);
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+
+    INSERT INTO seller_product_sales_daily (seller_id, day, product_id, orders, units, revenue)
+    SELECT * FROM compute_seller_product_sales_daily(from_day, to_day);
+
+    RETURN refreshed;
+END;
+$$ LANGUAGE plpgsql;
+
+ANALYZE Purchases;
@@ -0,0 +1,28 @@
+-- Migration script to stop seller sales rebuilds from stalling every
+-- checkout: refresh_seller_sales (migration 0011) locked both rollup
+-- tables against writes for the whole batch, whatever days it covered.
+-- It now takes an advisory lock per UTC day in its range instead, which
+-- checkout takes in shared mode for its purchase's day, so only
+-- checkouts on the days being rebuilt wait.
+
+CREATE OR REPLACE FUNCTION refresh_seller_sales(from_day DATE, to_day DATE) RETURNS INT AS $$
+DECLARE
+    refreshed INT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('seller_sales_daily'), d::DATE - DATE '2000-01-01')
+    FROM generate_series(from_day::TIMESTAMP, (to_day - 1)::TIMESTAMP, INTERVAL '1 day') AS g(d)
+    ORDER BY d;
+
+    DELETE FROM seller_sales_daily WHERE day >= from_day AND day < to_day;
+    DELETE FROM seller_product_sales_daily WHERE day >= from_day AND day < to_day;
+
+    INSERT INTO seller_sales_daily (seller_id, day, orders, lines, units, revenue)
+    SELECT * FROM compute_seller_sales_daily(from_day, to_day);
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+
+    INSERT INTO seller_product_sales_daily (seller_id, day, product_id, orders, units, revenue)
+    SELECT * FROM compute_seller_product_sales_daily(from_day, to_day);
+
+    RETURN refreshed;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,38 @@
+-- Migration script to stop concurrent listing changes from leaving a
+-- stale product_offer_summary row: refresh_product_offer_summary
+-- (migration 0003) aggregated Inventory in the same statement that
+-- overwrote the row, so at READ COMMITTED a transaction queued behind
+-- another wrote totals from a snapshot missing the other's changes.
+-- It now creates and locks the rows first and aggregates afterwards, in
+-- a statement that sees every change committed while it waited.
+
+CREATE OR REPLACE FUNCTION refresh_product_offer_summary(pids INT[]) RETURNS void AS $$
+BEGIN
+    INSERT INTO product_offer_summary (product_id, min_price, max_price, seller_count, total_stock)
+    SELECT DISTINCT product_id, 0, 0, 0, 0
+    FROM Inventory
+    WHERE product_id = ANY(pids)
+    ORDER BY product_id
+    ON CONFLICT (product_id) DO NOTHING;
+
+    PERFORM 1 FROM product_offer_summary WHERE product_id = ANY(pids) ORDER BY product_id FOR UPDATE;
+
+    UPDATE product_offer_summary s
+    SET min_price = c.min_price,
+        max_price = c.max_price,
+        seller_count = c.seller_count,
+        total_stock = c.total_stock
+    FROM (
+        SELECT product_id, MIN(price) AS min_price, MAX(price) AS max_price,
+               COUNT(*) AS seller_count, SUM(quantity) AS total_stock
+        FROM Inventory
+        WHERE product_id = ANY(pids)
+        GROUP BY product_id
+    ) c
+    WHERE s.product_id = c.product_id;
+
+    DELETE FROM product_offer_summary s
+    WHERE s.product_id = ANY(pids)
+      AND NOT EXISTS (SELECT 1 FROM Inventory i WHERE i.product_id = s.product_id);
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,113 @@
+"""Rebuild or verify the seller sales rollups from Ledger and Purchases.
+
+Checkout keeps seller_sales_daily and seller_product_sales_daily up to
+date as it goes; this recomputes them, a range of days per transaction,
+for the first fill after migration 0011 or to repair drift:
+
+    python db/seller_sales.py rebuild                # every day with a purchase
+    python db/seller_sales.py rebuild --days 30      # days per transaction
+    python db/seller_sales.py verify                 # exit 1 if any row is off
+
+rebuild is safe against live traffic (see refresh_seller_sales in
+create.sql): each batch locks just its own days, so only checkouts
+landing on those days (in practice, today's) wait while it runs.
+verify compares each batch with a fresh computation in one snapshot.
+"""
+import argparse
+import sys
+import time
+from datetime import timedelta
+
+from sqlalchemy import create_engine, text
+
+from migrate import database_url
+
+# (table, compute function, key columns, value columns)
+ROLLUPS = [
+    ('seller_sales_daily', 'compute_seller_sales_daily',
+     ('seller_id', 'day'), ('orders', 'lines', 'units', 'revenue')),
+    ('seller_product_sales_daily', 'compute_seller_product_sales_daily',
+     ('seller_id', 'day', 'product_id'), ('orders', 'units', 'revenue')),
+]
+
+
+def day_batches(engine, days):
+    """[start, end) ranges of `days` days covering every purchase (UTC)."""
+    with engine.connect() as conn:
+        first, last = conn.execute(text('''
+            SELECT MIN(date AT TIME ZONE 'UTC')::DATE, MAX(date AT TIME ZONE 'UTC')::DATE
+            FROM Purchases
+        ''')).one()
+    if first is None:
+        return
+    start = first
+    while start <= last:
+        yield start, start + timedelta(days=days)
+        start += timedelta(days=days)
+
+
+def rebuild(engine, days):
+    total = 0
+    started = time.monotonic()
+    for start, end in day_batches(engine, days):
+        with engine.connect().execution_options(isolation_level='READ COMMITTED') as conn:
+            with conn.begin():
+                total += conn.execute(text('SELECT refresh_seller_sales(:start, :end)'),
+                                      {'start': start, 'end': end}).scalar()
+        print(f'  through {end - timedelta(days=1)}: {total} seller-days '
+              f'({total / (time.monotonic() - started):.0f}/s)', flush=True)
+    print(f'rebuilt {total} seller-days')
+    return 0
+
+
+def verify(engine, days, show=20):
+    """Report rollup rows that differ from Ledger (missing and extra rows included)."""
+    differences = []
+    for start, end in day_batches(engine, days):
+        with engine.connect().execution_options(isolation_level='REPEATABLE READ',
+                                                postgresql_readonly=True) as conn:
+            with conn.begin():
+                for table, compute, keys, values in ROLLUPS:
+                    join = ' AND '.join(f'c.{k} = s.{k}' for k in keys)
+                    compare = ' OR '.join(f'c.{v} IS DISTINCT FROM s.{v}' for v in values)
+                    rows = conn.execute(text(f'''
+                        SELECT {', '.join(f'COALESCE(c.{k}, s.{k})' for k in keys)},
+                               {', '.join(f'c.{v}, s.{v}' for v in values)}
+                        FROM {compute}(:start, :end) c
+                        FULL JOIN (
+                            SELECT * FROM {table} WHERE day >= :start AND day < :end
+                        ) s ON {join}
+                        WHERE {compare}
+                        ORDER BY {', '.join(str(i + 1) for i in range(len(keys)))}
+                    '''), {'start': start, 'end': end}).fetchall()
+                    differences += [(table, keys, values, row) for row in rows]
+    for table, keys, values, row in differences[:show]:
+        key = ', '.join(f'{k} {row[i]}' for i, k in enumerate(keys))
+        fields = [f'{v} {row[len(keys) + 2 * i + 1]} != {row[len(keys) + 2 * i]}'
+                  for i, v in enumerate(values)
+                  if row[len(keys) + 2 * i] != row[len(keys) + 2 * i + 1]]
+        print(f'{table} ({key}): stored ' + ', '.join(fields))
+    if len(differences) > show:
+        print(f'... and {len(differences) - show} more')
+    print(f'{len(differences)} rollup row(s) out of date')
+    return 1 if differences else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild or verify the seller sales rollups from Ledger.')
+    parser.add_argument('command', choices=['rebuild', 'verify'])
+    parser.add_argument('--days', type=int, default=7, help='days per transaction (default 7)')
+    parser.add_argument('--url', help='database URL (default: from .flaskenv)')
+    args = parser.parse_args()
+
+    engine = create_engine(args.url or database_url())
+    try:
+        if args.command == 'rebuild':
+            return rebuild(engine, args.days)
+        return verify(engine, args.days)
+    finally:
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
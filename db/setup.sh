@@ -19,10 +19,17 @@ fi
 psql -c "CREATE DATABASE $dbname"
 
 psql -af create.sql $dbname
+# create.sql is the full current schema: mark every migration as applied
+python $mybase/migrate.py baseline
 cd $datadir
 
 echo "Running from: $(pwd)"
 echo "Files here:"
 ls -l
 
-psql -af $mybase/load.sql $dbname
\ No newline at end of file
+if [ -f manifest.json ]; then
+    # Bulk data from generated/gen_bulk.py: parallel COPY loader
+    python $mybase/load.py .
+else
+    psql -af $mybase/load.sql $dbname
+fi
\ No newline at end of file
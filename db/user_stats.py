@@ -0,0 +1,101 @@
+"""Rebuild or verify the user_stats table from Ledger and Purchases.
+
+Checkout and fulfillment keep user_stats up to date as they go; this
+recomputes it, a batch of users per transaction (by id), for the first
+fill after migration 0009 or to repair drift:
+
+    python db/user_stats.py rebuild                  # recompute every user
+    python db/user_stats.py rebuild --batch-size 500
+    python db/user_stats.py verify                   # exit 1 if any row is off
+
+rebuild is safe against live traffic (see refresh_user_stats in
+create.sql). verify compares each batch with a fresh computation in one
+snapshot, so checkouts committing meanwhile are not reported as drift.
+"""
+import argparse
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+
+from migrate import database_url
+
+FIELDS = ('orders_placed', 'total_spent', 'orders_sold', 'lines_sold',
+          'units_sold', 'total_revenue', 'lines_pending')
+
+
+def user_batches(engine, batch_size):
+    """Lists of up to batch_size user ids, in id order."""
+    after = None
+    while True:
+        with engine.connect() as conn:
+            ids = conn.execute(text('''
+                SELECT id FROM Users
+                WHERE :after IS NULL OR id > :after
+                ORDER BY id
+                LIMIT :batch_size
+            '''), {'after': after, 'batch_size': batch_size}).scalars().all()
+        if not ids:
+            return
+        yield ids
+        after = ids[-1]
+
+
+def rebuild(engine, batch_size):
+    total = 0
+    started = time.monotonic()
+    for ids in user_batches(engine, batch_size):
+        with engine.connect().execution_options(isolation_level='READ COMMITTED') as conn:
+            with conn.begin():
+                total += conn.execute(text('SELECT refresh_user_stats(:ids)'), {'ids': ids}).scalar()
+        print(f'  {total} users ({total / (time.monotonic() - started):.0f} users/s)', flush=True)
+    print(f'rebuilt user_stats for {total} users')
+    return 0
+
+
+def verify(engine, batch_size, show=20):
+    """Report users whose stored row differs from Ledger (a missing row counts as zeros)."""
+    differences = []
+    checked = 0
+    compare = ' OR '.join(f'c.{f} IS DISTINCT FROM COALESCE(s.{f}, 0)' for f in FIELDS)
+    for ids in user_batches(engine, batch_size):
+        with engine.connect().execution_options(isolation_level='REPEATABLE READ',
+                                                postgresql_readonly=True) as conn:
+            with conn.begin():
+                rows = conn.execute(text(f'''
+                    SELECT c.user_id, {', '.join(f'c.{f}, s.{f}' for f in FIELDS)}
+                    FROM compute_user_stats(:ids) c
+                    LEFT JOIN user_stats s ON s.user_id = c.user_id
+                    WHERE {compare}
+                    ORDER BY c.user_id
+                '''), {'ids': ids}).fetchall()
+        checked += len(ids)
+        differences += rows
+    for row in differences[:show]:
+        fields = [f'{f} {row[2 + 2 * i]} != {row[1 + 2 * i]}'
+                  for i, f in enumerate(FIELDS) if row[1 + 2 * i] != (row[2 + 2 * i] or 0)]
+        print(f'user {row[0]}: stored ' + ', '.join(fields))
+    if len(differences) > show:
+        print(f'... and {len(differences) - show} more')
+    print(f'checked {checked} users, {len(differences)} out of date')
+    return 1 if differences else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild or verify user_stats from Ledger.')
+    parser.add_argument('command', choices=['rebuild', 'verify'])
+    parser.add_argument('--batch-size', type=int, default=1000, help='users per transaction (default 1000)')
+    parser.add_argument('--url', help='database URL (default: from .flaskenv)')
+    args = parser.parse_args()
+
+    engine = create_engine(args.url or database_url())
+    try:
+        if args.command == 'rebuild':
+            return rebuild(engine, args.batch_size)
+        return verify(engine, args.batch_size)
+    finally:
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    sys.exit(main())